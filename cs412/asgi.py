@@ -3,6 +3,13 @@ ASGI config for cs412 project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+With DJANGO_ASYNC_VIEWS=1 the mini_fb read pages are served by the async views
+in mini_fb/async_views.py. Run it with uvicorn workers under gunicorn:
+
+    DJANGO_ASYNC_VIEWS=1 gunicorn cs412.asgi -k uvicorn.workers.UvicornWorker
+
+Compare the two modes with ``python manage.py benchmark_server_modes``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -0,0 +1,163 @@
+"""
+Serving of the uploaded files under MEDIA_ROOT.
+
+Static files are served by WhiteNoise; uploads are not known when WhiteNoise
+scans the static files, so they are served by this view, with the same
+caching behaviour: validators (ETag, Last-Modified), Range requests, and
+far-future, immutable caching for content-addressed files. Under WSGI, whole
+files are returned as a FileResponse, which the server may send with
+sendfile(); under ASGI, files are read a chunk at a time, see streaming.py.
+"""
+
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .streaming import streaming_content
+
+# files stored by mini_fb.storage.ContentAddressedStorage, originals and their
+# variants alike, never change: their name holds the SHA-256 of their content
+CONTENT_ADDRESSED = re.compile(
+    r"^([0-9a-f]{2})/([0-9a-f]{2})/(?P<address>\1\2[0-9a-f]{60})(\.\w+)?$"
+)
+
+# the files ContentAddressedStorage is still writing or is deleting
+UNFINISHED_SUFFIXES = (".upload", ".deleting")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# bytes read at a time when streaming part of a file
+CHUNK_SIZE = 64 * 1024
+
+
+def read_range(path, start, length):
+    """
+    yield length bytes of the file at path, from offset start
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def is_servable(path):
+    """
+    return whether the file at path under MEDIA_ROOT is a finished upload:
+    a content-addressed file, or an image stored under its own name at the top
+    of MEDIA_ROOT before uploads were content-addressed
+    """
+    if path.endswith(UNFINISHED_SUFFIXES):
+        return False
+    if CONTENT_ADDRESSED.match(path):
+        return True
+    content_type = mimetypes.guess_type(path)[0] or ""
+    return "/" not in path and content_type.startswith("image/")
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    return the file at path under MEDIA_ROOT
+    """
+    if not is_servable(path):
+        raise Http404("No such media file.")
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stats = os.stat(full_path)
+    except (SuspiciousFileOperation, ValueError, OSError):
+        raise Http404("No such media file.")
+    if not stat.S_ISREG(stats.st_mode):
+        raise Http404("No such media file.")
+
+    # a content-addressed file is touched when it is uploaded again, so its
+    # validator is its address rather than its mtime
+    content_addressed = CONTENT_ADDRESSED.match(path)
+    if content_addressed:
+        etag = f'"{content_addressed["address"]}"'
+    else:
+        etag = f'"{stats.st_size:x}-{stats.st_mtime_ns:x}"'
+    last_modified = http_date(stats.st_mtime)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": (
+            IMMUTABLE_CACHE_CONTROL if content_addressed else DEFAULT_CACHE_CONTROL
+        ),
+    }
+
+    # answer conditional requests for a copy the client already has
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or (
+            if_none_match.strip() == "*"
+        ):
+            return HttpResponseNotModified(headers=headers)
+    else:
+        since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+        if since is not None and int(stats.st_mtime) <= since:
+            return HttpResponseNotModified(headers=headers)
+
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    size = stats.st_size
+
+    # serve a single byte range, unless If-Range says the file has changed
+    match = RANGE.match(request.headers.get("Range", ""))
+    if match and request.headers.get("If-Range", etag) in (etag, last_modified):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        elif last:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start, end = 0, -1
+
+        if start > end:
+            return HttpResponse(
+                status=416, headers={**headers, "Content-Range": f"bytes */{size}"}
+            )
+
+        response = StreamingHttpResponse(
+            streaming_content(request, read_range(full_path, start, end - start + 1)),
+            status=206,
+            content_type=content_type,
+            headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"},
+        )
+        response["Content-Length"] = str(end - start + 1)
+        return response
+
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            streaming_content(request, read_range(full_path, 0, size)),
+            content_type=content_type,
+            headers=headers,
+        )
+        response["Content-Length"] = str(size)
+        return response
+
+    return FileResponse(
+        open(full_path, "rb"), content_type=content_type, headers=headers
+    )
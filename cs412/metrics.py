@@ -0,0 +1,241 @@
+"""
+Per-request instrumentation: the number of SQL queries, the time spent in SQL
+and in rendering templates, the total duration and the response size.
+
+RequestMetricsMiddleware records every request under its resolved URL name
+("mini_fb:show_newsfeed", ...), logs one JSON line per request to the
+"cs412.metrics" logger, and warns when a view exceeds its budget in
+REQUEST_METRICS_BUDGETS. The most recent samples of each view are kept in
+memory and summarized as percentiles by metrics_view. Each server process
+keeps its own samples.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_safe
+
+logger = logging.getLogger("cs412.metrics")
+
+METRICS = ["queries", "sql_ms", "template_ms", "duration_ms", "response_bytes"]
+
+# the sample of the request being handled, followed into sync_to_async threads
+_current_sample = ContextVar("request_metrics_sample", default=None)
+
+
+def percentile(sorted_values, fraction):
+    """
+    return the value below which fraction of the sorted values fall
+    """
+    if not sorted_values:
+        return None
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class MetricsStore:
+    """
+    The most recent samples of each view, kept in memory
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        forget every sample
+        """
+        size = getattr(settings, "REQUEST_METRICS_SAMPLES", 1000)
+        with self.lock:
+            self.samples = defaultdict(lambda: deque(maxlen=size))
+
+    def add(self, view_name, sample):
+        """
+        record the sample of a request to view_name
+        """
+        with self.lock:
+            self.samples[view_name].append(sample)
+
+    def summary(self):
+        """
+        return the request count and the p50/p95/p99 of every metric, per view
+        """
+        with self.lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+
+        summary = {}
+        for name, values in sorted(samples.items()):
+            summary[name] = {"requests": len(values)}
+            for metric in METRICS:
+                measured = sorted(s[metric] for s in values if s[metric] is not None)
+                summary[name][metric] = {
+                    f"p{p}": percentile(measured, p / 100) for p in (50, 95, 99)
+                }
+        return summary
+
+
+store = MetricsStore()
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    database execute wrapper counting the queries and SQL time of the current request
+    """
+    sample = _current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample["queries"] += 1
+        sample["sql_ms"] += (time.perf_counter() - start) * 1000
+
+
+def instrument(connection):
+    """
+    install record_query on a database connection, once
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def instrument_new_connection(sender, connection, **kwargs):
+    instrument(connection)
+
+
+def check_budget(view_name, sample):
+    """
+    log a warning for every metric of sample over the budget of view_name
+    """
+    budget = getattr(settings, "REQUEST_METRICS_BUDGETS", {}).get(view_name, {})
+    exceeded = {
+        metric: {"value": sample[metric], "budget": limit}
+        for metric, limit in budget.items()
+        if sample.get(metric) is not None and sample[metric] > limit
+    }
+    if exceeded:
+        logger.warning(
+            "%s exceeded its budget: %s",
+            view_name,
+            json.dumps(exceeded),
+            extra={"view": view_name, "exceeded": exceeded},
+        )
+
+
+class RequestMetricsMiddleware:
+    """
+    Middleware that measures every request, see the module docstring
+    should come first, so the time of the other middleware is included
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # connections opened later, in any thread, are instrumented when created
+        connection_created.connect(instrument_new_connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        # connections this thread opened before the middleware existed
+        for connection in connections.all():
+            instrument(connection)
+
+        sample, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        return self.finish(request, response, sample)
+
+    async def __acall__(self, request):
+        sample, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        return self.finish(request, response, sample)
+
+    def start(self, request):
+        """
+        return a new sample for request, made the current one
+        """
+        sample = {
+            "queries": 0,
+            "sql_ms": 0.0,
+            "template_ms": None,
+            "duration_ms": None,
+            "response_bytes": None,
+            "started": time.perf_counter(),
+        }
+        return sample, _current_sample.set(sample)
+
+    def process_template_response(self, request, response):
+        """
+        time the rendering of a TemplateResponse
+        """
+        sample = _current_sample.get()
+        if sample is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                sample["template_ms"] = (time.perf_counter() - start) * 1000
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, sample):
+        """
+        complete, log and store the sample of request
+        """
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else "<unresolved>"
+
+        sample["duration_ms"] = (time.perf_counter() - sample.pop("started")) * 1000
+        if not response.streaming:
+            sample["response_bytes"] = len(response.content)
+        for metric in ["sql_ms", "template_ms", "duration_ms"]:
+            if sample[metric] is not None:
+                sample[metric] = round(sample[metric], 2)
+
+        logger.info(
+            json.dumps(
+                {
+                    "view": view_name,
+                    "method": request.method,
+                    "status": response.status_code,
+                    **sample,
+                }
+            )
+        )
+        store.add(view_name, sample)
+        check_budget(view_name, sample)
+        return response
+
+
+@require_safe
+def metrics_view(request):
+    """
+    return the percentiles of the metrics of every view, as JSON
+    only shown to staff users
+    """
+    if not request.user.is_staff:
+        raise Http404
+    return JsonResponse(store.summary())
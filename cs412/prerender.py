@@ -0,0 +1,87 @@
+"""
+Pages rendered ahead of time.
+
+The quotes and restaurant pages vary only in a random choice among a few
+inputs, the time they are generated at and the CSRF token of their forms.
+A PrerenderedPage renders its template once for every choice, with
+placeholders for the time and the token, and answers each request with one
+of the renderings, picked at random, with the placeholders filled in.
+The renderings are dropped when the development server sees a file change,
+so template edits show up as they used to.
+"""
+
+import random
+import threading
+import time
+
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import get_template
+from django.utils.autoreload import file_changed
+
+# stand-ins for the per-request values, left alone by HTML escaping
+CURRENT_TIME = "__PRERENDERED_CURRENT_TIME__"
+CSRF_TOKEN = "__PRERENDERED_CSRF_TOKEN__"
+
+# every PrerenderedPage, to drop their renderings on file changes
+_pages = []
+
+
+class PrerenderedPage:
+    """
+    The renderings of a template for each of a list of contexts
+    """
+
+    def __init__(self, template_name, contexts):
+        self.template_name = template_name
+        self.contexts = contexts
+        self.renderings = None
+        self.lock = threading.Lock()
+        _pages.append(self)
+
+    def get_renderings(self):
+        """
+        return the rendering of every context, made on first use
+        """
+        renderings = self.renderings
+        if renderings is None:
+            with self.lock:
+                if self.renderings is None:
+                    template = get_template(self.template_name)
+                    self.renderings = [
+                        template.render(
+                            {
+                                **context,
+                                "current_time": CURRENT_TIME,
+                                "csrf_token": CSRF_TOKEN,
+                            }
+                        )
+                        for context in self.contexts
+                    ]
+                renderings = self.renderings
+        return renderings
+
+    def clear(self):
+        """
+        drop the renderings, to render the template again on next use
+        """
+        self.renderings = None
+
+    def response(self, request):
+        """
+        return a response with a random rendering, completed for request
+        """
+        html = random.choice(self.get_renderings()).replace(CURRENT_TIME, time.ctime())
+        if CSRF_TOKEN in html:
+            html = html.replace(CSRF_TOKEN, get_token(request))
+        return HttpResponse(html)
+
+
+@receiver(file_changed)
+def clear_prerendered_pages(sender, file_path, **kwargs):
+    """
+    drop the renderings when the development server sees a file change
+    """
+    for page in _pages:
+        page.clear()
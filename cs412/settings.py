@@ -24,7 +24,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = "django-insecure-4r^)&l^pyzxfpnoqs96-1b^n%xy(o)5-$02sl)sexle!!drk+h"
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# DJANGO_DEBUG=0 turns it off for production
+DEBUG = os.environ.get("DJANGO_DEBUG", "1") == "1"
 
 ALLOWED_HOSTS = ["*"]
 
@@ -44,12 +45,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "cs412.metrics.RequestMetricsMiddleware",  # measures each request, see cs412/metrics.py
     "django.middleware.security.SecurityMiddleware",
-    # "whitenoise.middleware.WhiteNoiseMiddleware",  # Add whitenoise to deploy static files
+    "whitenoise.middleware.WhiteNoiseMiddleware",  # Add whitenoise to deploy static files
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "mini_fb.middleware.ProfileMiddleware",  # sets request.profile for the logged-in user
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -60,7 +63,6 @@ TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [],
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.debug",
@@ -68,6 +70,17 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
             ],
+            # compile each template once per process, in development too;
+            # the development server resets the cache when a template changes
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                )
+            ],
         },
     },
 ]
@@ -77,15 +90,129 @@ WSGI_APPLICATION = "cs412.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+# DJANGO_DATABASE selects the backend: "sqlite" (default) or "postgres".
+# DJANGO_DB_CONN_MAX_AGE keeps connections open between requests (seconds).
+
+DATABASE_BACKEND = os.environ.get("DJANGO_DATABASE", "sqlite")
+DB_CONN_MAX_AGE = int(os.environ.get("DJANGO_DB_CONN_MAX_AGE", 600))
+
+# tuning applied to every new SQLite connection:
+# WAL lets readers run alongside the single writer, synchronous=NORMAL is safe
+# with WAL and fsyncs only at checkpoints, mmap_size maps up to 256 MiB of the file,
+# busy_timeout waits for a lock instead of failing with "database is locked",
+# and a negative cache_size is in KiB (64 MiB of page cache)
+# journal_mode is stored in the database file: the committed db.sqlite3 is in WAL
+# mode already, so opening it does not rewrite the file
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+if DATABASE_BACKEND == "postgres":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DJANGO_DB_NAME", "cs412"),
+            "USER": os.environ.get("DJANGO_DB_USER", ""),
+            "PASSWORD": os.environ.get("DJANGO_DB_PASSWORD", ""),
+            "HOST": os.environ.get("DJANGO_DB_HOST", ""),
+            "PORT": os.environ.get("DJANGO_DB_PORT", ""),
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            # check a persistent connection is still usable before reusing it
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+
+    # DJANGO_DB_POOL_SIZE > 0 uses the psycopg connection pool of each worker
+    # instead of persistent connections (the two cannot be combined)
+    DB_POOL_SIZE = int(os.environ.get("DJANGO_DB_POOL_SIZE", 0))
+    if DB_POOL_SIZE:
+        from psycopg_pool import ConnectionPool
+
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"] = {
+            "pool": {
+                "min_size": 1,
+                "max_size": DB_POOL_SIZE,
+                "timeout": 10,
+                # health check when a connection is taken from the pool
+                "check": ConnectionPool.check_connection,
+            }
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("DJANGO_DB_NAME", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            "OPTIONS": {
+                "init_command": ";".join(
+                    f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()
+                ),
+                # take the write lock when a transaction starts, so it waits out
+                # busy_timeout rather than failing on its first write
+                "transaction_mode": "IMMEDIATE",
+                "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000,
+            },
+        }
+    }
+
 
-DATABASES = {
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# DJANGO_CACHE selects the backend: "file" (default), "locmem", "redis" or
+# "memcached", and DJANGO_CACHE_LOCATION overrides its directory or server address.
+# The version counters of the cached fragments (mini_fb.caching) must be seen by
+# every worker, or a worker keeps serving fragments another one has made stale:
+# locmem is private to each process, so it only suits a single-process server.
+
+CACHE_BACKENDS = {
+    "locmem": ("django.core.cache.backends.locmem.LocMemCache", "cs412"),
+    "file": (
+        "django.core.cache.backends.filebased.FileBasedCache",
+        os.path.join(BASE_DIR, "cache"),
+    ),
+    "redis": ("django.core.cache.backends.redis.RedisCache", "redis://127.0.0.1:6379"),
+    "memcached": (
+        "django.core.cache.backends.memcached.PyMemcacheCache",
+        "127.0.0.1:11211",
+    ),
+}
+
+CACHE_NAME = os.environ.get("DJANGO_CACHE", "file")
+CACHE_BACKEND, CACHE_LOCATION = CACHE_BACKENDS[CACHE_NAME]
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": CACHE_BACKEND,
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", CACHE_LOCATION),
     }
 }
 
 
+# Sessions and authentication
+# DJANGO_SESSION_ENGINE selects where sessions are kept: "db" (default) in the
+# database only, "cached_db" reads them from the cache and writes them through
+# to the database, "signed_cookies" keeps them in the client's cookie.
+# cached_db needs a cache every worker shares, or a logout in one worker does
+# not reach the sessions cached by the others.
+
+SESSION_ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}
+
+SESSION_ENGINE = SESSION_ENGINES[os.environ.get("DJANGO_SESSION_ENGINE", "db")]
+
+# the logged-in user is loaded from the cache, see mini_fb.auth
+AUTHENTICATION_BACKENDS = ["mini_fb.auth.CachedModelBackend"]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -130,9 +257,88 @@ STATICFILES_DIRS = [
 # Directory where static files will be collected during deployment (for production)
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
-MEDIA_ROOT = os.path.join(BASE_DIR, "media/")
+# collectstatic writes hashed file names plus gzip and brotli compressed copies,
+# which WhiteNoise serves with far-future cache headers
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "cs412.storage.StaticFilesStorage",
+    },
+}
+
+# look up files missing from the manifest, see cs412.storage.StaticFilesStorage
+WHITENOISE_MANIFEST_STRICT = False
+
+# DJANGO_MEDIA_ROOT moves the uploads, e.g. for the benchmark command
+MEDIA_ROOT = os.environ.get("DJANGO_MEDIA_ROOT", os.path.join(BASE_DIR, "media/"))
 MEDIA_URL = "/media/"
 
+# Seconds to keep the logged-in user's mini_fb Profile in the cache between requests,
+# 0 looks it up on every request
+MINI_FB_PROFILE_CACHE_TIMEOUT = 300
+
+# Seconds to keep the logged-in User in the cache between requests,
+# 0 looks it up on every request. Only a cache server shared by every worker
+# sees the invalidation of a password change or deactivation, so the users
+# are cached with redis or memcached only
+MINI_FB_USER_CACHE_TIMEOUT = 300 if CACHE_NAME in ["redis", "memcached"] else 0
+
+# Seconds during which a mini_fb media file that was just stored or uploaded
+# again is never deleted, since the row referencing it may not have committed
+MINI_FB_FILE_GRACE_PERIOD = 600
+
+# How mini_fb runs the work that follows its writes (news feed fan-out, image
+# variants, file sweeps): "database" queues it in the Task table for the
+# run_tasks worker command (the worker process of the Procfile), "inline" runs
+# it at the end of the request, without a worker. Without a worker running,
+# queued tasks never run, so the default is "inline" under DEBUG, for runserver;
+# inline mode drops the delayed file sweeps, see collect_orphaned_media.
+MINI_FB_TASK_QUEUE = os.environ.get(
+    "DJANGO_TASK_QUEUE", "inline" if DEBUG else "database"
+)
+
+# Serve the read-heavy mini_fb pages with async views, for the ASGI deployment
+# described in cs412/asgi.py
+MINI_FB_ASYNC_VIEWS = os.environ.get("DJANGO_ASYNC_VIEWS") == "1"
+
+# Restaurant orders are stored in batches by a background thread, once this many
+# are waiting or this many seconds have passed; an interval of 0 stores each
+# order during its request
+RESTAURANT_ORDER_BATCH_SIZE = 100
+RESTAURANT_ORDER_FLUSH_INTERVAL = 1.0
+# An order that fails to be stored this many times is logged and dropped
+RESTAURANT_ORDER_MAX_ATTEMPTS = 5
+
+# Number of recent requests per view whose metrics are kept for /metrics/
+REQUEST_METRICS_SAMPLES = 1000
+
+# Per-view limits on the metrics of cs412.metrics.RequestMetricsMiddleware,
+# a request over any of them logs a warning
+REQUEST_METRICS_BUDGETS = {
+    "mini_fb:show_all_profiles_view": {"queries": 5, "duration_ms": 200},
+    "mini_fb:show_profile": {"queries": 10, "duration_ms": 300},
+    "mini_fb:show_profile_for_user": {"queries": 10, "duration_ms": 300},
+    "mini_fb:show_newsfeed": {"queries": 10, "duration_ms": 300},
+    "mini_fb:friend_suggestions": {"queries": 10, "duration_ms": 300},
+}
+
+# The metrics of every request are logged as a JSON line at INFO, shown with
+# DJANGO_METRICS_LOG_LEVEL=INFO; by default only the requests over budget are
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "cs412.metrics": {
+            "handlers": ["console"],
+            "level": os.environ.get("DJANGO_METRICS_LOG_LEVEL", "WARNING"),
+            "propagate": False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -0,0 +1,18 @@
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    WhiteNoise's compressed, hashed static files storage, falling back to the
+    unhashed file name for files collectstatic has not processed yet, so pages
+    still render in development and tests before collectstatic has run
+    """
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            # only lookups fall back, collectstatic itself must find every file
+            if content is not None:
+                raise
+            return name
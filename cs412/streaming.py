@@ -0,0 +1,44 @@
+"""
+Streaming response bodies that are sent as they are generated under ASGI too.
+
+Under WSGI, a StreamingHttpResponse over a synchronous iterator sends each
+piece as soon as it is produced. Under ASGI, Django gathers a synchronous
+iterator into a list with a single sync_to_async call before sending any of
+it, so a large export or file would be held in memory whole. Under ASGI the
+iterator is therefore advanced one piece at a time in the sync thread, as an
+asynchronous iterator, which Django sends as it goes.
+"""
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+# returned by next() once the iterator is exhausted
+_DONE = object()
+
+
+async def iterate_in_sync_thread(iterator):
+    """
+    yield the non-empty pieces of the synchronous iterator, each produced by a
+    call in the sync thread, where the iterator's database connection lives
+    """
+    iterator = iter(iterator)
+    next_piece = sync_to_async(next)
+    try:
+        while (piece := await next_piece(iterator, _DONE)) is not _DONE:
+            if piece:
+                yield piece
+    finally:
+        # close generators early, for their files and cursors
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+def streaming_content(request, iterator):
+    """
+    return iterator as the content of a StreamingHttpResponse to request,
+    wrapped in an asynchronous iterator when request came in through ASGI
+    """
+    if isinstance(request, ASGIRequest):
+        return iterate_in_sync_thread(iterator)
+    return iterator
@@ -16,9 +16,11 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from .media import serve_media
+from .metrics import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -28,6 +30,8 @@ urlpatterns = [
     path("restaurant/", include("restaurant.urls")),
     # Include the URLs for the 'mini_fb' app
     path("mini_fb/", include("mini_fb.urls")),
-] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # percentiles of the per-view request metrics of this process
+    path("metrics/", metrics_view, name="metrics"),
+    # Static files are served by WhiteNoiseMiddleware, uploaded media by serve_media
+    re_path(rf"^{settings.MEDIA_URL.strip('/')}/(?P<path>.+)$", serve_media),
+]
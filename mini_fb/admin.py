@@ -1,9 +1,35 @@
 from django.contrib import admin
+from .deletion import delete_profiles, delete_status_messages
 from .models import Profile, StatusMessage, Image, Friend
 
+
 # Register your models here.
 # Register Profile model so that it can be managed through the Django Admin interface
-admin.site.register(Profile)
-admin.site.register(StatusMessage)
+@admin.register(Profile)
+class ProfileAdmin(admin.ModelAdmin):
+    """
+    profiles are deleted with their whole history in bulk, see deletion.py
+    """
+
+    def delete_model(self, request, obj):
+        delete_profiles([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        delete_profiles(queryset.values_list("pk", flat=True))
+
+
+@admin.register(StatusMessage)
+class StatusMessageAdmin(admin.ModelAdmin):
+    """
+    status messages are deleted with their images in bulk, see deletion.py
+    """
+
+    def delete_model(self, request, obj):
+        delete_status_messages([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        delete_status_messages(queryset.values_list("pk", flat=True))
+
+
 admin.site.register(Image)
 admin.site.register(Friend)
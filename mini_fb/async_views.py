@@ -0,0 +1,151 @@
+"""
+Async versions of the read-heavy mini_fb views, used when the project is served
+over ASGI (see cs412/asgi.py). They render the same templates as the views in
+views.py. The rows a page needs are loaded with the async ORM only when the
+page's cached fragment is missing. They return a TemplateResponse, which
+Django renders in a worker thread, so a request waiting on the database does
+not hold a thread.
+"""
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.http import Http404
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.views.generic import View
+
+from .caching import get_directory_version, get_news_feed_version, get_profile_version
+from .middleware import aget_profile
+from .models import Profile
+from .pagination import paginate_by_id, paginate_by_timestamp
+
+
+async def fragment_is_cached(fragment_name, *vary_on):
+    """
+    return True if the template fragment cached by {% cache ... fragment_name vary_on %}
+    is in the cache
+    """
+    return await cache.ahas_key(make_template_fragment_key(fragment_name, vary_on))
+
+
+class AsyncShowAllProfilesView(View):
+    """
+    An async view class to display all profiles stored in the Profile model
+    """
+
+    template_name = "mini_fb/show_all_profiles.html"
+
+    async def get(self, request, *args, **kwargs):
+        # a missing cursor renders as "" in the fragment key
+        after = request.GET.get("after", "")
+        profiles = paginate_by_id(Profile.objects.all(), after)
+        cache_version = await sync_to_async(get_directory_version)()
+
+        if not await fragment_is_cached("all_profiles", cache_version, after):
+            await profiles.afetch()
+
+        context = {"profiles": profiles, "cache_version": cache_version}
+        return TemplateResponse(request, self.template_name, context)
+
+
+class AsyncShowProfilePageView(View):
+    """
+    An async view class to display a single profile page
+    """
+
+    template_name = "mini_fb/show_profile.html"
+
+    async def get_profile(self, request):
+        """
+        return the profile to display
+        """
+        try:
+            return await Profile.objects.aget(pk=self.kwargs["pk"])
+        except Profile.DoesNotExist:
+            raise Http404("No profile found matching the query.")
+
+    async def get(self, request, *args, **kwargs):
+        profile = await self.get_profile(request)
+        user = await request.auser()
+        # a missing cursor renders as "" in the fragment key
+        after = request.GET.get("after", "")
+        is_owner = profile.user_id == user.pk
+        cache_version = await sync_to_async(get_profile_version)(profile)
+
+        # prefetch the images of the whole page and their variants in two queries
+        status_messages = paginate_by_timestamp(
+            profile.get_status_messages().prefetch_related("images__variants"), after
+        )
+
+        if not await fragment_is_cached("profile_friends", profile.pk, cache_version):
+            await profile.aget_friends()
+        if not await fragment_is_cached(
+            "profile_status_messages", profile.pk, cache_version, is_owner, after
+        ):
+            await status_messages.afetch()
+
+        context = {
+            "profile": profile,
+            "object": profile,
+            "status_messages": status_messages,
+            "cache_version": cache_version,
+            "is_owner": is_owner,
+        }
+        return TemplateResponse(request, self.template_name, context)
+
+
+class AsyncShowProfileForUser(AsyncShowProfilePageView):
+    """
+    An async view class to display the profile page for the current user
+    """
+
+    async def get_profile(self, request):
+        """
+        return the profile of the logged-in user
+        """
+        profile = await aget_profile(request)
+        if profile is None:
+            raise Http404("There is no profile for this user.")
+        return profile
+
+
+class AsyncShowNewsFeedView(View):
+    """
+    An async view class to display the news feed of the current user
+    """
+
+    template_name = "mini_fb/news_feed.html"
+
+    async def get(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), reverse("mini_fb:login"))
+
+        profile = await aget_profile(request)
+        if profile is None:
+            raise Http404("There is no profile for this user.")
+
+        # a missing cursor renders as "" in the fragment key
+        after = request.GET.get("after", "")
+        # the feed version combines the versions of the profile's friends
+        await profile.aget_friends()
+        cache_version = await sync_to_async(get_news_feed_version)(profile)
+
+        # prefetching the images of the whole page and their variants in two queries
+        news_feed = paginate_by_timestamp(
+            profile.get_news_feed().prefetch_related("images__variants"),
+            after,
+            field="feed_timestamp",
+        )
+        if not await fragment_is_cached("news_feed", profile.pk, cache_version, after):
+            await news_feed.afetch()
+
+        context = {
+            "profile": profile,
+            "object": profile,
+            "news_feed": news_feed,
+            "cache_version": cache_version,
+        }
+        return TemplateResponse(request, self.template_name, context)
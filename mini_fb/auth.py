@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+
+def user_cache_key(user_pk):
+    """
+    return the cache key of the user with user_pk
+    """
+    return f"mini_fb:user:{user_pk}"
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that keeps the users it loads for AuthenticationMiddleware
+    in the cache backend for MINI_FB_USER_CACHE_TIMEOUT seconds, so a request
+    with a session does not query the user table
+    the cached user is dropped whenever the user is saved or deleted
+    (see signals.py), so password and is_active changes apply at once, in
+    every worker as long as they share the cache backend
+    """
+
+    def get_user(self, user_id):
+        timeout = getattr(settings, "MINI_FB_USER_CACHE_TIMEOUT", 0)
+        if not timeout:
+            return super().get_user(user_id)
+
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, timeout)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,343 @@
+"""
+The benchmark suite: a synthetic dataset at several scales, and one scenario
+for every URL of the quotes, restaurant and mini_fb apps.
+
+The dataset is built on the existing models. Profiles and friendships come from
+the load_friend_graph command; each synthetic profile then gets status messages
+(fanned out to the news feeds) and images, which share a few content-addressed
+files. Seeding is incremental, so a larger scale tops up a smaller one.
+
+See the benchmark management command for running the suite.
+"""
+
+import io
+import itertools
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Count
+from django.urls import get_resolver, reverse
+from PIL import Image as PILImage
+
+from .caching import bump_directory_version, bump_profile_versions
+from .loadtest import summarize
+from .models import (
+    Friend,
+    Image,
+    NewsFeedItem,
+    Profile,
+    StatusMessage,
+    rebuild_counters,
+)
+from .search import STATUS_MESSAGE_INDEX
+
+# the size of each scale: synthetic profiles, average friends per profile,
+# status messages per profile and images per profile
+SCALES = {
+    "small": {"profiles": 100, "friends": 10, "status_messages": 5, "images": 2},
+    "medium": {"profiles": 1000, "friends": 25, "status_messages": 10, "images": 4},
+    "large": {"profiles": 10000, "friends": 50, "status_messages": 20, "images": 4},
+}
+
+# the number of distinct image files the synthetic images share
+IMAGE_FILES = 8
+
+# the apps whose URLs the scenarios must cover
+APPS = ["quotes", "restaurant", "mini_fb"]
+
+BATCH_SIZE = 1000
+
+
+def synthetic_profiles():
+    """
+    return a queryset of the profiles created by load_friend_graph --synthetic-profiles
+    """
+    return Profile.objects.filter(user__username__startswith="synthetic_")
+
+
+def image_files(count):
+    """
+    return the names of count small PNG files of different colours in the image storage
+    """
+    storage = Image._meta.get_field("image_file").storage
+    names = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        colour = ((i * 97) % 256, (i * 57) % 256, (i * 31) % 256)
+        PILImage.new("RGB", (800, 600), colour).save(buffer, format="PNG")
+        # identical files are stored once, so seeding again does not add files
+        names.append(storage.save(f"benchmark_{i}.png", ContentFile(buffer.getvalue())))
+    return names
+
+
+def seed_dataset(scale, seed=412, stdout=None):
+    """
+    top the synthetic dataset up to scale, a key of SCALES
+    return the number of rows of each model
+    """
+    size = SCALES[scale]
+    rng = random.Random(seed)
+
+    call_command(
+        "load_friend_graph",
+        synthetic_profiles=size["profiles"],
+        synthetic_friends=size["friends"],
+        seed=seed,
+        stdout=stdout or io.StringIO(),
+    )
+
+    # the friends of every synthetic profile, to fan the new messages out
+    readers = {}
+    for pk1, pk2 in Friend.objects.values_list("profile1_id", "profile2_id"):
+        readers.setdefault(pk1, []).append(pk2)
+        readers.setdefault(pk2, []).append(pk1)
+
+    # status messages
+    missing = (
+        synthetic_profiles()
+        .annotate(count=Count("statusmessage"))
+        .filter(count__lt=size["status_messages"])
+    )
+    new_messages = (
+        StatusMessage(profile_id=pk, message=f"synthetic status {i} of {pk}")
+        for pk, count in missing.values_list("pk", "count").iterator()
+        for i in range(count, size["status_messages"])
+    )
+    touched = set()
+    while batch := list(itertools.islice(new_messages, BATCH_SIZE)):
+        with transaction.atomic():
+            StatusMessage.objects.bulk_create(batch)
+            # bulk_create does not return pks on every backend, so look them up
+            created = list(
+                StatusMessage.objects.filter(
+                    profile_id__in={message.profile_id for message in batch},
+                    feed_items__isnull=True,
+                ).values_list("pk", "profile_id", "timestamp")
+            )
+            # bulk_create sends no signals, so index the new messages here
+            STATUS_MESSAGE_INDEX.update(
+                StatusMessage.objects.filter(pk__in=[row[0] for row in created])
+            )
+            NewsFeedItem.objects.bulk_create(
+                [
+                    NewsFeedItem(
+                        profile_id=reader, status_message_id=pk, timestamp=timestamp
+                    )
+                    for pk, profile_id, timestamp in created
+                    for reader in [profile_id] + readers.get(profile_id, [])
+                ],
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+        touched.update(message.profile_id for message in batch)
+
+    # images, attached to random messages of their profile
+    files = image_files(IMAGE_FILES)
+    missing = (
+        synthetic_profiles()
+        .annotate(count=Count("statusmessage__images"))
+        .filter(count__lt=size["images"])
+    )
+    for pk, count in missing.values_list("pk", "count").iterator():
+        messages = list(
+            StatusMessage.objects.filter(profile_id=pk).values_list("pk", flat=True)
+        )
+        Image.objects.bulk_create(
+            Image(status_message_id=rng.choice(messages), image_file=rng.choice(files))
+            for i in range(count, size["images"])
+        )
+        touched.add(pk)
+
+    # bulk_create sends no signals, so recount the profiles and mark the cached
+    # pages stale here
+    rebuild_counters(touched)
+    bump_profile_versions(touched)
+    bump_directory_version()
+
+    return {
+        "profiles": Profile.objects.count(),
+        "friends": Friend.objects.count(),
+        "status_messages": StatusMessage.objects.count(),
+        "images": Image.objects.count(),
+        "news_feed_items": NewsFeedItem.objects.count(),
+    }
+
+
+class Scenario:
+    """
+    A request to one URL of the site, repeated by the benchmark
+    path and data may be callables, called before each request, which is how
+    scenarios that use up what they request (deleting a status message) get
+    a fresh target every time
+    """
+
+    def __init__(self, name, path, method="GET", data=None, login=True):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.data = data
+        self.login = login
+
+    def get_path(self):
+        """
+        return the path of the next request
+        """
+        return self.path() if callable(self.path) else self.path
+
+    def get_data(self):
+        """
+        return the form data of the next request
+        """
+        return self.data() if callable(self.data) else self.data
+
+    @property
+    def static(self):
+        """
+        return True if every request of the scenario is the same GET,
+        so it can be sent by the HTTP load generator
+        """
+        return self.method == "GET" and not callable(self.path)
+
+
+def benchmark_user():
+    """
+    return the user the logged-in scenarios run as, the owner of the first
+    synthetic profile
+    """
+    return User.objects.get(username="synthetic_0")
+
+
+def scenarios(user):
+    """
+    return the scenarios of every URL of APPS, with the logged-in ones run as user
+    """
+    profile = Profile.objects.filter(user=user).order_by("pk").first()
+    others = itertools.cycle(
+        synthetic_profiles().exclude(pk=profile.pk).values_list("pk", flat=True)[:1000]
+    )
+    own_message = StatusMessage.objects.filter(profile=profile).first()
+    image = Image.objects.exclude(image_file="").first()
+    counter = itertools.count()
+
+    def new_message():
+        message = StatusMessage.objects.create(
+            profile=profile, message=f"benchmark status {next(counter)}"
+        )
+        return reverse("mini_fb:delete_status", kwargs={"pk": message.pk})
+
+    return [
+        # quotes
+        Scenario("quotes:quote", reverse("quotes:quote"), login=False),
+        Scenario("quotes:show_all", reverse("quotes:show_all"), login=False),
+        Scenario("quotes:about", reverse("quotes:about"), login=False),
+        # restaurant
+        Scenario("restaurant:main", reverse("restaurant:main"), login=False),
+        Scenario("restaurant:order", reverse("restaurant:order"), login=False),
+        Scenario(
+            "restaurant:confirmation",
+            reverse("restaurant:confirmation"),
+            method="POST",
+            data={
+                "items": ["Wonton Soup", "Beef Noodle Soup with Brisket"],
+                "extras": ["Tendon"],
+                "name": "Benchmark",
+                "phone": "555-0100",
+                "email": "benchmark@example.com",
+            },
+            login=False,
+        ),
+        # mini_fb pages
+        Scenario(
+            "mini_fb:show_all_profiles_view", reverse("mini_fb:show_all_profiles_view")
+        ),
+        Scenario(
+            "mini_fb:show_profile",
+            reverse("mini_fb:show_profile", kwargs={"pk": profile.pk}),
+        ),
+        Scenario(
+            "mini_fb:show_profile_for_user", reverse("mini_fb:show_profile_for_user")
+        ),
+        Scenario("mini_fb:show_newsfeed", reverse("mini_fb:show_newsfeed")),
+        Scenario("mini_fb:friend_suggestions", reverse("mini_fb:friend_suggestions")),
+        Scenario(
+            "mini_fb:search",
+            reverse("mini_fb:search") + "?q=synthetic+status",
+            login=False,
+        ),
+        Scenario(
+            "mini_fb:create_profile", reverse("mini_fb:create_profile"), login=False
+        ),
+        Scenario("mini_fb:update_profile", reverse("mini_fb:update_profile")),
+        Scenario("mini_fb:export_profile", reverse("mini_fb:export_profile")),
+        Scenario("mini_fb:login", reverse("mini_fb:login"), login=False),
+        Scenario("media", image.image_file.url, login=False),
+        # mini_fb writes
+        Scenario(
+            "mini_fb:create_status",
+            reverse("mini_fb:create_status"),
+            method="POST",
+            data=lambda: {"message": f"benchmark status {next(counter)}"},
+        ),
+        Scenario(
+            "mini_fb:update_status",
+            reverse("mini_fb:update_status", kwargs={"pk": own_message.pk}),
+            method="POST",
+            data=lambda: {"message": f"benchmark update {next(counter)}"},
+        ),
+        Scenario("mini_fb:delete_status", new_message, method="POST"),
+        Scenario(
+            "mini_fb:add_friend",
+            lambda: reverse("mini_fb:add_friend", kwargs={"other_pk": next(others)}),
+        ),
+        Scenario(
+            "mini_fb:logout", reverse("mini_fb:logout"), method="POST", login=False
+        ),
+    ]
+
+
+def url_names():
+    """
+    return the names of the URLs of APPS, as "app:name"
+    """
+    resolver = get_resolver()
+    return {
+        f"{app}:{name}"
+        for app in APPS
+        for name in resolver.namespace_dict[app][1].reverse_dict
+        if isinstance(name, str)
+    }
+
+
+def run_scenario(client, scenario, iterations):
+    """
+    send the requests of scenario with the test client, after one warm-up request
+    return their statistics
+    """
+    latencies = []
+    errors = 0
+    elapsed = 0.0
+    for i in range(iterations + 1):
+        path, data = scenario.get_path(), scenario.get_data()
+        start = time.perf_counter()
+        if scenario.method == "GET":
+            response = client.get(path, data)
+        else:
+            response = client.post(path, data or {})
+        if response.streaming:
+            # a streamed body is generated as it is read
+            for chunk in response.streaming_content:
+                pass
+        latency = time.perf_counter() - start
+
+        if i == 0:
+            continue  # the warm-up request
+        elapsed += latency
+        if response.status_code >= 400:
+            errors += 1
+        else:
+            latencies.append(latency)
+    return summarize(latencies, errors, elapsed)
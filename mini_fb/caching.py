@@ -0,0 +1,88 @@
+"""
+Version counters for the cached template fragments of the mini_fb pages.
+
+Each profile has a version that changes whenever something shown on its
+pages changes: the profile itself, its friendships, its status messages or
+their images. Fragments include the version in their cache key, so a bump
+makes every stale fragment unreachable without having to find and delete it.
+"""
+
+import time
+
+from django.core.cache import cache
+
+# version of the profile directory, changed when any profile changes
+DIRECTORY_VERSION_KEY = "mini_fb:version:directory"
+
+
+def profile_cache_key(user_pk):
+    """
+    return the cache key of the profile of the user with user_pk
+    """
+    return f"mini_fb:user_profile:{user_pk}"
+
+
+def profile_version_key(pk):
+    """
+    return the cache key of the version of the profile with pk
+    """
+    return f"mini_fb:version:profile:{pk}"
+
+
+def new_version():
+    """
+    return a fresh version value
+    versions start from the clock, so a version evicted from the cache
+    never comes back with a value used by an older fragment
+    """
+    return time.time_ns()
+
+
+def get_versions(keys):
+    """
+    return a string combining the versions stored under keys,
+    creating the versions that are missing
+    """
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return "-".join(str(versions[key]) for key in keys)
+
+
+def get_profile_version(profile):
+    """
+    return the version of a profile's own page
+    """
+    return get_versions([profile_version_key(profile.pk)])
+
+
+def get_news_feed_version(profile):
+    """
+    return the version of a profile's news feed, which shows the status
+    messages of the profile and of all of its friends
+    """
+    pks = [profile.pk] + [friend.pk for friend in profile.get_friends()]
+    return get_versions([profile_version_key(pk) for pk in pks])
+
+
+def get_directory_version():
+    """
+    return the version of the profile directory
+    """
+    return get_versions([DIRECTORY_VERSION_KEY])
+
+
+def bump_profile_versions(pks):
+    """
+    give the profiles with pks a new version
+    """
+    cache.set_many({profile_version_key(pk): new_version() for pk in pks}, None)
+
+
+def bump_directory_version():
+    """
+    give the profile directory a new version
+    """
+    cache.set(DIRECTORY_VERSION_KEY, new_version(), None)
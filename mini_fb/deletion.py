@@ -0,0 +1,263 @@
+"""
+Bulk deletion of profiles and status messages with large histories.
+
+Model.delete() collects every dependent row in Python and sends signals for
+each of them, which takes longer than a request for a busy profile. The
+functions here delete the dependent rows instead in chunks of
+DELETE_CHUNK_SIZE primary keys, with plain DELETE statements, in one
+transaction, and do once what the signal receivers would do per row: update
+the search index, the counters and the cached pages.
+
+The files of the deleted images and variants are not deleted by the request.
+Their names are queued as PendingFileRemoval rows in the same transaction,
+and once it commits a queued task sweeps them (see mini_fb/worker.py). It
+deletes the files no row references any more, unless an upload stored them
+again within their grace period (see mini_fb/storage.py). The
+collect_orphaned_media command runs the sweeper and also finds the files
+nothing references.
+"""
+
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .caching import bump_directory_version, bump_profile_versions, profile_cache_key
+from .models import (
+    Friend,
+    Image,
+    ImageVariant,
+    NewsFeedItem,
+    PendingFileRemoval,
+    Profile,
+    StatusMessage,
+    Task,
+    update_counters,
+)
+from .search import PROFILE_INDEX, STATUS_MESSAGE_INDEX
+
+# primary keys per DELETE statement
+DELETE_CHUNK_SIZE = 500
+
+
+def chunked_pks(queryset):
+    """
+    yield the pks of queryset in lists of DELETE_CHUNK_SIZE, for rows that are
+    deleted as they are yielded
+    """
+    queryset = queryset.order_by("pk").values_list("pk", flat=True)
+    while pks := list(queryset[:DELETE_CHUNK_SIZE]):
+        yield pks
+
+
+def raw_delete(queryset):
+    """
+    delete the rows of queryset DELETE_CHUNK_SIZE at a time, without loading them,
+    cascading or sending signals
+    return the number of rows deleted
+    """
+    deleted = 0
+    for pks in chunked_pks(queryset):
+        # the DELETE statement of QuerySet.delete(), without its collector
+        # _raw_delete is private API, checked against Django 5.1 by
+        # BulkDeletionTest.test_raw_delete: review it when upgrading Django
+        deleted += queryset.model.objects.filter(pk__in=pks)._raw_delete(queryset.db)
+    return deleted
+
+
+def queue_file_removals(names):
+    """
+    queue the storage names of files that may have lost their last reference
+    """
+    PendingFileRemoval.objects.bulk_create(
+        [PendingFileRemoval(name=name) for name in set(names) if name],
+        ignore_conflicts=True,
+    )
+
+
+def count_by(queryset, field):
+    """
+    return a dict of the number of rows of queryset per value of field
+    """
+    return dict(queryset.order_by().values_list(field).annotate(n=Count("pk")))
+
+
+def subtract_counters(counts):
+    """
+    subtract counts, a dict of {field: Counter of {profile pk: count}}, from the
+    counters of the profiles, with one UPDATE per distinct set of counts
+    """
+    profiles = defaultdict(dict)
+    for field, counter in counts.items():
+        for pk, count in counter.items():
+            if count:
+                profiles[pk][field] = -count
+
+    groups = defaultdict(list)
+    for pk, deltas in profiles.items():
+        groups[tuple(sorted(deltas.items()))].append(pk)
+    for deltas, pks in groups.items():
+        update_counters(Profile.objects.filter(pk__in=pks), **dict(deltas))
+
+
+def _delete_status_messages(message_pks):
+    """
+    delete the status messages with message_pks and everything depending on them,
+    in the current transaction
+    return the number of rows deleted per model
+    """
+    deleted = {"images": 0, "image_variants": 0, "news_feed_items": 0}
+
+    images = Image.objects.filter(status_message__in=message_pks)
+    variants = ImageVariant.objects.filter(image__status_message__in=message_pks)
+    queue_file_removals(
+        list(images.values_list("image_file", flat=True))
+        + list(variants.values_list("file", flat=True))
+    )
+
+    deleted["image_variants"] += raw_delete(variants)
+    deleted["images"] += raw_delete(images)
+    deleted["news_feed_items"] += raw_delete(
+        NewsFeedItem.objects.filter(status_message__in=message_pks)
+    )
+    STATUS_MESSAGE_INDEX.delete(message_pks)
+    deleted["status_messages"] = raw_delete(
+        StatusMessage.objects.filter(pk__in=message_pks)
+    )
+    return deleted
+
+
+def delete_status_messages(message_pks):
+    """
+    delete the status messages with message_pks, with their images, variants
+    and news feed items
+    return the number of rows deleted per model
+    """
+    message_pks = list(message_pks)
+
+    with transaction.atomic():
+        deleted = {}
+        counts = {"status_count": Counter(), "image_count": Counter()}
+        for start in range(0, len(message_pks), DELETE_CHUNK_SIZE):
+            chunk = message_pks[start : start + DELETE_CHUNK_SIZE]
+            # what the chunk takes from the counters of each author
+            counts["status_count"].update(
+                count_by(StatusMessage.objects.filter(pk__in=chunk), "profile")
+            )
+            counts["image_count"].update(
+                count_by(
+                    Image.objects.filter(status_message__in=chunk),
+                    "status_message__profile",
+                )
+            )
+            for model, count in _delete_status_messages(chunk).items():
+                deleted[model] = deleted.get(model, 0) + count
+
+        subtract_counters(counts)
+        # the news feeds of the friends combine the versions of the authors
+        bump_profile_versions(counts["status_count"])
+        schedule_sweep()
+
+    return deleted
+
+
+def delete_profiles(profile_pks):
+    """
+    delete the profiles with profile_pks and their whole history: status messages,
+    images, friendships and news feeds
+    return the number of rows deleted per model
+    """
+    profile_pks = list(profile_pks)
+    profiles = Profile.objects.filter(pk__in=profile_pks)
+    friendships = Friend.objects.filter(
+        Q(profile1__in=profile_pks) | Q(profile2__in=profile_pks)
+    )
+
+    with transaction.atomic():
+        # the profiles left with fewer friends, and how many fewer
+        lost_friends = Counter()
+        for pk1, pk2 in friendships.values_list("profile1_id", "profile2_id"):
+            lost_friends.update([pk1, pk2])
+        for pk in profile_pks:
+            del lost_friends[pk]
+        friend_pks = set(lost_friends)
+        user_pks = list(profiles.values_list("user_id", flat=True))
+
+        deleted = {}
+        for pks in chunked_pks(StatusMessage.objects.filter(profile__in=profile_pks)):
+            for model, count in _delete_status_messages(pks).items():
+                deleted[model] = deleted.get(model, 0) + count
+        deleted["news_feed_items"] = deleted.get("news_feed_items", 0) + raw_delete(
+            NewsFeedItem.objects.filter(profile__in=profile_pks)
+        )
+        deleted["friends"] = raw_delete(friendships)
+        PROFILE_INDEX.delete(profile_pks)
+        deleted["profiles"] = raw_delete(profiles)
+
+        subtract_counters({"friend_count": lost_friends})
+        bump_profile_versions(friend_pks)
+        bump_directory_version()
+        schedule_sweep()
+
+    # the friends lost their mutual friends through the deleted profiles
+    cache.delete_many(
+        [profile_cache_key(pk) for pk in user_pks]
+        + [f"mini_fb:friend_suggestions:{pk}" for pk in friend_pks]
+    )
+    return deleted
+
+
+def unreferenced_files(names):
+    """
+    return the set of the file names no Image or ImageVariant references
+    """
+    names = set(names)
+    names -= set(
+        Image.objects.filter(image_file__in=names).values_list("image_file", flat=True)
+    )
+    names -= set(
+        ImageVariant.objects.filter(file__in=names).values_list("file", flat=True)
+    )
+    return names
+
+
+def sweep_files():
+    """
+    delete the queued files that no Image or ImageVariant references any more,
+    and empty the queue
+    a file stored or uploaded again within its grace period stays queued, and
+    is swept again once the period is over, see ContentAddressedStorage
+    return the number of files deleted
+    """
+    storage = Image._meta.get_field("image_file").storage
+    deleted = 0
+    kept = False
+    queue = PendingFileRemoval.objects.order_by("pk")
+    last_pk = 0
+    while removals := list(queue.filter(pk__gt=last_pk)[:DELETE_CHUNK_SIZE]):
+        last_pk = removals[-1].pk
+        names = unreferenced_files(removal.name for removal in removals)
+        swept = []
+        for removal in removals:
+            if removal.name not in names:
+                swept.append(removal.pk)
+            # an identical upload may have stored the file again since the check
+            elif storage.delete_if_stale(removal.name):
+                swept.append(removal.pk)
+                deleted += 1
+            else:
+                kept = True
+        PendingFileRemoval.objects.filter(pk__in=swept).delete()
+
+    if kept:
+        schedule_sweep(delay=getattr(settings, "MINI_FB_FILE_GRACE_PERIOD", 600))
+    return deleted
+
+
+def schedule_sweep(delay=0):
+    """
+    queue a sweep of the queued files in delay seconds, see mini_fb/worker.py
+    """
+    Task.enqueue("mini_fb.deletion.sweep_files", delay=delay)
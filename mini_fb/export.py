@@ -0,0 +1,152 @@
+"""
+Streaming export of everything a profile has put on mini_fb.
+
+The export is a JSONL document: one record for the profile, then one per
+friend and one per status message, with the names of its images. The ZIP
+export holds the document as data.jsonl and the image files under images/.
+
+Both are generated as iterators of bytes, for a StreamingHttpResponse or a
+file. Rows are read from the database EXPORT_CHUNK_SIZE at a time and files
+are copied chunk by chunk, so memory use does not grow with the size of the
+profile.
+"""
+
+import io
+import json
+import time
+import zipfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Image, StatusMessage
+
+# rows read from the database at a time
+EXPORT_CHUNK_SIZE = 500
+
+# the export formats and their content types
+EXPORT_FORMATS = {"jsonl": "application/x-ndjson", "zip": "application/zip"}
+
+
+def export_records(profile):
+    """
+    yield the records of the export of profile, as dicts
+    """
+    yield {
+        "type": "profile",
+        "id": profile.pk,
+        "username": profile.user.username,
+        "first_name": profile.first_name,
+        "last_name": profile.last_name,
+        "city": profile.city,
+        "email": profile.email,
+        "image_url": profile.image_url,
+    }
+
+    for friend in profile.friends_queryset().order_by("pk").iterator(EXPORT_CHUNK_SIZE):
+        yield {
+            "type": "friend",
+            "id": friend.pk,
+            "first_name": friend.first_name,
+            "last_name": friend.last_name,
+            "city": friend.city,
+        }
+
+    messages = (
+        StatusMessage.objects.filter(profile=profile)
+        .order_by("timestamp", "pk")
+        .prefetch_related("images")
+    )
+    for message in messages.iterator(EXPORT_CHUNK_SIZE):
+        yield {
+            "type": "status_message",
+            "id": message.pk,
+            "timestamp": message.timestamp,
+            "message": message.message,
+            "images": [
+                f"images/{image.image_file.name}"
+                for image in message.images.all()
+                if image.image_file
+            ],
+        }
+
+
+def export_jsonl(profile):
+    """
+    yield the export of profile as JSONL, one line at a time
+    """
+    for record in export_records(profile):
+        yield (json.dumps(record, cls=DjangoJSONEncoder) + "\n").encode()
+
+
+class ZipStream(io.RawIOBase):
+    """
+    A write-only stream keeping what is written to it until it is taken,
+    for zipfile to write an archive into while it is being sent
+    zipfile sees the stream is not seekable and writes the sizes of the members
+    after their data, so no member has to be held in memory
+    """
+
+    def __init__(self):
+        self.written = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        """
+        return what was written since the last call
+        """
+        data = b"".join(self.written)
+        self.written = []
+        return data
+
+
+def export_zip(profile):
+    """
+    yield the export of profile as a ZIP archive, a piece at a time
+    """
+    stream = ZipStream()
+    date_time = time.localtime()[:6]
+    with zipfile.ZipFile(stream, "w") as archive:
+        info = zipfile.ZipInfo("data.jsonl", date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(info, "w") as member:
+            for line in export_jsonl(profile):
+                member.write(line)
+                yield stream.take()
+
+        # identical uploads share a file, which is archived once
+        names = (
+            Image.objects.filter(status_message__profile=profile)
+            .exclude(image_file="")
+            .order_by("image_file")
+            .values_list("image_file", flat=True)
+            .distinct()
+        )
+        storage = Image._meta.get_field("image_file").storage
+        for name in names.iterator(EXPORT_CHUNK_SIZE):
+            if not storage.exists(name):
+                continue
+            # image files are compressed already, store them as they are
+            info = zipfile.ZipInfo(f"images/{name}", date_time)
+            with storage.open(name) as f, archive.open(
+                info, "w", force_zip64=f.size >= zipfile.ZIP64_LIMIT
+            ) as member:
+                for chunk in f.chunks():
+                    member.write(chunk)
+                    yield stream.take()
+
+    # the central directory, written when the archive closes
+    yield stream.take()
+
+
+def export_profile(profile, export_format):
+    """
+    return an iterator of the bytes of the export of profile in export_format,
+    a key of EXPORT_FORMATS
+    """
+    return export_zip(profile) if export_format == "zip" else export_jsonl(profile)
@@ -0,0 +1,97 @@
+"""
+Background generation of the downscaled variants of status message images.
+
+The upload request only stores the original file; the variants are written
+by a queued task once the request's transaction has committed.
+"""
+
+import io
+import os
+
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage, ImageOps
+
+from .caching import bump_profile_versions
+from .models import Image, ImageVariant, Task
+
+# longest side in pixels of each variant
+VARIANT_SIZES = {"thumbnail": 150, "feed": 600}
+
+# file extension of each Pillow format
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "AVIF": "avif"}
+
+
+def variant_formats():
+    """
+    return the Pillow formats to write variants in, the ones this Pillow build supports
+    """
+    PILImage.init()
+    return [ImageVariant.FALLBACK_FORMAT] + [
+        image_format
+        for image_format, mime_type in ImageVariant.MODERN_FORMATS
+        if image_format in PILImage.SAVE
+    ]
+
+
+def generate_variants(image):
+    """
+    write the missing downscaled variants of an Image and record their dimensions
+    return the number of variants created
+    """
+    existing = set(image.variants.values_list("name", "format"))
+    formats = variant_formats()
+    stem = os.path.splitext(os.path.basename(image.image_file.name))[0]
+    created = 0
+
+    with image.image_file.open("rb") as f, PILImage.open(f) as original:
+        # respect the camera orientation, and drop the alpha channel JPEG cannot store
+        original = ImageOps.exif_transpose(original).convert("RGB")
+
+        for name, size in VARIANT_SIZES.items():
+            resized = original.copy()
+            resized.thumbnail((size, size))
+
+            for image_format in formats:
+                if (name, image_format) in existing:
+                    continue
+
+                buffer = io.BytesIO()
+                resized.save(buffer, image_format, quality=80)
+                variant = ImageVariant(
+                    image=image,
+                    name=name,
+                    format=image_format,
+                    width=resized.width,
+                    height=resized.height,
+                )
+                variant.file.save(
+                    f"{stem}_{name}.{EXTENSIONS[image_format]}",
+                    ContentFile(buffer.getvalue()),
+                    save=False,
+                )
+                variant.save()
+                created += 1
+
+    if created:
+        # the cached pages showing the image can now use the variants
+        bump_profile_versions([image.status_message.profile_id])
+
+    return created
+
+
+def process_image(image_pk):
+    """
+    generate the variants of the Image with image_pk, the task queued by
+    schedule_variants
+    """
+    image = Image.objects.select_related("status_message").filter(pk=image_pk).first()
+    # the image may have been deleted before its turn came
+    if image is not None and image.image_file:
+        generate_variants(image)
+
+
+def schedule_variants(image):
+    """
+    queue the generation of the variants of an Image, see mini_fb/worker.py
+    """
+    Task.enqueue("mini_fb.images.process_image", image.pk, key=f"variants:{image.pk}")
@@ -0,0 +1,163 @@
+"""
+A small HTTP load generator for benchmarking a running server.
+
+Each client thread keeps one keep-alive connection and requests the given
+paths in turn until the duration is over. The latency of every request is
+recorded, so throughput and percentiles can be reported per path.
+"""
+
+import http.client
+import socket
+import subprocess
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+
+
+def percentile(sorted_values, fraction):
+    """
+    return the value below which fraction of the sorted values fall
+    """
+    if not sorted_values:
+        return None
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    return the statistics of a list of request latencies in seconds
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0,
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def run_load(base_url, paths, concurrency=8, duration=10.0, headers=None):
+    """
+    request paths from base_url with concurrency clients for duration seconds
+    return a dict of statistics per path, plus "all" for the whole run
+    """
+    url = urlsplit(base_url)
+    headers = dict(headers or {})
+    deadline = time.monotonic() + duration
+    lock = threading.Lock()
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+
+    def client(offset):
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        i = offset
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+                connection = http.client.HTTPConnection(
+                    url.hostname, url.port, timeout=30
+                )
+            latency = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies[path].append(latency)
+                else:
+                    errors[path] += 1
+        connection.close()
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    results = {
+        path: summarize(latencies[path], errors[path], elapsed) for path in paths
+    }
+    results["all"] = summarize(
+        [latency for values in latencies.values() for latency in values],
+        sum(errors.values()),
+        elapsed,
+    )
+    return results
+
+
+def login_session(user):
+    """
+    return a new session logged in as user, to send its cookie with the requests
+    of a load test; delete it when done
+    """
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session
+
+
+def session_cookie(session):
+    """
+    return the Cookie header sending session
+    """
+    return f"{settings.SESSION_COOKIE_NAME}={session.session_key}"
+
+
+def free_port():
+    """
+    return a TCP port nothing listens on
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(command, port, env, timeout=30.0):
+    """
+    start a server process with command and wait until it accepts connections
+    on port; return the process
+    """
+    process = subprocess.Popen(command, env=env)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{command[0]} exited with {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{command[0]} did not start listening on port {port}")
+
+
+def stop_server(process):
+    """
+    stop a server process started by start_server
+    """
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
@@ -0,0 +1,248 @@
+"""
+Run the benchmark suite of mini_fb/benchmark.py: seed the synthetic dataset at
+each scale, then request every URL of the quotes, restaurant and mini_fb apps
+and report throughput and p50/p95/p99 latency per URL.
+
+    export DJANGO_DB_NAME=/tmp/benchmark.sqlite3 DJANGO_MEDIA_ROOT=/tmp/benchmark_media
+    python manage.py migrate
+    python manage.py benchmark --scales small medium \\
+        --output results.json --compare previous.json
+
+With --server client (the default) every scenario is sent through the Django
+test client, one request at a time. With --server gunicorn the GET scenarios
+are sent over HTTP to a local gunicorn by concurrent clients.
+
+The dataset is written to the configured database and MEDIA_ROOT, so they
+must not be the development ones.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from mini_fb.benchmark import (
+    SCALES,
+    benchmark_user,
+    run_scenario,
+    scenarios,
+    seed_dataset,
+)
+from mini_fb.loadtest import (
+    free_port,
+    login_session,
+    run_load,
+    session_cookie,
+    start_server,
+    stop_server,
+)
+
+# a p95 this much slower than in the compared run is reported as a regression
+REGRESSION_THRESHOLD = 0.20
+
+
+class Command(BaseCommand):
+    help = "Seed a synthetic dataset and benchmark every URL of the site"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", nargs="+", choices=SCALES, default=["small"])
+        parser.add_argument(
+            "--server", choices=["client", "gunicorn"], default="client"
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=50,
+            help="requests per scenario with the test client",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=10.0,
+            help="seconds of load per scale with gunicorn",
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--seed", type=int, default=412)
+        parser.add_argument("--output", help="file to write the JSON results to")
+        parser.add_argument("--compare", help="JSON results of an earlier run")
+
+    def handle(self, *args, **options):
+        name = settings.DATABASES["default"]["NAME"]
+        if (
+            connection.vendor == "sqlite"
+            and Path(name) == settings.BASE_DIR / "db.sqlite3"
+        ):
+            raise CommandError(
+                "the benchmark writes a synthetic dataset; "
+                "point DJANGO_DB_NAME at a scratch database"
+            )
+        if (
+            Path(settings.MEDIA_ROOT).resolve()
+            == (settings.BASE_DIR / "media").resolve()
+        ):
+            raise CommandError(
+                "the benchmark stores the images of its dataset; "
+                "point DJANGO_MEDIA_ROOT at a scratch directory"
+            )
+
+        results = {"meta": self.meta(options), "scales": {}}
+        for scale in sorted(options["scales"], key=list(SCALES).index):
+            self.stdout.write(f"{scale}: seeding")
+            dataset = seed_dataset(scale, options["seed"])
+            self.stdout.write(f"{scale}: {dataset}")
+
+            if options["server"] == "client":
+                urls = self.run_client(options)
+            else:
+                urls = self.run_gunicorn(options)
+            results["scales"][scale] = {"dataset": dataset, "urls": urls}
+
+            for url, stats in urls.items():
+                self.stdout.write(
+                    f"{scale:<7} {url:<35} {stats['throughput']:>8} req/s "
+                    f"p50 {stats['p50_ms']} p95 {stats['p95_ms']} "
+                    f"p99 {stats['p99_ms']} ms, {stats['errors']} errors"
+                )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(
+                self.style.SUCCESS(f"results written to {options['output']}")
+            )
+
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                self.compare(json.load(f), results)
+
+    def meta(self, options):
+        """
+        return what the results were measured on
+        """
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                capture_output=True,
+                text=True,
+                cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except OSError:
+            commit = ""
+
+        return {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "commit": commit,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "cache": settings.CACHES["default"]["BACKEND"],
+            "server": options["server"],
+            "iterations": options["iterations"],
+            "duration": options["duration"],
+            "concurrency": options["concurrency"],
+            "workers": options["workers"],
+            "seed": options["seed"],
+        }
+
+    def run_client(self, options):
+        """
+        send every scenario through the test client
+        return the statistics per scenario
+        """
+        user = benchmark_user()
+        anonymous, logged_in = Client(), Client()
+        logged_in.force_login(user)
+
+        # silence the per-request metrics lines and the views' debug prints
+        metrics_logger = logging.getLogger("cs412.metrics")
+        level = metrics_logger.level
+        metrics_logger.setLevel(logging.ERROR)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                return {
+                    scenario.name: run_scenario(
+                        logged_in if scenario.login else anonymous,
+                        scenario,
+                        options["iterations"],
+                    )
+                    for scenario in scenarios(user)
+                }
+        finally:
+            metrics_logger.setLevel(level)
+
+    def run_gunicorn(self, options):
+        """
+        send the GET scenarios to a local gunicorn, all at once
+        return the statistics per scenario
+        """
+        user = benchmark_user()
+        selected = [scenario for scenario in scenarios(user) if scenario.static]
+        session = login_session(user)
+
+        port = free_port()
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "cs412.wsgi",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(options["workers"]),
+            "--log-level",
+            "warning",
+        ]
+        env = {**os.environ, "DJANGO_METRICS_LOG_LEVEL": "ERROR"}
+        process = start_server(command, port, env)
+        try:
+            paths = [scenario.path for scenario in selected]
+            base_url = f"http://127.0.0.1:{port}"
+            headers = {"Cookie": session_cookie(session)}
+            # warm up the workers and the caches before measuring
+            run_load(base_url, paths, options["concurrency"], 1.0, headers)
+            stats = run_load(
+                base_url, paths, options["concurrency"], options["duration"], headers
+            )
+        finally:
+            stop_server(process)
+            session.delete()
+
+        return {scenario.name: stats[scenario.path] for scenario in selected}
+
+    def compare(self, previous, current):
+        """
+        report the change of the p95 of every URL measured in both runs
+        """
+        self.stdout.write(f"compared with {previous['meta'].get('commit', '?')}:")
+        for key in ["server", "database", "cache"]:
+            if previous["meta"].get(key) != current["meta"][key]:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"the runs differ in {key}: "
+                        f"{previous['meta'].get(key)} and {current['meta'][key]}"
+                    )
+                )
+        for scale, results in current["scales"].items():
+            before = previous["scales"].get(scale, {}).get("urls", {})
+            for url, stats in results["urls"].items():
+                old, new = before.get(url, {}).get("p95_ms"), stats["p95_ms"]
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                line = f"{scale:<7} {url:<35} p95 {old} -> {new} ms ({change:+.0%})"
+                if change > REGRESSION_THRESHOLD:
+                    self.stdout.write(self.style.WARNING(line))
+                else:
+                    self.stdout.write(line)
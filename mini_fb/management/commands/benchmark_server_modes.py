@@ -0,0 +1,138 @@
+"""
+Benchmark the mini_fb read pages served by gunicorn in both deployment modes,
+under the same load:
+
+- wsgi: sync workers running cs412.wsgi and the sync views
+- asgi: uvicorn workers running cs412.asgi and the async views
+
+    python manage.py benchmark_server_modes --username tester --concurrency 32
+
+The servers use the configured database; seed it first, for example with
+load_friend_graph. Pass --output to write the results as JSON.
+"""
+
+import json
+import os
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from mini_fb.loadtest import (
+    free_port,
+    login_session,
+    run_load,
+    session_cookie,
+    start_server,
+    stop_server,
+)
+from mini_fb.models import Profile
+
+MODES = {
+    "wsgi": (["cs412.wsgi"], {"DJANGO_ASYNC_VIEWS": "0"}),
+    "asgi": (
+        ["cs412.asgi", "-k", "uvicorn.workers.UvicornWorker"],
+        {"DJANGO_ASYNC_VIEWS": "1"},
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = "Compare the throughput and latency of the WSGI and ASGI deployment modes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username", help="user whose profile and news feed are requested"
+        )
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--duration", type=float, default=10.0)
+        parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+        parser.add_argument("--output", help="file to write the JSON results to")
+
+    def handle(self, *args, **options):
+        paths = [reverse("mini_fb:show_all_profiles_view")]
+        headers = {}
+        session = None
+
+        if options["username"]:
+            try:
+                user = User.objects.get(username=options["username"])
+            except User.DoesNotExist:
+                raise CommandError(f"no user {options['username']}")
+            profile = Profile.objects.filter(user=user).order_by("pk").first()
+            if profile is None:
+                raise CommandError(f"{user} has no profile")
+
+            # log the clients in with a session of their own
+            session = login_session(user)
+            headers["Cookie"] = session_cookie(session)
+
+            paths += [
+                reverse("mini_fb:show_profile", kwargs={"pk": profile.pk}),
+                reverse("mini_fb:show_profile_for_user"),
+                reverse("mini_fb:show_newsfeed"),
+            ]
+
+        results = {}
+        try:
+            for mode in options["modes"]:
+                results[mode] = self.benchmark(mode, paths, headers, options)
+        finally:
+            if session is not None:
+                session.delete()
+
+        for path in paths + ["all"]:
+            row = "  ".join(
+                f"{mode}: {results[mode][path]['throughput']:>8} req/s "
+                f"p50 {results[mode][path]['p50_ms']} ms "
+                f"p99 {results[mode][path]['p99_ms']} ms"
+                for mode in results
+            )
+            self.stdout.write(f"{path:<40} {row}")
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(
+                self.style.SUCCESS(f"results written to {options['output']}")
+            )
+
+    def benchmark(self, mode, paths, headers, options):
+        """
+        start gunicorn in mode, put it under load and return the statistics
+        """
+        arguments, env = MODES[mode]
+        port = free_port()
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            *arguments,
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(options["workers"]),
+            "--log-level",
+            "warning",
+        ]
+
+        self.stdout.write(f"{mode}: {' '.join(command[2:])}")
+        # the per-request metrics lines would drown the output
+        env = {**os.environ, "DJANGO_METRICS_LOG_LEVEL": "ERROR", **env}
+        process = start_server(command, port, env)
+        try:
+            # warm up the workers and the caches before measuring
+            run_load(
+                f"http://127.0.0.1:{port}", paths, options["concurrency"], 1.0, headers
+            )
+            return run_load(
+                f"http://127.0.0.1:{port}",
+                paths,
+                options["concurrency"],
+                options["duration"],
+                headers,
+            )
+        finally:
+            stop_server(process)
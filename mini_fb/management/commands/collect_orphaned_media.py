@@ -0,0 +1,79 @@
+"""
+Garbage-collect the mini_fb media files nothing references.
+
+First sweeps the files queued by the bulk deletions (see mini_fb/deletion.py),
+then walks the media directory and deletes the files older than --min-age
+hours that no Image or ImageVariant references: files left by deletions that
+bypassed the queue, and temporary uploads left by crashed requests. Younger
+files are kept, since an upload stores its file before its row commits:
+
+    python manage.py collect_orphaned_media --dry-run
+    python manage.py collect_orphaned_media --min-age 24
+"""
+
+import itertools
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from mini_fb.deletion import DELETE_CHUNK_SIZE, sweep_files, unreferenced_files
+from mini_fb.models import Image
+
+
+def stored_files(storage, min_age):
+    """
+    yield the names of the files of storage not modified for min_age seconds
+    """
+    if not os.path.isdir(storage.location):
+        return
+    cutoff = time.time() - min_age
+    for directory, dirnames, filenames in os.walk(storage.location):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            if os.path.getmtime(path) < cutoff:
+                yield os.path.relpath(path, storage.location).replace(os.sep, "/")
+
+
+class Command(BaseCommand):
+    help = "Delete the media files no image or image variant references"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-age",
+            type=float,
+            default=24,
+            help="hours since a file was written before it may be deleted",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="list the orphaned files without deleting them",
+        )
+
+    def handle(self, *args, **options):
+        if not options["dry_run"]:
+            swept = sweep_files()
+            self.stdout.write(f"{swept} queued files deleted")
+
+        storage = Image._meta.get_field("image_file").storage
+        names = stored_files(storage, options["min_age"] * 3600)
+        checked = orphaned = size = 0
+        while batch := list(itertools.islice(names, DELETE_CHUNK_SIZE)):
+            checked += len(batch)
+            for name in sorted(unreferenced_files(batch)):
+                orphaned += 1
+                size += storage.size(name)
+                if options["dry_run"]:
+                    self.stdout.write(name)
+                else:
+                    storage.delete(name)
+
+        verb = "found" if options["dry_run"] else "deleted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{checked} files checked, {orphaned} orphaned files {verb} "
+                f"({size / 1024 / 1024:.1f} MiB)"
+            )
+        )
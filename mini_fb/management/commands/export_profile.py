@@ -0,0 +1,50 @@
+"""
+Export everything a mini_fb profile has put on the site, as JSONL or as a ZIP
+archive with the image files, streamed to a file or to stdout:
+
+    python manage.py export_profile 12 --output profile_12.zip
+    python manage.py export_profile 12 --format jsonl
+"""
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mini_fb.export import EXPORT_FORMATS, export_profile
+from mini_fb.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Export the data of a profile as JSONL or as a ZIP archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("profile", type=int, help="pk of the exported profile")
+        parser.add_argument(
+            "--format",
+            choices=list(EXPORT_FORMATS),
+            default="zip",
+            help="jsonl, or zip with the image files",
+        )
+        parser.add_argument("--output", help="file to write, stdout when not given")
+
+    def handle(self, *args, **options):
+        try:
+            profile = Profile.objects.select_related("user").get(pk=options["profile"])
+        except Profile.DoesNotExist:
+            raise CommandError(f"no profile with pk {options['profile']}")
+
+        chunks = export_profile(profile, options["format"])
+        if options["output"] is None:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        size = 0
+        with open(options["output"], "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        self.stdout.write(
+            self.style.SUCCESS(f"{size} bytes written to {options['output']}")
+        )
@@ -0,0 +1,31 @@
+"""
+Generate the missing downscaled variants of every mini_fb Image, for images
+uploaded before variants existed or whose background processing failed:
+
+    python manage.py generate_image_variants
+"""
+
+from django.core.management.base import BaseCommand
+
+from mini_fb.images import generate_variants
+from mini_fb.models import Image
+
+
+class Command(BaseCommand):
+    help = "Generate the missing downscaled variants of the status message images"
+
+    def handle(self, *args, **options):
+        created = failed = 0
+
+        images = Image.objects.exclude(image_file="").select_related("status_message")
+        for image in images.iterator(chunk_size=500):
+            try:
+                created += generate_variants(image)
+            except (OSError, ValueError) as e:
+                # missing or unreadable files are reported and skipped
+                failed += 1
+                self.stderr.write(f"Image {image.pk} ({image.image_file.name}): {e}")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"{created} variants created, {failed} images failed")
+        )
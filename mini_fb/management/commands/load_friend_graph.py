@@ -0,0 +1,319 @@
+"""
+Bulk load users, profiles and friendships into mini_fb.
+
+Records are streamed from CSV or JSONL files (the format follows the file
+extension), or generated as a synthetic graph for load testing:
+
+    python manage.py load_friend_graph --profiles profiles.csv --friends friends.jsonl
+    python manage.py load_friend_graph --synthetic-profiles 10000 --synthetic-friends 50
+
+A profile record has the fields username, first_name, last_name, city, email
+and image_url; its User is created when the username does not exist yet.
+A friend record has the fields username1 and username2.
+"""
+
+import csv
+import itertools
+import json
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from mini_fb.caching import bump_directory_version, bump_profile_versions
+from mini_fb.models import (
+    Friend,
+    NewsFeedItem,
+    Profile,
+    StatusMessage,
+    rebuild_counters,
+)
+from mini_fb.search import PROFILE_INDEX
+
+PROFILE_FIELDS = ["username", "first_name", "last_name", "city", "email", "image_url"]
+FRIEND_FIELDS = ["username1", "username2"]
+
+SYNTHETIC_CITIES = ["Boston", "Brockton", "Cambridge", "Quincy", "Somerville"]
+
+
+def read_records(path, fields):
+    """
+    yield one dict per record of a CSV or JSONL file, without reading it all at once
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            records = csv.DictReader(f)
+        elif path.endswith((".jsonl", ".json")):
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            raise CommandError(f"{path}: expected a .csv or .jsonl file")
+
+        for number, record in enumerate(records, start=1):
+            missing = [field for field in fields if not record.get(field)]
+            if missing:
+                raise CommandError(f"{path}, record {number}: missing {missing}")
+            yield record
+
+
+def chunked(iterable, size):
+    """
+    yield lists of at most size items from iterable
+    """
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk load profiles and friendships from CSV/JSONL files or a synthetic graph"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", help="CSV or JSONL file of profiles")
+        parser.add_argument("--friends", help="CSV or JSONL file of friend edges")
+        parser.add_argument(
+            "--synthetic-profiles",
+            type=int,
+            default=0,
+            help="generate this many synthetic profiles instead of reading files",
+        )
+        parser.add_argument(
+            "--synthetic-friends",
+            type=int,
+            default=10,
+            help="average number of friends of a synthetic profile",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=412, help="random seed of the synthetic graph"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="rows written per bulk insert and transaction",
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+
+        # username -> profile pk of every profile seen so far
+        self.profile_pks = {}
+
+        if options["synthetic_profiles"]:
+            count = options["synthetic_profiles"]
+            rng = random.Random(options["seed"])
+            profiles = self.synthetic_profiles(count)
+            friends = self.synthetic_friends(count, options["synthetic_friends"], rng)
+        else:
+            if not options["profiles"] and not options["friends"]:
+                raise CommandError("give --profiles/--friends or --synthetic-profiles")
+            profiles = (
+                read_records(options["profiles"], PROFILE_FIELDS)
+                if options["profiles"]
+                else []
+            )
+            friends = (
+                read_records(options["friends"], FRIEND_FIELDS)
+                if options["friends"]
+                else []
+            )
+
+        self.run("profiles", profiles, self.load_profiles)
+        self.run("friendships", friends, self.load_friends)
+
+    def run(self, label, records, load_batch):
+        """
+        write records in batches, one transaction per batch, reporting throughput
+        """
+        start = time.monotonic()
+        read = written = 0
+
+        for batch in chunked(records, self.batch_size):
+            with transaction.atomic():
+                written += load_batch(batch)
+            read += len(batch)
+
+            elapsed = time.monotonic() - start
+            self.stdout.write(
+                f"{label}: {read} read, {written} written, "
+                f"{read / elapsed if elapsed else 0:.0f} records/s"
+            )
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{label}: done, {written} of {read} records written in {elapsed:.1f}s"
+            )
+        )
+
+    def load_profiles(self, batch):
+        """
+        create the missing users and profiles of a batch of profile records
+        return the number of profiles created
+        """
+        usernames = {record["username"] for record in batch}
+
+        # create the users that do not exist yet
+        existing = set(
+            User.objects.filter(username__in=usernames).values_list(
+                "username", flat=True
+            )
+        )
+        new_users = []
+        for username in usernames - existing:
+            user = User(username=username)
+            user.set_unusable_password()
+            new_users.append(user)
+        User.objects.bulk_create(new_users)
+        user_pks = dict(
+            User.objects.filter(username__in=usernames).values_list("username", "pk")
+        )
+
+        # users that already have a profile keep it
+        for username, profile_pk in Profile.objects.filter(
+            user__username__in=usernames
+        ).values_list("user__username", "pk"):
+            self.profile_pks.setdefault(username, profile_pk)
+
+        new_profiles = {}
+        for record in batch:
+            username = record["username"]
+            if username in self.profile_pks or username in new_profiles:
+                continue
+            new_profiles[username] = Profile(
+                user_id=user_pks[username],
+                first_name=record["first_name"],
+                last_name=record["last_name"],
+                city=record["city"],
+                email=record["email"],
+                image_url=record["image_url"],
+            )
+        Profile.objects.bulk_create(new_profiles.values())
+        if new_profiles:
+            bump_directory_version()
+
+        if new_profiles:
+            # bulk_create does not return pks on every backend, so look them up
+            for username, profile_pk in Profile.objects.filter(
+                user__username__in=new_profiles
+            ).values_list("user__username", "pk"):
+                self.profile_pks.setdefault(username, profile_pk)
+                new_profiles[username].pk = profile_pk
+            # bulk_create sends no signals, so index the new profiles here
+            PROFILE_INDEX.update(new_profiles.values())
+
+        return len(new_profiles)
+
+    def load_friends(self, batch):
+        """
+        create the friendships of a batch of friend records that do not exist yet,
+        and backfill the news feeds of the new friends
+        return the number of friendships created
+        """
+        # resolve the usernames that have not been seen yet
+        unknown = {
+            record[field] for record in batch for field in FRIEND_FIELDS
+        } - self.profile_pks.keys()
+        for username, profile_pk in Profile.objects.filter(
+            user__username__in=unknown
+        ).values_list("user__username", "pk"):
+            self.profile_pks.setdefault(username, profile_pk)
+
+        # dedupe the edges of the batch in canonical order
+        pairs = set()
+        for record in batch:
+            pk1 = self.profile_pks.get(record["username1"])
+            pk2 = self.profile_pks.get(record["username2"])
+            if pk1 is None or pk2 is None:
+                raise CommandError(f"unknown profile in friend record {record}")
+            if pk1 != pk2:
+                pairs.add((min(pk1, pk2), max(pk1, pk2)))
+
+        # skip the friendships already stored, by earlier batches or loads
+        existing = Friend.objects.filter(
+            profile1__in={pk1 for pk1, pk2 in pairs},
+            profile2__in={pk2 for pk1, pk2 in pairs},
+        ).values_list("profile1_id", "profile2_id")
+        pairs -= set(existing)
+
+        # the unique (profile1, profile2) constraint skips friendships stored
+        # concurrently since
+        Friend.objects.bulk_create(
+            [Friend(profile1_id=pk1, profile2_id=pk2) for pk1, pk2 in pairs],
+            ignore_conflicts=True,
+        )
+
+        # backfill the news feeds, as Profile.add_friend does
+        readers = {}
+        for pk1, pk2 in pairs:
+            readers.setdefault(pk1, []).append(pk2)
+            readers.setdefault(pk2, []).append(pk1)
+        messages = StatusMessage.objects.filter(profile_id__in=readers).values_list(
+            "pk", "profile_id", "timestamp"
+        )
+        NewsFeedItem.objects.bulk_create(
+            [
+                NewsFeedItem(
+                    profile_id=reader, status_message_id=pk, timestamp=timestamp
+                )
+                for pk, profile_id, timestamp in messages
+                for reader in readers[profile_id]
+            ],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+
+        # bulk_create sends no signals, so mark the cached pages of the new
+        # friends stale here, and drop the friend suggestions of the new friends
+        # and of all their friends, as Profile.clear_friend_suggestions does
+        suggesters = set(readers)
+        for pk1, pk2 in Friend.objects.filter(
+            Q(profile1__in=readers) | Q(profile2__in=readers)
+        ).values_list("profile1_id", "profile2_id"):
+            suggesters.update((pk1, pk2))
+        cache.delete_many([f"mini_fb:friend_suggestions:{pk}" for pk in suggesters])
+        bump_profile_versions(readers)
+        # an edge stored concurrently would be counted twice, so recount rather
+        # than add
+        rebuild_counters(readers)
+
+        return len(pairs)
+
+    def synthetic_profiles(self, count):
+        """
+        yield count synthetic profile records
+        """
+        for i in range(count):
+            yield {
+                "username": f"synthetic_{i}",
+                "first_name": f"First{i}",
+                "last_name": f"Last{i}",
+                "city": SYNTHETIC_CITIES[i % len(SYNTHETIC_CITIES)],
+                "email": f"synthetic_{i}@example.com",
+                "image_url": f"https://picsum.photos/seed/{i}/200",
+            }
+
+    def synthetic_friends(self, count, average_friends, rng):
+        """
+        yield random, distinct friend records between count synthetic profiles,
+        about average_friends per profile
+        """
+        if count < 2:
+            return
+
+        seen = set()
+        edges = min(count * average_friends // 2, count * (count - 1) // 2)
+        while len(seen) < edges:
+            pair = tuple(sorted(rng.sample(range(count), 2)))
+            if pair in seen:
+                continue
+            seen.add(pair)
+            yield {
+                "username1": f"synthetic_{pair[0]}",
+                "username2": f"synthetic_{pair[1]}",
+            }
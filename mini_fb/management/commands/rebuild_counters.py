@@ -0,0 +1,29 @@
+"""
+Recount the denormalized friend, status message and image counters of the
+mini_fb profiles and status messages from the child tables, after bulk loads
+or whenever they may have drifted:
+
+    python manage.py rebuild_counters
+    python manage.py rebuild_counters --profile 12 --profile 13
+"""
+
+from django.core.management.base import BaseCommand
+
+from mini_fb.models import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recount the friend, status message and image counters of the profiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profile",
+            type=int,
+            action="append",
+            dest="profiles",
+            help="pk of a profile to recount, all profiles when not given",
+        )
+
+    def handle(self, *args, **options):
+        updated = rebuild_counters(options["profiles"])
+        self.stdout.write(self.style.SUCCESS(f"{updated} profiles recounted"))
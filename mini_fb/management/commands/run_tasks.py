@@ -0,0 +1,57 @@
+"""
+Run the queued mini_fb tasks: news feed fan-out, image variants and file
+sweeps, see mini_fb/worker.py.
+
+    python manage.py run_tasks --workers 4
+    python manage.py run_tasks --pool process --workers 4
+    python manage.py run_tasks --once
+"""
+
+from django.core.management.base import BaseCommand
+
+from mini_fb.models import Task
+from mini_fb.worker import run_worker
+
+
+class Command(BaseCommand):
+    help = "Run the queued mini_fb tasks on a pool of threads or processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=4, help="tasks run at the same time"
+        )
+        parser.add_argument(
+            "--pool",
+            choices=["thread", "process"],
+            default="thread",
+            help="run the tasks on threads, or on processes for CPU-bound tasks",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="seconds between two looks at an empty queue",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="exit once no task is due instead of waiting for more",
+        )
+
+    def handle(self, *args, **options):
+        if not options["once"]:
+            self.stdout.write(
+                f"running tasks on {options['workers']} {options['pool']}s, "
+                "Ctrl-C to stop"
+            )
+        count = run_worker(
+            workers=options["workers"],
+            pool=options["pool"],
+            poll_interval=options["poll_interval"],
+            once=options["once"],
+        )
+
+        failed = Task.objects.filter(status=Task.FAILED).count()
+        self.stdout.write(
+            self.style.SUCCESS(f"{count} tasks run, {failed} failed tasks in the queue")
+        )
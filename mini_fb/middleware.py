@@ -0,0 +1,86 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from .caching import profile_cache_key
+from .models import Profile
+
+
+def get_profile(request):
+    """
+    return the Profile of the logged-in user, or None
+    the profile is resolved once per request, and kept in the cache backend
+    between requests when MINI_FB_PROFILE_CACHE_TIMEOUT is set
+    """
+    if not hasattr(request, "_cached_profile"):
+        request._cached_profile = None
+
+        if request.user.is_authenticated:
+            timeout = getattr(settings, "MINI_FB_PROFILE_CACHE_TIMEOUT", 0)
+            key = profile_cache_key(request.user.pk)
+
+            profile = cache.get(key) if timeout else None
+            if profile is None:
+                # a user may own several profiles, the first one is theirs
+                profile = (
+                    Profile.objects.filter(user=request.user).order_by("pk").first()
+                )
+                if profile is not None and timeout:
+                    cache.set(key, profile, timeout)
+
+            request._cached_profile = profile
+
+    return request._cached_profile
+
+
+async def aget_profile(request):
+    """
+    async version of get_profile, sharing its per-request memo
+    """
+    if not hasattr(request, "_cached_profile"):
+        profile = None
+
+        user = await request.auser()
+        if user.is_authenticated:
+            timeout = getattr(settings, "MINI_FB_PROFILE_CACHE_TIMEOUT", 0)
+            key = profile_cache_key(user.pk)
+
+            profile = await cache.aget(key) if timeout else None
+            if profile is None:
+                # a user may own several profiles, the first one is theirs
+                profile = (
+                    await Profile.objects.filter(user=user).order_by("pk").afirst()
+                )
+                if profile is not None and timeout:
+                    await cache.aset(key, profile, timeout)
+
+        request._cached_profile = profile
+
+    return request._cached_profile
+
+
+class ProfileMiddleware:
+    """
+    Middleware that sets request.profile to the lazily resolved Profile
+    of the logged-in user, so views and templates share one lookup per request
+    must come after AuthenticationMiddleware
+    runs natively under both WSGI and ASGI
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.profile = SimpleLazyObject(lambda: get_profile(request))
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
@@ -0,0 +1,85 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_news_feed(apps, schema_editor):
+    """
+    materialize the news feed of every profile from the existing status messages
+    """
+    StatusMessage = apps.get_model("mini_fb", "StatusMessage")
+    Friend = apps.get_model("mini_fb", "Friend")
+    NewsFeedItem = apps.get_model("mini_fb", "NewsFeedItem")
+
+    # map each profile to the profiles that read its messages (itself and its friends)
+    readers = {}
+    for friend in Friend.objects.all():
+        readers.setdefault(friend.profile1_id, set()).add(friend.profile2_id)
+        readers.setdefault(friend.profile2_id, set()).add(friend.profile1_id)
+
+    items = []
+    for msg in StatusMessage.objects.all():
+        for reader_id in readers.get(msg.profile_id, set()) | {msg.profile_id}:
+            items.append(
+                NewsFeedItem(
+                    profile_id=reader_id, status_message=msg, timestamp=msg.timestamp
+                )
+            )
+    NewsFeedItem.objects.bulk_create(items, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_fb", "0005_profile_user"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NewsFeedItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("timestamp", models.DateTimeField()),
+                (
+                    "profile",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="news_feed_items",
+                        to="mini_fb.profile",
+                    ),
+                ),
+                (
+                    "status_message",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="feed_items",
+                        to="mini_fb.statusmessage",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["profile", "-timestamp"],
+                        name="mini_fb_new_profile_f3e0ae_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("profile", "status_message"),
+                        name="unique_news_feed_item",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_news_feed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:10
+
+from django.db import migrations
+
+
+def canonicalize_friends(apps, schema_editor):
+    """
+    store every existing friendship once, with the smaller profile pk as profile1
+    """
+    Friend = apps.get_model("mini_fb", "Friend")
+
+    seen = set()
+    for friend in Friend.objects.order_by("pk"):
+        pair = tuple(sorted([friend.profile1_id, friend.profile2_id]))
+
+        # drop self-friendships and duplicates of a friendship already kept
+        if pair[0] == pair[1] or pair in seen:
+            friend.delete()
+            continue
+        seen.add(pair)
+
+        if (friend.profile1_id, friend.profile2_id) != pair:
+            Friend.objects.filter(pk=friend.pk).update(
+                profile1_id=pair[0], profile2_id=pair[1]
+            )
+
+
+class Migration(migrations.Migration):
+    # the data fix runs in its own transaction: PostgreSQL cannot alter a table
+    # with the pending trigger events of the deleted rows, so the constraints
+    # are added by 0008_friend_constraints
+
+    dependencies = [
+        ("mini_fb", "0006_newsfeeditem"),
+    ]
+
+    operations = [
+        migrations.RunPython(canonicalize_friends, migrations.RunPython.noop),
+    ]
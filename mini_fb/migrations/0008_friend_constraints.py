@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_fb", "0007_friend_canonical_order"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="statusmessage",
+            index=models.Index(
+                fields=["profile", "-timestamp"], name="mini_fb_sta_profile_276f4e_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="friend",
+            constraint=models.UniqueConstraint(
+                fields=("profile1", "profile2"), name="unique_friend"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="friend",
+            constraint=models.CheckConstraint(
+                condition=models.Q(("profile1__lt", models.F("profile2"))),
+                name="friend_canonical_order",
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:16
+
+import mini_fb.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_fb", "0009_imagevariant"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="image",
+            name="image_file",
+            field=models.ImageField(
+                blank=True,
+                db_index=True,
+                storage=mini_fb.storage.ContentAddressedStorage(),
+                upload_to="",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="imagevariant",
+            name="file",
+            field=models.ImageField(
+                db_index=True,
+                storage=mini_fb.storage.ContentAddressedStorage(),
+                upload_to="",
+            ),
+        ),
+    ]
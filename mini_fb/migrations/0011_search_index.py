@@ -0,0 +1,82 @@
+from django.db import migrations
+
+# the index tables of mini_fb/search.py, as they were when this migration was written
+SQLITE_TABLES = [
+    (
+        "CREATE VIRTUAL TABLE mini_fb_profile_search "
+        "USING fts5(name, city, tokenize='porter unicode61')",
+        "INSERT INTO mini_fb_profile_search (rowid, name, city) "
+        "SELECT id, first_name || ' ' || last_name, city FROM mini_fb_profile",
+        "DROP TABLE IF EXISTS mini_fb_profile_search",
+    ),
+    (
+        "CREATE VIRTUAL TABLE mini_fb_statusmessage_search "
+        "USING fts5(message, tokenize='porter unicode61')",
+        "INSERT INTO mini_fb_statusmessage_search (rowid, message) "
+        "SELECT id, message FROM mini_fb_statusmessage",
+        "DROP TABLE IF EXISTS mini_fb_statusmessage_search",
+    ),
+]
+
+# no foreign keys: Django truncates its tables without CASCADE when flushing the
+# database, which PostgreSQL refuses for tables referenced by these ones. Rows
+# are deleted with their objects by the delete signals and deletion.py, and
+# search() skips the pks of objects that are gone.
+POSTGRESQL_TABLES = [
+    (
+        "CREATE TABLE mini_fb_profile_search ("
+        "id bigint PRIMARY KEY, document tsvector NOT NULL)",
+        "CREATE INDEX mini_fb_profile_search_document "
+        "ON mini_fb_profile_search USING GIN (document)",
+        "INSERT INTO mini_fb_profile_search (id, document) "
+        "SELECT id, "
+        "setweight(to_tsvector('english', first_name || ' ' || last_name), 'A') || "
+        "setweight(to_tsvector('english', city), 'B') FROM mini_fb_profile",
+        "DROP TABLE IF EXISTS mini_fb_profile_search",
+    ),
+    (
+        "CREATE TABLE mini_fb_statusmessage_search ("
+        "id bigint PRIMARY KEY, document tsvector NOT NULL)",
+        "CREATE INDEX mini_fb_statusmessage_search_document "
+        "ON mini_fb_statusmessage_search USING GIN (document)",
+        "INSERT INTO mini_fb_statusmessage_search (id, document) "
+        "SELECT id, setweight(to_tsvector('english', message), 'A') "
+        "FROM mini_fb_statusmessage",
+        "DROP TABLE IF EXISTS mini_fb_statusmessage_search",
+    ),
+]
+
+
+def vendor_tables(schema_editor):
+    """
+    return the statements creating and filling each index table, then dropping it,
+    for the database, none for databases without full-text search
+    """
+    return {"sqlite": SQLITE_TABLES, "postgresql": POSTGRESQL_TABLES}.get(
+        schema_editor.connection.vendor, []
+    )
+
+
+def create_search_index(apps, schema_editor):
+    """
+    create the index tables and index the existing profiles and status messages
+    """
+    for *statements, drop in vendor_tables(schema_editor):
+        for statement in statements:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    for *statements, drop in vendor_tables(schema_editor):
+        schema_editor.execute(drop)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_fb", "0010_content_addressed_storage"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    """
+    count the friends, status messages and images of the existing profiles
+    """
+    Profile = apps.get_model("mini_fb", "Profile")
+    StatusMessage = apps.get_model("mini_fb", "StatusMessage")
+    Image = apps.get_model("mini_fb", "Image")
+    Friend = apps.get_model("mini_fb", "Friend")
+
+    def count_rows(model, field):
+        rows = (
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(n=Count("pk"))
+            .values("n")
+        )
+        return Coalesce(Subquery(rows), 0)
+
+    StatusMessage.objects.update(image_count=count_rows(Image, "status_message"))
+    Profile.objects.update(
+        friend_count=count_rows(Friend, "profile1") + count_rows(Friend, "profile2"),
+        status_count=count_rows(StatusMessage, "profile"),
+        image_count=count_rows(Image, "status_message__profile"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_fb", "0011_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="friend_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="image_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="status_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="statusmessage",
+            name="image_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mini_fb", "0012_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingFileRemoval",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("queued", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
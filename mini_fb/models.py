@@ -1,10 +1,53 @@
 # mini_fb/models.py
-from django.db import models
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, When
+from django.db.models.functions import Coalesce
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .caching import bump_directory_version, profile_cache_key
+from .storage import ContentAddressedStorage
+
+logger = logging.getLogger(__name__)
+
+# number of friend suggestions shown to a profile
+SUGGESTION_COUNT = 10
+
+# seconds to keep the friend suggestions of a profile cached
+SUGGESTION_CACHE_TIMEOUT = 15 * 60
+
+
+class CountersMixin:
+    """
+    A mixin for models with denormalized counters, which are written only with
+    F() expressions: saving an existing instance leaves them alone, so a stale
+    instance, e.g. one saved by a form, does not undo counts made since it was read
+    """
+
+    counter_fields = []
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")
+        ):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
 
 
 # Create your models here.
-class Profile(models.Model):
+class Profile(CountersMixin, models.Model):
     """
     Model file to represent Facebook user profile data.
     """
@@ -18,6 +61,16 @@ class Profile(models.Model):
     email = models.EmailField()
     image_url = models.URLField()
 
+    # denormalized counts of the profile's friends, status messages and their images,
+    # kept current by the receivers in signals.py, see also rebuild_counters
+    friend_count = models.PositiveIntegerField(default=0)
+    status_count = models.PositiveIntegerField(default=0)
+    image_count = models.PositiveIntegerField(default=0)
+    counter_fields = ["friend_count", "status_count", "image_count"]
+
+    # memoized result of get_friends, reset whenever a friendship is added
+    _friends_cache = None
+
     def __str__(self):
         """
         Return the string representation of each Fb profile,
@@ -36,27 +89,36 @@ class Profile(models.Model):
 
         return status_messages
 
+    def friends_queryset(self):
+        """
+        return a QuerySet of the friend's profiles
+        """
+        # a Friend row stores the relationship in either direction,
+        # so select the profiles on the other side of both directions at once
+        return Profile.objects.filter(
+            Q(pk__in=Friend.objects.filter(profile1=self).values("profile2"))
+            | Q(pk__in=Friend.objects.filter(profile2=self).values("profile1"))
+        )
+
     def get_friends(self):
         """
         return a list of the friend's profiles
+        the friends are resolved in a single query and memoized on this instance,
+        so templates can call get_friends more than once per request
         """
-        friend_profiles = []
+        if self._friends_cache is None:
+            self._friends_cache = list(self.friends_queryset())
 
-        # find the queryset of Friend objects that this profile is associated with
-        friends_queryset = Friend.objects.filter(profile1=self) | Friend.objects.filter(
-            profile2=self
-        )
+        return self._friends_cache
 
-        # iterate over the friend objects queryset
-        for friend in friends_queryset:
-            # if profile1 is self, add profile2 to the list of friend profiles
-            if (friend.profile1) == self:
-                friend_profiles += [friend.profile2]
-            else:
-                # else, add profile1 to the list of friend profiles
-                friend_profiles += [friend.profile1]
+    async def aget_friends(self):
+        """
+        async version of get_friends, sharing its memoized list
+        """
+        if self._friends_cache is None:
+            self._friends_cache = [friend async for friend in self.friends_queryset()]
 
-        return friend_profiles
+        return self._friends_cache
 
     def add_friend(self, other):
         """
@@ -67,57 +129,149 @@ class Profile(models.Model):
             print("Sorry. Self-friending is not allowed.")
             return
 
-        # check if friendship has existed
-        friendship_count = Friend.objects.filter(
-            profile1=self, profile2=other
-        ) | Friend.objects.filter(profile1=other, profile2=self)
-        if len(friendship_count) != 0:
+        # Friend rows are stored in canonical order, the smaller pk first
+        profile1, profile2 = sorted([self, other], key=lambda profile: profile.pk)
+
+        # check if friendship has existed, using the unique (profile1, profile2) index
+        if Friend.objects.filter(profile1=profile1, profile2=profile2).exists():
             print("Friend relationship already exists.")
             return
 
         # otherwise, create the friend relationship
-        new_friend = Friend.objects.create(profile1=self, profile2=other)
+        # a concurrent request may have created it since the check,
+        # in which case the unique constraint rejects the duplicate
+        try:
+            with transaction.atomic():
+                new_friend = Friend.objects.create(profile1=profile1, profile2=profile2)
+                # backfill each news feed with the existing status messages of
+                # the new friend, in the background
+                Task.enqueue(
+                    "mini_fb.tasks.backfill_friend_feeds",
+                    profile1.pk,
+                    profile2.pk,
+                    key=f"backfill_friend_feeds:{new_friend.pk}",
+                )
+        except IntegrityError:
+            print("Friend relationship already exists.")
+            return
+
+        # the memoized friend lists and the friend suggestions of both profiles are now stale
+        self._friends_cache = None
+        other._friends_cache = None
+        self.clear_friend_suggestions()
+        other.clear_friend_suggestions()
+
         print(f"{new_friend} have become friends.")
         return new_friend
 
-    def get_friend_suggestions(self):
+    def backfill_news_feeds(self, other):
         """
-        return a QuerySet of possible friends for a Profile
-        the friend suggestion QuerySet should not include the current Profile,
-        and not include Profiles that are already friend with the current Profile and
+        add the existing status messages of each profile to the news feed of the other
         """
+        NewsFeedItem.objects.bulk_create(
+            [
+                NewsFeedItem(profile=self, status_message=msg, timestamp=msg.timestamp)
+                for msg in other.get_status_messages()
+            ]
+            + [
+                NewsFeedItem(profile=other, status_message=msg, timestamp=msg.timestamp)
+                for msg in self.get_status_messages()
+            ],
+            ignore_conflicts=True,
+        )
 
-        # get the list of friends of the current Profile
-        friends = self.get_friends()
+    def get_friend_suggestions(self):
+        """
+        return a list of the top SUGGESTION_COUNT possible friends for a Profile,
+        ranked by the number of mutual friends, then by living in the same city
+        the friend suggestion list should not include the current Profile,
+        and not include Profiles that are already friend with the current Profile
+        the ranked list is cached until a friendship changes the friend graph
+        """
+        cache_key = f"mini_fb:friend_suggestions:{self.pk}"
+        suggestions = cache.get(cache_key)
+        if suggestions is not None:
+            return suggestions
 
         # get the list of friend's pk
-        friend_pks = [friend.pk for friend in friends]
+        friend_pks = [friend.pk for friend in self.get_friends()]
+        excluded = friend_pks + [self.pk]
+
+        def mutual_count(side, other_side):
+            # number of Friend rows linking the candidate (on side) to one of our friends
+            rows = (
+                Friend.objects.filter(
+                    **{side: OuterRef("pk"), f"{other_side}__in": friend_pks}
+                )
+                .order_by()
+                .values(side)
+                .annotate(n=Count("pk"))
+                .values("n")
+            )
+            return Coalesce(Subquery(rows), 0)
+
+        def first(profiles):
+            # the first SUGGESTION_COUNT of profiles that are not excluded
+            return Q(
+                pk__in=profiles.exclude(pk__in=excluded)
+                .order_by("pk")
+                .values("pk")[:SUGGESTION_COUNT]
+            )
+
+        # only the friends of friends, found through the Friend rows of the friends
+        # in either direction, have mutual friends; the profiles without are ranked
+        # by city then pk, so the first ones of the city and of the other cities
+        # complete the list when there are too few friends of friends
+        candidates = Profile.objects.filter(
+            Q(pk__in=Friend.objects.filter(profile1__in=friend_pks).values("profile2"))
+            | Q(
+                pk__in=Friend.objects.filter(profile2__in=friend_pks).values("profile1")
+            )
+            | first(Profile.objects.filter(city=self.city))
+            | first(Profile.objects.exclude(city=self.city))
+        )
 
-        # get the QuerySet of possible friend suggestions
-        suggestions = Profile.objects.exclude(pk__in=friend_pks).exclude(pk=self.pk)
+        # rank the candidates in the database and keep the top ones
+        suggestions = list(
+            candidates.exclude(pk__in=excluded)
+            .annotate(
+                mutual_friends=mutual_count("profile1", "profile2")
+                + mutual_count("profile2", "profile1"),
+                same_city=Case(When(city=self.city, then=1), default=0),
+            )
+            .order_by("-mutual_friends", "-same_city", "pk")[:SUGGESTION_COUNT]
+        )
 
+        cache.set(cache_key, suggestions, SUGGESTION_CACHE_TIMEOUT)
         return suggestions
 
+    def clear_friend_suggestions(self):
+        """
+        drop the cached friend suggestions of this profile and of its friends,
+        whose mutual friend counts depend on this profile's friendships
+        """
+        profiles = self.get_friends() + [self]
+        cache.delete_many(
+            [f"mini_fb:friend_suggestions:{profile.pk}" for profile in profiles]
+        )
+
     def get_news_feed(self):
         """
         return a QuerySet of all StatusMessages for the profile on which the method was called,
         as well as all of the friends of that profile
+        the feed is read from the materialized NewsFeedItem rows of this profile
         """
-        # get the friend list of the current profile
-        friends = self.get_friends()
-
-        # add the current profile to the list of friend profiles
-        newsfeed_profiles = friends + [self]
-
-        # get the QuerySet of StatusMessage associated with the newsfeed profiles
-        msgs = StatusMessage.objects.filter(profile__in=newsfeed_profiles).order_by(
-            "-timestamp"
+        msgs = (
+            StatusMessage.objects.filter(feed_items__profile=self)
+            .annotate(feed_timestamp=F("feed_items__timestamp"))
+            .select_related("profile")
+            .order_by("-feed_timestamp")
         )
 
         return msgs
 
 
-class StatusMessage(models.Model):
+class StatusMessage(CountersMixin, models.Model):
     """
     Model to represent Facebook status messages for a profile
     """
@@ -126,6 +280,13 @@ class StatusMessage(models.Model):
     message = models.TextField()
     # foreign key references a Profile
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    # denormalized count of the message's images, see Profile.image_count
+    image_count = models.PositiveIntegerField(default=0)
+    counter_fields = ["image_count"]
+
+    class Meta:
+        # serves the newest-first status message lists of a profile
+        indexes = [models.Index(fields=["profile", "-timestamp"])]
 
     def __str__(self):
         """
@@ -136,8 +297,32 @@ class StatusMessage(models.Model):
     def get_images(self):
         """
         Get all associated images for this StatusMessage
+        uses the related manager so images prefetched with prefetch_related("images")
+        are served without another query
+        """
+        return self.images.all()
+
+    def fan_out(self):
+        """
+        push this StatusMessage into the news feed of its author and of every friend,
+        or refresh the feed timestamps if the message has already been pushed
         """
-        return Image.objects.filter(status_message=self)
+        updated = NewsFeedItem.objects.filter(status_message=self).update(
+            timestamp=self.timestamp
+        )
+        if updated:
+            return
+
+        readers = self.profile.get_friends() + [self.profile]
+        NewsFeedItem.objects.bulk_create(
+            [
+                NewsFeedItem(
+                    profile=reader, status_message=self, timestamp=self.timestamp
+                )
+                for reader in readers
+            ],
+            ignore_conflicts=True,
+        )
 
 
 class Image(models.Model):
@@ -148,7 +333,10 @@ class Image(models.Model):
     status_message = models.ForeignKey(
         StatusMessage, on_delete=models.CASCADE, related_name="images"
     )
-    image_file = models.ImageField(blank=True)
+    # identical uploads share one file, see mini_fb/storage.py
+    image_file = models.ImageField(
+        blank=True, storage=ContentAddressedStorage(), db_index=True
+    )
     timestamp = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -157,6 +345,140 @@ class Image(models.Model):
         """
         return self.image_file.url
 
+    def get_srcset(self):
+        """
+        return the srcset of the downscaled variants in the original's format,
+        for the <img> element
+        uses the related manager so variants prefetched with
+        prefetch_related("images__variants") are served without another query
+        """
+        return ", ".join(
+            f"{variant.file.url} {variant.width}w"
+            for variant in self.variants.all()
+            if variant.format == ImageVariant.FALLBACK_FORMAT
+        )
+
+    def get_sources(self):
+        """
+        return a list of (mime type, srcset) pairs of the downscaled variants
+        in the modern formats, best first, for the <source> elements of a <picture>
+        """
+        sources = []
+        for image_format, mime_type in ImageVariant.MODERN_FORMATS:
+            srcset = ", ".join(
+                f"{variant.file.url} {variant.width}w"
+                for variant in self.variants.all()
+                if variant.format == image_format
+            )
+            if srcset:
+                sources.append((mime_type, srcset))
+        return sources
+
+
+class ImageVariant(models.Model):
+    """
+    Model to represent a downscaled copy of an Image, generated in the background
+    """
+
+    # the format of the variants every browser can show
+    FALLBACK_FORMAT = "JPEG"
+    # (Pillow format, mime type) of the smaller formats, best first
+    MODERN_FORMATS = [("AVIF", "image/avif"), ("WEBP", "image/webp")]
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="variants")
+    # the size name of the variant, e.g. thumbnail or feed
+    name = models.CharField(max_length=20)
+    # the Pillow format name of the file, e.g. JPEG or WEBP
+    format = models.CharField(max_length=10)
+    file = models.ImageField(storage=ContentAddressedStorage(), db_index=True)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["image", "name", "format"], name="unique_image_variant"
+            )
+        ]
+
+    def __str__(self):
+        """
+        Return the string representation for the image variant
+        """
+        return f"{self.file.url} ({self.width}x{self.height})"
+
+
+class PendingFileRemoval(models.Model):
+    """
+    Model to represent a media file that may have lost its last reference,
+    queued by the bulk deletions of deletion.py for the file sweeper
+    """
+
+    # the storage name of the file
+    name = models.CharField(max_length=255, unique=True)
+    queued = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        """
+        Return the string representation for the pending file removal
+        """
+        return self.name
+
+
+def update_counters(profiles, **deltas):
+    """
+    add deltas to the counters of the profiles of a queryset,
+    e.g. update_counters(Profile.objects.filter(pk=pk), status_count=1)
+    the counters are changed with F() expressions, so concurrent changes add up
+    """
+    user_pks = list(profiles.values_list("user_id", flat=True))
+    profiles.update(**{field: F(field) + delta for field, delta in deltas.items()})
+
+    # update() sends no signals: drop the profiles cached by ProfileMiddleware,
+    # and the directory, which shows the counters
+    cache.delete_many([profile_cache_key(pk) for pk in user_pks])
+    bump_directory_version()
+
+
+def count_rows(queryset, field):
+    """
+    return an expression counting the rows of queryset whose field is the outer pk
+    """
+    rows = (
+        queryset.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(n=Count("pk"))
+        .values("n")
+    )
+    return Coalesce(Subquery(rows), 0)
+
+
+def rebuild_counters(profile_pks=None):
+    """
+    recount the counters of the profiles with profile_pks, or of every profile,
+    and of their status messages, from the child tables
+    """
+    profiles = Profile.objects.all()
+    messages = StatusMessage.objects.all()
+    if profile_pks is not None:
+        profiles = profiles.filter(pk__in=profile_pks)
+        messages = messages.filter(profile__in=profile_pks)
+
+    messages.update(image_count=count_rows(Image.objects.all(), "status_message"))
+    updated = profiles.update(
+        friend_count=count_rows(Friend.objects.all(), "profile1")
+        + count_rows(Friend.objects.all(), "profile2"),
+        status_count=count_rows(StatusMessage.objects.all(), "profile"),
+        image_count=count_rows(Image.objects.all(), "status_message__profile"),
+    )
+
+    cache.delete_many(
+        [profile_cache_key(pk) for pk in profiles.values_list("user_id", flat=True)]
+    )
+    bump_directory_version()
+    return updated
+
 
 class Friend(models.Model):
     """
@@ -171,6 +493,17 @@ class Friend(models.Model):
     )
     timestamp = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # each friendship is stored once, with the smaller profile pk as profile1
+        constraints = [
+            models.UniqueConstraint(
+                fields=["profile1", "profile2"], name="unique_friend"
+            ),
+            models.CheckConstraint(
+                condition=Q(profile1__lt=F("profile2")), name="friend_canonical_order"
+            ),
+        ]
+
     def __str__(self):
         """
         Return a string representation for a friend relationship between 2 profiles
@@ -178,3 +511,130 @@ class Friend(models.Model):
         profile1_fullname = self.profile1.first_name + self.profile1.last_name
         profile2_fullname = self.profile2.first_name + self.profile2.last_name
         return f"{profile1_fullname} & {profile2_fullname}"
+
+
+class NewsFeedItem(models.Model):
+    """
+    Model to represent one StatusMessage in the materialized news feed of a profile
+    rows are written when a message is created or a friendship is added,
+    and are removed together with their StatusMessage
+    """
+
+    # the profile whose news feed shows the message
+    profile = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, related_name="news_feed_items"
+    )
+    status_message = models.ForeignKey(
+        StatusMessage, on_delete=models.CASCADE, related_name="feed_items"
+    )
+    # copy of the StatusMessage timestamp, so the feed is read from this table's index
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=["profile", "-timestamp"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["profile", "status_message"], name="unique_news_feed_item"
+            )
+        ]
+
+    def __str__(self):
+        """
+        Return a string representation for a news feed item
+        """
+        return f"{self.profile}: {self.status_message}"
+
+
+class Task(models.Model):
+    """
+    Model to represent a function call queued for the run_tasks worker, see
+    mini_fb/worker.py
+    a task is queued in the transaction of the write it follows, so it runs only
+    if the write commits; a failed task is retried with exponential backoff,
+    up to max_attempts times
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    # the dotted path of the function, e.g. mini_fb.tasks.fan_out_status_message
+    name = models.CharField(max_length=200)
+    # the positional arguments of the function, as JSON
+    args = models.JSONField(default=list)
+    # tasks with the same key are queued once
+    key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # when a queued task is due, or when a running task's worker is presumed dead
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # serves the workers' search for due tasks
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self):
+        """
+        Return the string representation for the task
+        """
+        return f"{self.name}{tuple(self.args)} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, name, *args, key=None, max_attempts=5, delay=0):
+        """
+        run the function with the dotted path name with args after the current
+        transaction commits, and at least delay seconds from now: queued for the
+        worker, or at the end of the request when MINI_FB_TASK_QUEUE is "inline"
+        a task with the key of an earlier task is dropped, unless that task
+        failed for good, which is queued again instead; a delayed task is dropped
+        in inline mode, where nothing runs later
+        """
+        if getattr(settings, "MINI_FB_TASK_QUEUE", "database") == "inline":
+            if not delay:
+                transaction.on_commit(lambda: run_inline(name, args))
+            return
+
+        run_after = timezone.now() + timedelta(seconds=delay)
+        if key is not None:
+            cls.objects.filter(key=key, status=cls.FAILED).update(
+                name=name,
+                args=list(args),
+                status=cls.QUEUED,
+                attempts=0,
+                max_attempts=max_attempts,
+                run_after=run_after,
+                last_error="",
+            )
+        cls.objects.bulk_create(
+            [
+                cls(
+                    name=name,
+                    args=list(args),
+                    key=key,
+                    max_attempts=max_attempts,
+                    run_after=run_after,
+                )
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def run_inline(name, args):
+    """
+    run the function with the dotted path name with args, logging any failure
+    """
+    try:
+        import_string(name)(*args)
+    except Exception:
+        logger.exception("task %s%s failed", name, tuple(args))
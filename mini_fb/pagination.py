@@ -0,0 +1,139 @@
+"""
+Keyset (cursor) pagination for the mini_fb list pages.
+
+A page is selected by the sort key of the last row of the previous page,
+so every page costs the same indexed range scan no matter how deep it is.
+"""
+
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+from django.http import Http404
+
+# number of rows shown on one page
+PAGE_SIZE = 20
+
+
+def encode_cursor(*values):
+    """
+    return an opaque, URL-safe cursor string for the given sort key values
+    """
+    raw = "|".join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    return the list of sort key strings stored in a cursor
+    raise Http404 if the cursor has been tampered with
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+    except (binascii.Error, UnicodeDecodeError):
+        raise Http404("Invalid page cursor.")
+
+
+class KeysetPage:
+    """
+    One page of rows of a keyset paginated queryset.
+    The rows are only fetched when the page is first used, so a template
+    fragment served from the cache never runs the page query.
+    """
+
+    def __init__(self, queryset, page_size, cursor_of):
+        self.queryset = queryset
+        self.page_size = page_size
+        # function returning the cursor that continues after a given row
+        self.cursor_of = cursor_of
+        self._rows = None
+        self._next_cursor = None
+
+    def _fetch(self):
+        """
+        run the page query once, fetching one extra row to find out
+        whether there is a next page
+        """
+        if self._rows is None:
+            rows = list(self.queryset[: self.page_size + 1])
+            if len(rows) > self.page_size:
+                rows = rows[: self.page_size]
+                self._next_cursor = self.cursor_of(rows[-1])
+            self._rows = rows
+        return self._rows
+
+    async def afetch(self):
+        """
+        run the page query from async code, so rendering the page needs no query
+        """
+        if self._rows is None:
+            rows = [row async for row in self.queryset[: self.page_size + 1]]
+            if len(rows) > self.page_size:
+                rows = rows[: self.page_size]
+                self._next_cursor = self.cursor_of(rows[-1])
+            self._rows = rows
+        return self._rows
+
+    @property
+    def next_cursor(self):
+        """
+        the cursor of the next page, or None on the last page
+        """
+        self._fetch()
+        return self._next_cursor
+
+    def __iter__(self):
+        return iter(self._fetch())
+
+    def __len__(self):
+        return len(self._fetch())
+
+    def __bool__(self):
+        return bool(self._fetch())
+
+
+def paginate_by_timestamp(
+    queryset, cursor=None, field="timestamp", page_size=PAGE_SIZE
+):
+    """
+    return the KeysetPage of a queryset listed newest first that starts after cursor
+    rows are ordered on (field, pk), so rows sharing a timestamp are never skipped
+    """
+    queryset = queryset.order_by(f"-{field}", "-pk")
+
+    if cursor:
+        try:
+            timestamp, pk = decode_cursor(cursor)
+            timestamp, pk = datetime.fromisoformat(timestamp), int(pk)
+        except ValueError:
+            raise Http404("Invalid page cursor.")
+
+        queryset = queryset.filter(
+            Q(**{f"{field}__lt": timestamp}) | Q(**{field: timestamp, "pk__lt": pk})
+        )
+
+    return KeysetPage(
+        queryset,
+        page_size,
+        lambda row: encode_cursor(getattr(row, field).isoformat(), row.pk),
+    )
+
+
+def paginate_by_id(queryset, cursor=None, page_size=PAGE_SIZE):
+    """
+    return the KeysetPage of a queryset listed in pk order that starts after cursor
+    """
+    queryset = queryset.order_by("pk")
+
+    if cursor:
+        try:
+            (pk,) = decode_cursor(cursor)
+            pk = int(pk)
+        except ValueError:
+            raise Http404("Invalid page cursor.")
+
+        queryset = queryset.filter(pk__gt=pk)
+
+    return KeysetPage(queryset, page_size, lambda row: encode_cursor(row.pk))
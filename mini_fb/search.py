@@ -0,0 +1,212 @@
+"""
+Full-text search over profiles and status messages.
+
+Each searchable model has an index table keyed by the object's pk and kept
+current by the save and delete signals (see signals.py):
+
+- SQLite: an FTS5 virtual table, ranked with bm25()
+- PostgreSQL: a tsvector column with a GIN index, ranked with ts_rank()
+
+The tables are created by migration 0011_search_index. Other databases fall
+back to icontains filters.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Profile, StatusMessage
+
+# number of results per page
+PAGE_SIZE = 20
+
+# the words of a query that are searched, the rest are ignored
+MAX_TERMS = 10
+
+
+def search_terms(query):
+    """
+    return the words of query, lowercased
+    punctuation is dropped, so the terms are safe to put in a MATCH or tsquery
+    """
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+
+class SearchIndex:
+    """
+    The index table of a model, see the module docstring
+    columns are the names of the indexed texts, most important for ranking first,
+    and values returns them for an object
+    """
+
+    def __init__(self, model, table, columns, values, search_fields):
+        self.model = model
+        self.table = table
+        self.columns = columns
+        self.values = values
+        # the fields searched by the icontains fallback
+        self.search_fields = search_fields
+
+    def document_sql(self):
+        """
+        return the PostgreSQL expression of the tsvector of the column values,
+        weighted A, B, ... in column order
+        """
+        return " || ".join(
+            f"setweight(to_tsvector('english', %s), '{'ABCD'[i]}')"
+            for i in range(len(self.columns))
+        )
+
+    def update(self, objects):
+        """
+        index objects, replacing what was indexed for them before
+        """
+        objects = [obj for obj in objects if obj.pk is not None]
+        if not objects or connection.vendor not in ("sqlite", "postgresql"):
+            return
+
+        rows = [[obj.pk, *self.values(obj)] for obj in objects]
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                self.delete([obj.pk for obj in objects])
+                placeholders = ", ".join(["%s"] * (len(self.columns) + 1))
+                cursor.executemany(
+                    f"INSERT INTO {self.table} (rowid, {', '.join(self.columns)}) "
+                    f"VALUES ({placeholders})",
+                    rows,
+                )
+            else:
+                cursor.executemany(
+                    f"INSERT INTO {self.table} (id, document) "
+                    f"VALUES (%s, {self.document_sql()}) "
+                    "ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document",
+                    rows,
+                )
+
+    def delete(self, pks):
+        """
+        remove the objects with pks from the index
+        """
+        pks = list(pks)
+        if not pks or connection.vendor not in ("sqlite", "postgresql"):
+            return
+
+        key = "rowid" if connection.vendor == "sqlite" else "id"
+        placeholders = ", ".join(["%s"] * len(pks))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE {key} IN ({placeholders})", pks
+            )
+
+    def search(self, terms, offset, limit):
+        """
+        return the pks of the objects matching every term, best first
+        the last term also matches as a prefix, for search-as-you-type
+        """
+        if not terms:
+            return []
+
+        if connection.vendor == "sqlite":
+            match = " ".join(f'"{term}"' for term in terms) + "*"
+            # bm25 weighs each column, the first one highest
+            weights = ", ".join(str(10.0 / (i + 1)) for i in range(len(self.columns)))
+            sql = (
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s "
+                f"ORDER BY bm25({self.table}, {weights}), rowid LIMIT %s OFFSET %s"
+            )
+        elif connection.vendor == "postgresql":
+            match = " & ".join(terms) + ":*"
+            sql = (
+                f"SELECT id FROM {self.table}, to_tsquery('english', %s) query "
+                "WHERE document @@ query "
+                "ORDER BY ts_rank(document, query) DESC, id LIMIT %s OFFSET %s"
+            )
+        else:
+            condition = Q()
+            for term in terms:
+                condition &= Q.create(
+                    [(f"{field}__icontains", term) for field in self.search_fields],
+                    connector=Q.OR,
+                )
+            return list(
+                self.model.objects.filter(condition)
+                .order_by("-pk")
+                .values_list("pk", flat=True)[offset : offset + limit]
+            )
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+PROFILE_INDEX = SearchIndex(
+    Profile,
+    "mini_fb_profile_search",
+    ["name", "city"],
+    lambda profile: [f"{profile.first_name} {profile.last_name}", profile.city],
+    ["first_name", "last_name", "city"],
+)
+
+STATUS_MESSAGE_INDEX = SearchIndex(
+    StatusMessage,
+    "mini_fb_statusmessage_search",
+    ["message"],
+    lambda status_message: [status_message.message],
+    ["message"],
+)
+
+
+class SearchPage:
+    """
+    A page of ranked search results
+    """
+
+    def __init__(self, object_list, number, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def next_page_number(self):
+        return self.number + 1
+
+
+def search(index, queryset, query, page=1, page_size=PAGE_SIZE):
+    """
+    return the SearchPage number page of the objects of queryset matching query
+    in index, best first
+    """
+    offset = (page - 1) * page_size
+    # one more result than shown tells if there is a next page
+    pks = index.search(search_terms(query), offset, page_size + 1)
+    objects = queryset.in_bulk(pks[:page_size])
+    return SearchPage(
+        [objects[pk] for pk in pks[:page_size] if pk in objects],
+        page,
+        len(pks) > page_size,
+    )
+
+
+def search_profiles(query, page=1):
+    """
+    return a SearchPage of the profiles whose name or city match query
+    """
+    return search(PROFILE_INDEX, Profile.objects.all(), query, page)
+
+
+def search_status_messages(query, page=1):
+    """
+    return a SearchPage of the status messages whose text matches query
+    """
+    return search(
+        STATUS_MESSAGE_INDEX,
+        StatusMessage.objects.select_related("profile"),
+        query,
+        page,
+    )
@@ -0,0 +1,155 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth import user_cache_key
+from .caching import bump_directory_version, bump_profile_versions, profile_cache_key
+from .models import (
+    Friend,
+    Image,
+    ImageVariant,
+    Profile,
+    StatusMessage,
+    update_counters,
+)
+from .search import PROFILE_INDEX, STATUS_MESSAGE_INDEX
+from .storage import release_file
+
+
+@receiver([post_save, post_delete], sender=User)
+def clear_cached_user(sender, instance, **kwargs):
+    """
+    drop the cached user when it changes, e.g. its password or active state
+    """
+    cache.delete(user_cache_key(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def clear_cached_profile(sender, instance, **kwargs):
+    """
+    drop the cached profile of the profile's user when the profile changes
+    """
+    cache.delete(profile_cache_key(instance.user_id))
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def bump_profile_version(sender, instance, **kwargs):
+    """
+    a profile is shown on its own page, on its friends' pages and feeds,
+    and in the directory
+    """
+    friends = instance.get_friends() if kwargs["signal"] is post_save else []
+    bump_profile_versions([instance.pk] + [friend.pk for friend in friends])
+    bump_directory_version()
+
+
+@receiver([post_save, post_delete], sender=StatusMessage)
+def bump_status_message_version(sender, instance, **kwargs):
+    """
+    a status message is shown on its profile's page and in the feeds that
+    combine the profile's version
+    """
+    bump_profile_versions([instance.profile_id])
+
+
+@receiver([post_save, post_delete], sender=Image)
+def bump_image_version(sender, instance, **kwargs):
+    """
+    an image is shown with its status message
+    """
+    profile_id = (
+        StatusMessage.objects.filter(pk=instance.status_message_id)
+        .values_list("profile_id", flat=True)
+        .first()
+    )
+    if profile_id is not None:
+        bump_profile_versions([profile_id])
+
+
+@receiver([post_save, post_delete], sender=Friend)
+def bump_friend_version(sender, instance, **kwargs):
+    """
+    a friendship is shown on the pages and feeds of both profiles
+    """
+    bump_profile_versions([instance.profile1_id, instance.profile2_id])
+
+
+@receiver(post_delete, sender=Image)
+def release_image_file(sender, instance, **kwargs):
+    """
+    delete the image file when no other Image shares it
+    """
+    release_file(instance.image_file, Image, "image_file")
+
+
+@receiver(post_delete, sender=ImageVariant)
+def release_variant_file(sender, instance, **kwargs):
+    """
+    delete the variant file when no other ImageVariant shares it
+    """
+    release_file(instance.file, ImageVariant, "file")
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=StatusMessage)
+def update_search_index(sender, instance, **kwargs):
+    """
+    index the new text of a profile or status message
+    """
+    index = PROFILE_INDEX if sender is Profile else STATUS_MESSAGE_INDEX
+    index.update([instance])
+
+
+@receiver(post_delete, sender=Profile)
+@receiver(post_delete, sender=StatusMessage)
+def remove_from_search_index(sender, instance, **kwargs):
+    """
+    remove a deleted profile or status message from the search results
+    """
+    index = PROFILE_INDEX if sender is Profile else STATUS_MESSAGE_INDEX
+    index.delete([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Friend)
+def count_friend(sender, instance, **kwargs):
+    """
+    count a new or deleted friendship on both profiles
+    """
+    if kwargs.get("created") is False:
+        return
+    delta = 1 if kwargs["signal"] is post_save else -1
+    update_counters(
+        Profile.objects.filter(pk__in=[instance.profile1_id, instance.profile2_id]),
+        friend_count=delta,
+    )
+
+
+@receiver([post_save, post_delete], sender=StatusMessage)
+def count_status_message(sender, instance, **kwargs):
+    """
+    count a new or deleted status message on its profile
+    the images of a deleted message are deleted, and counted, before it
+    """
+    if kwargs.get("created") is False:
+        return
+    delta = 1 if kwargs["signal"] is post_save else -1
+    update_counters(Profile.objects.filter(pk=instance.profile_id), status_count=delta)
+
+
+@receiver([post_save, post_delete], sender=Image)
+def count_image(sender, instance, **kwargs):
+    """
+    count a new or deleted image on its status message and its profile
+    """
+    if kwargs.get("created") is False:
+        return
+    delta = 1 if kwargs["signal"] is post_save else -1
+    StatusMessage.objects.filter(pk=instance.status_message_id).update(
+        image_count=F("image_count") + delta
+    )
+    update_counters(
+        Profile.objects.filter(statusmessage=instance.status_message_id),
+        image_count=delta,
+    )
@@ -0,0 +1,112 @@
+"""
+Content-addressed storage for the mini_fb image files.
+
+A file is stored once under a path derived from the SHA-256 of its content,
+sharded in two directory levels (ab/cd/abcd....jpg), however many times it
+is uploaded. Its URL therefore never changes meaning and can be cached
+forever. The rows referencing a path are its reference count: the file is
+removed when the last one is deleted.
+
+An upload identical to a stored file writes nothing, but touches the file, and
+the row referencing it commits later. A file modified less than
+MINI_FB_FILE_GRACE_PERIOD seconds ago is therefore never deleted, even when no
+row references it yet: see delete_if_stale.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    A FileSystemStorage that names files after the hash of their content
+    """
+
+    def _save(self, name, content):
+        """
+        stream content into a temporary file while hashing it, then move it
+        to its content address unless an identical file is already stored
+        return the content address
+        """
+        extension = os.path.splitext(name)[1].lower()
+        os.makedirs(self.location, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.location, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+
+            address = digest.hexdigest()
+            name = f"{address[:2]}/{address[2:4]}/{address}{extension}"
+            path = self.path(name)
+
+            try:
+                # an identical file is stored: mark it in use for the grace period
+                os.utime(path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                # an atomic rename, so readers never see a partial file
+                os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        """
+        keep the name as it is, _save replaces it with the content address
+        """
+        return name
+
+    def delete_if_stale(self, name):
+        """
+        delete the file with name, which no row referenced when it was checked,
+        unless it was stored or uploaded again within the grace period, by an
+        upload whose row may not have committed yet
+        return False if the file was kept
+        """
+        path = self.path(name)
+        doomed = f"{path}.deleting"
+        try:
+            # once the file is moved away, _save can no longer touch it and
+            # stores a new copy instead
+            os.replace(path, doomed)
+        except FileNotFoundError:
+            return True
+
+        grace = getattr(settings, "MINI_FB_FILE_GRACE_PERIOD", 600)
+        if os.path.getmtime(doomed) > time.time() - grace:
+            # a copy stored in the meantime has the same content
+            os.replace(doomed, path)
+            return False
+        os.remove(doomed)
+        return True
+
+
+def release_file(field_file, model, field_name):
+    """
+    delete a stored file once the transaction commits, unless another row of
+    model still references it or it is within its grace period
+    a file kept for its grace period is left to the collect_orphaned_media command
+    """
+    name = field_file.name
+    if not name:
+        return
+
+    def delete_if_unreferenced():
+        if not model.objects.filter(**{field_name: name}).exists():
+            field_file.storage.delete_if_stale(name)
+
+    transaction.on_commit(delete_if_unreferenced)
@@ -0,0 +1,34 @@
+"""
+The work that follows the mini_fb writes, run as Tasks by the run_tasks worker.
+
+Each task takes primary keys, reloads what it needs, and can run more than
+once with the same result, since a task whose worker dies is run again.
+Objects deleted before their task's turn are skipped.
+"""
+
+from .caching import bump_profile_versions
+from .models import Profile, StatusMessage
+
+
+def fan_out_status_message(message_pk):
+    """
+    push a new or updated status message into the news feeds of its author and
+    of the author's friends
+    """
+    sm = StatusMessage.objects.select_related("profile").filter(pk=message_pk).first()
+    if sm is None:
+        return
+    sm.fan_out()
+    # the cached feeds combine the author's version
+    bump_profile_versions([sm.profile_id])
+
+
+def backfill_friend_feeds(profile1_pk, profile2_pk):
+    """
+    add the status messages of each of two new friends to the news feed of the other
+    """
+    profiles = Profile.objects.in_bulk([profile1_pk, profile2_pk])
+    if len(profiles) < 2:
+        return
+    profiles[profile1_pk].backfill_news_feeds(profiles[profile2_pk])
+    bump_profile_versions([profile1_pk, profile2_pk])
@@ -1,3 +1,1586 @@
-from django.test import TestCase
+import contextlib
+import io
+import json
+import os
+import re
+import signal
+import sys
+import tempfile
+import time
+import zipfile
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.test import (
+    AsyncRequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from cs412 import metrics
+
+from . import benchmark
+from .deletion import (
+    delete_profiles,
+    delete_status_messages,
+    queue_file_removals,
+    raw_delete,
+    sweep_files,
+)
+from .async_views import (
+    AsyncShowAllProfilesView,
+    AsyncShowNewsFeedView,
+    AsyncShowProfileForUser,
+    AsyncShowProfilePageView,
+)
+from .pagination import (
+    PAGE_SIZE,
+    encode_cursor,
+    paginate_by_id,
+    paginate_by_timestamp,
+)
+from .models import (
+    Friend,
+    Image,
+    ImageVariant,
+    NewsFeedItem,
+    PendingFileRemoval,
+    Profile,
+    StatusMessage,
+    Task,
+    rebuild_counters,
+)
+from .search import search_profiles, search_status_messages
+from .storage import ContentAddressedStorage
+from .worker import TASK_LEASE, purge_finished_tasks, run_due_tasks
 
 # Create your tests here.
+# the query count tests render every page in full, without cached fragments
+NO_CACHE = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+
+def png_bytes(seed=0):
+    """
+    return the content of a small PNG file, different for each seed
+    """
+    buffer = io.BytesIO()
+    PILImage.new("RGB", (64, 48), (seed % 256, 0, 0)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+# the files on the stack of every query, left out of query_origin
+QUERY_ORIGIN_SKIPPED = {
+    __file__,
+    metrics.__file__,
+    os.path.join(settings.BASE_DIR, "manage.py"),
+    os.path.join(settings.BASE_DIR, "mini_fb", "middleware.py"),
+}
+
+
+def query_origin(frame):
+    """
+    return where the query run below frame comes from: the innermost template
+    tag or variable being rendered, and the project functions on the stack
+    """
+    template = None
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        if template is None and code.co_name == "render_annotated":
+            # django.template.base.Node.render_annotated of the node being rendered
+            node = frame.f_locals.get("self")
+            token = getattr(node, "token", None)
+            if token is not None and node.origin is not None:
+                template = (
+                    f"{node.origin.template_name}:{token.lineno} {token.contents!r}"
+                )
+        elif (
+            code.co_filename.startswith(str(settings.BASE_DIR))
+            and "site-packages" not in code.co_filename
+            and code.co_filename not in QUERY_ORIGIN_SKIPPED
+        ):
+            path = os.path.relpath(code.co_filename, settings.BASE_DIR)
+            functions.append(f"{path}:{frame.f_lineno} in {code.co_name}()")
+        frame = frame.f_back
+    # the three innermost functions tell where the query was made
+    functions = functions[:3]
+    return [template] + functions if template else functions
+
+
+class MiniFbTestCase(TestCase):
+    """
+    A TestCase with helpers to create profiles and to store media in a
+    temporary directory
+    """
+
+    def use_temporary_media(self):
+        """
+        store the media written by the test in a temporary directory
+        """
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+    def create_profile(self, user, first_name="Test", **fields):
+        """
+        return a new profile of user, with fields replacing the default ones
+        """
+        fields = {
+            "last_name": "User",
+            "city": "Boston",
+            "email": "test@example.com",
+            "image_url": "https://example.com/test.jpg",
+            **fields,
+        }
+        return Profile.objects.create(user=user, first_name=first_name, **fields)
+
+    def create_profiles(self, user, count):
+        """
+        return count new profiles of user, named Test0, Test1...
+        """
+        return [self.create_profile(user, f"Test{i}") for i in range(count)]
+
+
+class QueryRecorder:
+    """
+    Context manager recording the SQL of every query run in it,
+    with the origin of each query (see query_origin)
+    """
+
+    def __enter__(self):
+        self.queries = []
+        self.wrapper = connection.execute_wrapper(self.record)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wrapper.__exit__(*exc_info)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def record(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        # executemany runs one statement with many parameter lists, keep the SQL
+        if not many:
+            sql = connection.ops.last_executed_query(context["cursor"], sql, params)
+        self.queries.append((sql, query_origin(sys._getframe(1))))
+        return result
+
+
+def query_shape(sql):
+    """
+    return sql with its numbers replaced, so queries differing only in ids compare equal
+    """
+    return re.sub(r"\b\d+\b", "N", sql)
+
+
+@override_settings(CACHES=NO_CACHE, MINI_FB_TASK_QUEUE="inline")
+class ViewQueryCountTest(MiniFbTestCase):
+    """
+    Every mini_fb view must run the same number of queries however many friends,
+    status messages and images the profiles have
+    a failure lists the queries the larger dataset added, with the template tag
+    and functions each one came from
+    """
+
+    # the friends, each with a status message with images, added before each
+    # measurement, and as many status messages of the profile
+    GROWTH = [1, 3, 6]
+
+    def setUp(self):
+        """
+        create a logged-in user with a profile, and store media in a temporary directory
+        """
+        self.use_temporary_media()
+        cache.clear()
+
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.profile = self.create_profile(self.user)
+        self.message = self.add_message(self.profile)
+        self.client.force_login(self.user)
+        self.friends = 0
+
+    def add_message(self, profile, images=2):
+        """
+        return a new status message of profile, with images, in the news feeds
+        """
+        sm = StatusMessage.objects.create(profile=profile, message="message")
+        sm.fan_out()
+        for i in range(images):
+            Image.objects.create(status_message=sm, image_file=f"img_{sm.pk}_{i}.jpg")
+        return sm
+
+    def grow(self, count):
+        """
+        add count friends to the profile, each with a friend of their own for the
+        suggestions, and a status message with images for the profile and each friend
+        """
+        for i in range(count):
+            self.friends += 1
+            user = User.objects.create_user(username=f"friend{self.friends}")
+            friend = self.create_profile(user, f"Friend{self.friends}")
+            # add_friend prints the new friendships
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.profile.add_friend(friend)
+                friend.add_friend(self.create_profile(user, f"Other{self.friends}"))
+            self.add_message(friend)
+            self.add_message(self.profile)
+
+    def record(self, request):
+        """
+        return the queries of request(), made once the caches are warm
+        """
+        request()
+        with QueryRecorder() as queries:
+            response = request()
+        self.assertIn(response.status_code, [200, 302])
+        return queries
+
+    def assert_constant_queries(self, request):
+        """
+        request() must run as many queries as the dataset grows by GROWTH
+        """
+        measured = []
+        for count in self.GROWTH:
+            self.grow(count)
+            measured.append((self.friends, self.record(request)))
+
+        (small_size, small), *larger = measured
+        for size, queries in larger:
+            if len(queries) == len(small):
+                continue
+
+            added = Counter(query_shape(sql) for sql, origin in queries.queries)
+            added.subtract(query_shape(sql) for sql, origin in small.queries)
+            report = [
+                f"{len(small)} queries with {small_size} friends, "
+                f"{len(queries)} with {size}; the queries added:"
+            ]
+            for sql, origin in queries.queries:
+                if added[query_shape(sql)] > 0:
+                    report.append(f"x{added[query_shape(sql)]} {sql}")
+                    report.extend(f"    from {line}" for line in origin)
+                    added[query_shape(sql)] = 0
+            self.fail("\n".join(report))
+
+    def test_show_profile(self):
+        url = reverse("mini_fb:show_profile", kwargs={"pk": self.profile.pk})
+        self.assert_constant_queries(lambda: self.client.get(url))
+
+    def test_show_profile_for_user(self):
+        url = reverse("mini_fb:show_profile_for_user")
+        self.assert_constant_queries(lambda: self.client.get(url))
+
+    def test_show_newsfeed(self):
+        url = reverse("mini_fb:show_newsfeed")
+        self.assert_constant_queries(lambda: self.client.get(url))
+
+    def test_friend_suggestions(self):
+        url = reverse("mini_fb:friend_suggestions")
+        self.assert_constant_queries(lambda: self.client.get(url))
+
+    def test_show_all_profiles(self):
+        url = reverse("mini_fb:show_all_profiles_view")
+        self.assert_constant_queries(lambda: self.client.get(url))
+
+    def test_create_status(self):
+        url = reverse("mini_fb:create_status")
+        self.assert_constant_queries(lambda: self.client.get(url))
+
+        def post():
+            files = [
+                SimpleUploadedFile(f"{i}.png", png_bytes(i), content_type="image/png")
+                for i in range(2)
+            ]
+            with contextlib.redirect_stdout(io.StringIO()):
+                return self.client.post(url, {"message": "new", "files": files})
+
+        self.assert_constant_queries(post)
+
+    def test_update_status(self):
+        url = reverse("mini_fb:update_status", kwargs={"pk": self.message.pk})
+        self.assert_constant_queries(lambda: self.client.get(url))
+        self.assert_constant_queries(
+            lambda: self.client.post(url, {"message": "updated"})
+        )
+
+
+@override_settings(CACHES=NO_CACHE, MINI_FB_TASK_QUEUE="inline")
+class PaginationTest(MiniFbTestCase):
+    """
+    The keyset paginated pages list every row exactly once, across pages
+    whose boundaries fall among rows sharing a timestamp
+    """
+
+    # more than two pages, in groups of rows with the same timestamp
+    COUNT = 2 * PAGE_SIZE + 5
+    GROUP_SIZE = 7
+
+    def setUp(self):
+        """
+        create a logged-in user whose profile and friend posted status messages,
+        GROUP_SIZE at a time
+        """
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.profile, self.friend = self.create_profiles(self.user, 2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.profile.add_friend(self.friend)
+        self.client.force_login(self.user)
+
+        now = timezone.now()
+        for i in range(self.COUNT):
+            sm = StatusMessage.objects.create(
+                profile=self.profile if i % 2 else self.friend, message=f"post-{i}."
+            )
+            # timestamp is auto_now, set it after saving
+            timestamp = now - timedelta(minutes=i // self.GROUP_SIZE)
+            StatusMessage.objects.filter(pk=sm.pk).update(timestamp=timestamp)
+            sm.timestamp = timestamp
+            sm.fan_out()
+
+    def expected(self, posts):
+        """
+        return the numbers of posts in feed order: newest first, and among the
+        posts sharing a timestamp, the last created first
+        """
+        return [str(i) for i in sorted(posts, key=lambda i: (i // self.GROUP_SIZE, -i))]
+
+    def walk(self, url, pattern):
+        """
+        return the rows matching pattern on each page of url, following the
+        next-page links, and check the last page has no link
+        """
+        pages = []
+        response = self.client.get(url)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            content = response.content.decode()
+            pages.append(re.findall(pattern, content))
+            match = re.search(r'href="\?after=([^"]+)"', content)
+            if match is None:
+                return pages
+            response = self.client.get(url, {"after": match[1]})
+
+    def test_news_feed(self):
+        pages = self.walk(reverse("mini_fb:show_newsfeed"), r"post-(\d+)\.")
+        self.assertEqual([len(page) for page in pages], [PAGE_SIZE, PAGE_SIZE, 5])
+        self.assertEqual(sum(pages, []), self.expected(range(self.COUNT)))
+
+    def test_profile_status_messages(self):
+        pages = self.walk(
+            reverse("mini_fb:show_profile", args=[self.profile.pk]), r"post-(\d+)\."
+        )
+        self.assertEqual([len(page) for page in pages], [PAGE_SIZE, 2])
+        self.assertEqual(sum(pages, []), self.expected(range(1, self.COUNT, 2)))
+
+    def test_directory(self):
+        for i in range(2, self.COUNT):
+            self.create_profile(self.user, f"Test{i}")
+        pages = self.walk(
+            reverse("mini_fb:show_all_profiles_view"), r"<strong>Test(\d+) User"
+        )
+        self.assertEqual([len(page) for page in pages], [PAGE_SIZE, PAGE_SIZE, 5])
+        self.assertEqual(sum(pages, []), [str(i) for i in range(self.COUNT)])
+
+    def test_single_page_has_no_next_link(self):
+        # exactly one full page: the extra row fetched finds no next page
+        StatusMessage.objects.filter(
+            pk__gt=StatusMessage.objects.order_by("pk")[PAGE_SIZE - 1].pk
+        ).delete()
+        pages = self.walk(reverse("mini_fb:show_newsfeed"), r"post-(\d+)\.")
+        self.assertEqual([len(page) for page in pages], [PAGE_SIZE])
+
+    def test_malformed_cursor(self):
+        url = reverse("mini_fb:show_newsfeed")
+        for after in ["not base64!", encode_cursor("yesterday", 1), encode_cursor(1)]:
+            response = self.client.get(url, {"after": after})
+            self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse("mini_fb:show_all_profiles_view"), {"after": encode_cursor("x")}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_keyset_page(self):
+        queryset = StatusMessage.objects.filter(profile=self.profile)
+        page = paginate_by_timestamp(queryset, page_size=5)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(page), 5)
+            self.assertTrue(page)
+            cursor = page.next_cursor
+        rows = list(page)
+
+        page = paginate_by_timestamp(queryset, cursor, page_size=5)
+        self.assertTrue(set(page).isdisjoint(rows))
+        self.assertEqual(
+            list(paginate_by_id(queryset, encode_cursor(rows[0].pk), page_size=100)),
+            list(queryset.filter(pk__gt=rows[0].pk).order_by("pk")),
+        )
+
+        page = paginate_by_id(queryset.none())
+        self.assertFalse(page)
+        self.assertIsNone(page.next_cursor)
+
+
+class AddFriendTest(MiniFbTestCase):
+    """
+    A friendship is stored once, in canonical order, whichever side adds it
+    """
+
+    def setUp(self):
+        """
+        create two profiles
+        """
+        cache.clear()
+        user = User.objects.create_user(username="tester", password="password")
+        self.p1, self.p2 = self.create_profiles(user, 2)
+
+    def test_add_friend_is_canonical_and_unique(self):
+        self.assertIsNotNone(self.p2.add_friend(self.p1))
+        self.assertIsNone(self.p1.add_friend(self.p2))
+        self.assertIsNone(self.p1.add_friend(self.p1))
+
+        friend = Friend.objects.get()
+        self.assertEqual((friend.profile1, friend.profile2), (self.p1, self.p2))
+        self.assertEqual(self.p2.get_friends(), [self.p1])
+
+
+class FriendSuggestionTest(MiniFbTestCase):
+    """
+    Friend suggestions rank every other profile by mutual friends, then city
+    """
+
+    def test_ranking(self):
+        user = User.objects.create_user(username="tester", password="password")
+        profiles = [
+            self.create_profile(
+                user, f"Test{i}", city=["Boston", "Cambridge"][i % 3 == 0]
+            )
+            for i in range(40)
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, profile in enumerate(profiles):
+                for j in [i * 7 % 40, i * 11 % 40]:
+                    profile.add_friend(profiles[j])
+
+        # profiles with too few friends of friends for a full list
+        loners = [
+            self.create_profile(user, f"Loner{i}", city="Cambridge") for i in range(2)
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            loners[1].add_friend(profiles[3])
+        profiles += loners
+
+        for profile in profiles[:5] + loners:
+            friends = set(profile.get_friends())
+            expected = sorted(
+                (p for p in profiles if p != profile and p not in friends),
+                key=lambda p: (
+                    -len(friends & set(p.get_friends())),
+                    p.city != profile.city,
+                    p.pk,
+                ),
+            )
+            self.assertEqual(profile.get_friend_suggestions(), expected[:10])
+
+
+class LoadFriendGraphTest(TestCase):
+    """
+    The bulk loader writes each profile and friendship once, and reports what
+    it wrote
+    """
+
+    def test_reload_writes_nothing(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        profiles = os.path.join(directory.name, "profiles.jsonl")
+        friends = os.path.join(directory.name, "friends.jsonl")
+        with open(profiles, "w") as f:
+            for name in ["ann", "bob", "cid"]:
+                record = {field: name for field in ["username", "first_name"]}
+                record.update(
+                    last_name="User",
+                    city="Boston",
+                    email=f"{name}@example.com",
+                    image_url="https://example.com/test.jpg",
+                )
+                f.write(json.dumps(record) + "\n")
+        with open(friends, "w") as f:
+            # the second edge repeats the first one, in the next batch
+            for pair in [("ann", "bob"), ("bob", "ann"), ("bob", "cid")]:
+                f.write(json.dumps(dict(zip(["username1", "username2"], pair))))
+                f.write("\n")
+
+        def load(friends=friends):
+            out = io.StringIO()
+            call_command(
+                "load_friend_graph",
+                profiles=profiles,
+                friends=friends,
+                batch_size=1,
+                stdout=out,
+            )
+            return out.getvalue()
+
+        output = load()
+        self.assertIn("profiles: done, 3 of 3 records written", output)
+        self.assertIn("friendships: done, 2 of 3 records written", output)
+        self.assertEqual(Friend.objects.count(), 2)
+
+        output = load()
+        self.assertIn("profiles: done, 0 of 3 records written", output)
+        self.assertIn("friendships: done, 0 of 3 records written", output)
+        bob = Profile.objects.get(user__username="bob")
+        self.assertEqual(bob.friend_count, 2)
+
+        # a new edge changes the mutual friends of the friends of its ends
+        key = f"mini_fb:friend_suggestions:{bob.pk}"
+        cache.set(key, [])
+        more_friends = os.path.join(directory.name, "more_friends.jsonl")
+        with open(more_friends, "w") as f:
+            f.write(json.dumps({"username1": "ann", "username2": "cid"}) + "\n")
+        output = load(more_friends)
+        self.assertIn("friendships: done, 1 of 1 records written", output)
+        self.assertIsNone(cache.get(key))
+
+
+class FragmentCacheTest(MiniFbTestCase):
+    """
+    Cached page fragments are served until the data they show changes
+    """
+
+    def setUp(self):
+        """
+        create a logged-in user with a profile and a friend
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.profile, self.friend = self.create_profiles(self.user, 2)
+        self.profile.add_friend(self.friend)
+        self.client.force_login(self.user)
+
+    def test_new_status_message_invalidates_pages(self):
+        urls = [
+            reverse("mini_fb:show_newsfeed"),
+            reverse("mini_fb:show_profile", kwargs={"pk": self.friend.pk}),
+        ]
+        for url in urls:
+            self.assertNotContains(self.client.get(url), "fresh news")
+
+        sm = StatusMessage.objects.create(profile=self.friend, message="fresh news")
+        sm.fan_out()
+        for url in urls:
+            self.assertContains(self.client.get(url), "fresh news")
+
+        sm.delete()
+        for url in urls:
+            self.assertNotContains(self.client.get(url), "fresh news")
+
+    def test_profile_update_invalidates_directory(self):
+        url = reverse("mini_fb:show_all_profiles_view")
+        self.assertContains(self.client.get(url), "Boston")
+
+        self.friend.city = "Brockton"
+        self.friend.save()
+        self.assertContains(self.client.get(url), "Brockton")
+
+
+@override_settings(CACHES=NO_CACHE, MINI_FB_TASK_QUEUE="inline")
+class ImageVariantTest(MiniFbTestCase):
+    """
+    Uploaded status images get downscaled variants, used by the news feed
+    """
+
+    def setUp(self):
+        """
+        create a logged-in user with a profile, and store media in a temporary directory
+        """
+        self.use_temporary_media()
+
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.create_profile(self.user)
+        self.client.force_login(self.user)
+
+    def test_upload_generates_variants(self):
+        buffer = io.BytesIO()
+        PILImage.new("RGB", (1200, 800), "red").save(buffer, "PNG")
+        upload = SimpleUploadedFile("red.png", buffer.getvalue(), "image/png")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("mini_fb:create_status"),
+                {"message": "look", "files": [upload]},
+            )
+
+        image = Image.objects.get()
+        feed = image.variants.get(name="feed", format="JPEG")
+        self.assertEqual((feed.width, feed.height), (600, 400))
+        self.assertEqual(image.variants.filter(name="thumbnail").first().width, 150)
+
+        response = self.client.get(reverse("mini_fb:show_newsfeed"))
+        self.assertContains(response, f"{feed.file.url} 600w")
+
+
+@override_settings(MINI_FB_FILE_GRACE_PERIOD=0)
+class ContentAddressedStorageTest(MiniFbTestCase):
+    """
+    Identical image uploads share one file, removed with the last Image using it
+    """
+
+    def setUp(self):
+        """
+        create a status message, and store media in a temporary directory
+        """
+        self.use_temporary_media()
+
+        user = User.objects.create_user(username="tester", password="password")
+        profile = self.create_profile(user)
+        self.sm = StatusMessage.objects.create(profile=profile, message="msg")
+
+    def test_identical_uploads_share_one_file(self):
+        images = [
+            Image.objects.create(
+                status_message=self.sm,
+                image_file=SimpleUploadedFile(name, b"same bytes", "image/jpeg"),
+            )
+            for name in ["a.jpg", "b.JPG"]
+        ]
+        name = images[0].image_file.name
+        self.assertEqual(images[1].image_file.name, name)
+        self.assertRegex(name, r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$")
+
+        storage = images[0].image_file.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            images[0].delete()
+        self.assertTrue(storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            images[1].delete()
+        self.assertFalse(storage.exists(name))
+
+    @override_settings(MINI_FB_FILE_GRACE_PERIOD=60)
+    def test_identical_upload_keeps_released_file(self):
+        image = Image.objects.create(
+            status_message=self.sm,
+            image_file=SimpleUploadedFile("a.jpg", b"same bytes", "image/jpeg"),
+        )
+        name = image.image_file.name
+        storage = image.image_file.storage
+        hour_ago = time.time() - 3600
+        os.utime(storage.path(name), (hour_ago, hour_ago))
+
+        # an identical upload is stored while the last Image using the file is
+        # deleted, before the new Image commits
+        storage.save("b.jpg", ContentFile(b"same bytes"))
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertTrue(storage.exists(name))
+
+        os.utime(storage.path(name), (hour_ago, hour_ago))
+        self.assertTrue(storage.delete_if_stale(name))
+        self.assertFalse(storage.exists(name))
+
+
+class MediaServingTest(MiniFbTestCase):
+    """
+    Uploaded images are served with validators, ranges and immutable caching
+    """
+
+    def setUp(self):
+        """
+        store a content-addressed file in a temporary media directory
+        """
+        self.use_temporary_media()
+
+        self.name = ContentAddressedStorage().save("a.jpg", ContentFile(b"0123456789"))
+        self.url = settings.MEDIA_URL + self.name
+
+    def test_full_and_conditional_responses(self):
+        response = self.client.get(self.url)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        self.assertIn("immutable", response["Cache-Control"])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_response(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(b"".join(response.streaming_content), b"2345")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=20-")
+        self.assertEqual(response.status_code, 416)
+
+    def test_outside_media_root(self):
+        response = self.client.get(settings.MEDIA_URL + "../manage.py")
+        self.assertEqual(response.status_code, 404)
+
+    def test_etag_survives_upload_again(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertIn(self.name.split("/")[-1].split(".")[0], etag)
+
+        # storing the same content again touches the file
+        hour_ago = time.time() - 3600
+        os.utime(os.path.join(settings.MEDIA_ROOT, self.name), (hour_ago, hour_ago))
+        ContentAddressedStorage().save("b.jpg", ContentFile(b"0123456789"))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unfinished_and_unknown_files(self):
+        root = settings.MEDIA_ROOT
+        names = [
+            "tmpabc123.upload",
+            self.name + ".deleting",
+            "notes.txt",
+            "images/legacy.jpg",
+            # a shard that does not match the address
+            ("11" if self.name.startswith("00") else "00") + self.name[2:],
+        ]
+        for name in names + ["legacy.jpg"]:
+            os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+            with open(os.path.join(root, name), "wb") as f:
+                f.write(b"data")
+        for name in names:
+            response = self.client.get(settings.MEDIA_URL + name)
+            self.assertEqual(response.status_code, 404, name)
+
+        # uploaded under its own name before content addressing
+        response = self.client.get(settings.MEDIA_URL + "legacy.jpg")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("immutable", response["Cache-Control"])
+
+    async def test_asgi_responses_stream(self):
+        response = await self.async_client.get(self.url)
+        self.assertTrue(response.is_async)
+        self.assertEqual(response["Content-Length"], "10")
+        content = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(b"".join(content), b"0123456789")
+
+        response = await self.async_client.get(self.url, headers={"Range": "bytes=2-5"})
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.is_async)
+        content = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(b"".join(content), b"2345")
+
+
+class AsyncViewsTest(MiniFbTestCase):
+    """
+    The async read views render the same pages as their sync counterparts
+    """
+
+    def setUp(self):
+        """
+        create a user whose friend posted a status message
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.profile, self.friend = self.create_profiles(self.user, 2)
+        self.profile.add_friend(self.friend)
+        StatusMessage.objects.create(
+            profile=self.friend, message="async news"
+        ).fan_out()
+
+    async def render(self, view, **kwargs):
+        """
+        return the content of view rendered for the logged-in user
+        """
+
+        async def auser():
+            return self.user
+
+        request = AsyncRequestFactory().get("/")
+        request.user = self.user
+        request.auser = auser
+        response = await view.as_view()(request, **kwargs)
+        await sync_to_async(response.render)()
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    async def test_async_views(self):
+        content = await self.render(AsyncShowNewsFeedView)
+        self.assertIn("async news", content)
+
+        content = await self.render(AsyncShowProfilePageView, pk=self.friend.pk)
+        self.assertIn("async news", content)
+        self.assertIn("Test0", content)
+
+        content = await self.render(AsyncShowProfileForUser)
+        self.assertIn("Test1", content)
+
+        content = await self.render(AsyncShowAllProfilesView)
+        self.assertIn("Test1", content)
+
+        # rendered again from the cached fragments
+        content = await self.render(AsyncShowNewsFeedView)
+        self.assertIn("async news", content)
+
+
+class SQLiteTuningTest(TestCase):
+    """
+    Every SQLite connection must be opened with the tuned PRAGMAs
+    """
+
+    def test_pragmas(self):
+        """
+        the connection reports the PRAGMA values from settings
+        """
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite only")
+
+        with connection.cursor() as cursor:
+            values = {}
+            # mmap_size and journal_mode do not apply to the in-memory test database
+            for name in ["synchronous", "busy_timeout", "cache_size"]:
+                cursor.execute(f"PRAGMA {name}")
+                values[name] = cursor.fetchone()[0]
+
+        self.assertEqual(values["synchronous"], 1)  # NORMAL
+        self.assertEqual(
+            values["busy_timeout"], settings.SQLITE_PRAGMAS["busy_timeout"]
+        )
+        self.assertEqual(values["cache_size"], settings.SQLITE_PRAGMAS["cache_size"])
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+
+@override_settings(CACHES=NO_CACHE)
+class RequestMetricsTest(MiniFbTestCase):
+    """
+    Every request is measured under its URL name, and over-budget views are reported
+    """
+
+    def setUp(self):
+        """
+        create a logged-in user with a profile and a status message
+        """
+        metrics.store.reset()
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.profile = self.create_profile(self.user)
+        StatusMessage.objects.create(profile=self.profile, message="measured")
+        self.client.login(username="tester", password="password")
+
+    def test_request_is_measured(self):
+        """
+        the sample of a page has its queries, SQL and template times and size
+        """
+        with self.assertLogs("cs412.metrics", "INFO") as logs:
+            response = self.client.get(
+                reverse("mini_fb:show_profile", kwargs={"pk": self.profile.pk})
+            )
+
+        sample = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(sample["view"], "mini_fb:show_profile")
+        self.assertGreater(sample["queries"], 0)
+        self.assertIsNotNone(sample["template_ms"])
+        self.assertEqual(sample["response_bytes"], len(response.content))
+
+        summary = metrics.store.summary()["mini_fb:show_profile"]
+        self.assertEqual(summary["requests"], 1)
+        self.assertEqual(summary["queries"]["p50"], sample["queries"])
+
+    def test_budget_warning(self):
+        """
+        a view making more queries than its budget logs a warning
+        """
+        budgets = {"mini_fb:show_newsfeed": {"queries": 0}}
+        with override_settings(REQUEST_METRICS_BUDGETS=budgets):
+            with self.assertLogs("cs412.metrics", "WARNING") as logs:
+                self.client.get(reverse("mini_fb:show_newsfeed"))
+        self.assertIn("mini_fb:show_newsfeed exceeded its budget", logs.output[0])
+
+    @override_settings(DEBUG=True)
+    def test_metrics_endpoint(self):
+        """
+        the percentiles are shown to staff users only, even with DEBUG on
+        """
+        self.client.get(reverse("mini_fb:show_all_profiles_view"))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            "p95", response.json()["mini_fb:show_all_profiles_view"]["queries"]
+        )
+
+
+@override_settings(MINI_FB_TASK_QUEUE="inline", RESTAURANT_ORDER_FLUSH_INTERVAL=0)
+class BenchmarkSuiteTest(MiniFbTestCase):
+    """
+    The benchmark suite seeds its dataset and drives every URL without errors
+    """
+
+    def setUp(self):
+        """
+        store media in a temporary directory
+        """
+        self.use_temporary_media()
+        cache.clear()
+
+    def test_every_url_has_a_scenario(self):
+        dataset = benchmark.seed_dataset("small", stdout=io.StringIO())
+        self.assertEqual(dataset["profiles"], benchmark.SCALES["small"]["profiles"])
+        self.assertEqual(
+            dataset["images"],
+            benchmark.SCALES["small"]["profiles"] * benchmark.SCALES["small"]["images"],
+        )
+
+        # seeding again tops up nothing
+        self.assertEqual(benchmark.seed_dataset("small", stdout=io.StringIO()), dataset)
+
+        user = benchmark.benchmark_user()
+        scenarios = benchmark.scenarios(user)
+        self.assertLessEqual(
+            benchmark.url_names(), {scenario.name for scenario in scenarios}
+        )
+
+        client = self.client_class()
+        client.force_login(user)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for scenario in scenarios:
+                stats = benchmark.run_scenario(
+                    client if scenario.login else self.client_class(), scenario, 1
+                )
+                self.assertEqual(stats["errors"], 0, scenario.name)
+
+    def test_refuses_development_media_root(self):
+        with override_settings(MEDIA_ROOT=os.path.join(settings.BASE_DIR, "media/")):
+            with self.assertRaisesMessage(CommandError, "DJANGO_MEDIA_ROOT"):
+                call_command("benchmark", stdout=io.StringIO())
+
+
+@override_settings(
+    SESSION_ENGINE="django.contrib.sessions.backends.cached_db",
+    MINI_FB_USER_CACHE_TIMEOUT=300,
+)
+class CachedAuthenticationTest(TestCase):
+    """
+    With a shared cache, a logged-in request loads its session and user from the
+    cache, and changes to the user's password or active state still log it out
+    """
+
+    def setUp(self):
+        """
+        create a logged-in user
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.client.login(username="tester", password="password")
+
+    def request_user(self):
+        """
+        return the user of a request to a page without queries of its own
+        """
+        response = self.client.get(reverse("quotes:about"))
+        # request.user is lazy, load the session and the user here
+        response.wsgi_request.user.is_authenticated
+        return response.wsgi_request.user
+
+    def test_no_queries_in_steady_state(self):
+        self.request_user()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.request_user().pk, self.user.pk)
+
+    def test_password_change_logs_out(self):
+        self.request_user()
+        self.user.set_password("changed")
+        self.user.save()
+        self.assertFalse(self.request_user().is_authenticated)
+
+    def test_deactivation_logs_out(self):
+        self.request_user()
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.request_user().is_authenticated)
+
+
+class SearchTest(MiniFbTestCase):
+    """
+    Profiles and status messages are found by their words, best match first,
+    and the index follows their changes
+    """
+
+    def setUp(self):
+        """
+        create profiles in a few cities, with status messages
+        """
+        cache.clear()
+        user = User.objects.create_user(username="tester", password="password")
+        self.profiles = [
+            self.create_profile(user, first_name, last_name=last_name, city=city)
+            for first_name, last_name, city in [
+                ("Boston", "Smith", "Chicago"),
+                ("Alice", "Walker", "Boston"),
+                ("Bob", "Jones", "Cambridge"),
+            ]
+        ]
+        self.message = StatusMessage.objects.create(
+            profile=self.profiles[1], message="Running along the Charles river"
+        )
+
+    def test_name_ranks_above_city(self):
+        self.assertEqual(
+            list(search_profiles("boston")), [self.profiles[0], self.profiles[1]]
+        )
+        self.assertEqual(list(search_profiles("alice boston")), [self.profiles[1]])
+
+    def test_prefix_and_stemming(self):
+        self.assertEqual(list(search_profiles("cambr")), [self.profiles[2]])
+        self.assertEqual(list(search_status_messages("run")), [self.message])
+        self.assertEqual(list(search_status_messages("rivers")), [self.message])
+        self.assertEqual(list(search_status_messages("")), [])
+        self.assertEqual(list(search_status_messages('"*)(')), [])
+
+    def test_index_follows_changes(self):
+        self.message.message = "Cycling to Salem"
+        self.message.save()
+        self.assertEqual(list(search_status_messages("charles")), [])
+        self.assertEqual(list(search_status_messages("salem")), [self.message])
+
+        self.message.delete()
+        self.assertEqual(list(search_status_messages("salem")), [])
+
+    def test_pagination(self):
+        for i in range(25):
+            StatusMessage.objects.create(
+                profile=self.profiles[0], message=f"marathon day {i}"
+            )
+        first = search_status_messages("marathon")
+        second = search_status_messages("marathon", page=2)
+        self.assertEqual((len(first), first.has_next), (20, True))
+        self.assertEqual((len(second), second.has_next), (5, False))
+        self.assertFalse({sm.pk for sm in first} & {sm.pk for sm in second})
+
+    def test_search_page(self):
+        url = reverse("mini_fb:search")
+        self.assertContains(self.client.get(url, {"q": "walker"}), "Alice Walker")
+        response = self.client.get(url, {"q": "charles", "kind": "status"})
+        self.assertContains(response, "Running along the Charles river")
+        self.assertContains(self.client.get(url, {"q": "nobody"}), "No results")
+
+
+@override_settings(CACHES=NO_CACHE, MINI_FB_TASK_QUEUE="inline")
+class CounterTest(MiniFbTestCase):
+    """
+    The friend, status message and image counters of a profile follow the
+    views that change them, and can be rebuilt from the child tables
+    """
+
+    def setUp(self):
+        """
+        create a logged-in user with a profile and another profile,
+        and store media in a temporary directory
+        """
+        self.use_temporary_media()
+
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.profile, self.other = self.create_profiles(self.user, 2)
+        self.client.force_login(self.user)
+
+    def counters(self, profile):
+        """
+        return the friend, status message and image counts of profile
+        """
+        profile.refresh_from_db()
+        return profile.friend_count, profile.status_count, profile.image_count
+
+    def test_views_update_counters(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.other.add_friend(self.profile)
+            self.other.add_friend(self.profile)
+            files = [
+                SimpleUploadedFile(f"{i}.png", png_bytes(i), content_type="image/png")
+                for i in range(2)
+            ]
+            self.client.post(
+                reverse("mini_fb:create_status"), {"message": "new", "files": files}
+            )
+        self.assertEqual(self.counters(self.profile), (1, 1, 2))
+        self.assertEqual(self.counters(self.other), (1, 0, 0))
+        sm = StatusMessage.objects.get()
+        self.assertEqual(sm.image_count, 2)
+
+        self.client.post(reverse("mini_fb:delete_status", kwargs={"pk": sm.pk}))
+        self.assertEqual(self.counters(self.profile), (1, 0, 0))
+
+    def test_rebuild_counters(self):
+        sm = StatusMessage.objects.create(profile=self.profile, message="message")
+        Image.objects.create(status_message=sm, image_file="a.jpg")
+        Friend.objects.create(profile1=self.profile, profile2=self.other)
+        # bulk updates send no signals, so the counters drift
+        Profile.objects.update(friend_count=0, status_count=5, image_count=0)
+        StatusMessage.objects.update(image_count=0)
+
+        call_command("rebuild_counters", stdout=io.StringIO())
+        self.assertEqual(self.counters(self.profile), (1, 1, 1))
+        self.assertEqual(self.counters(self.other), (1, 0, 0))
+        sm.refresh_from_db()
+        self.assertEqual(sm.image_count, 1)
+
+    def test_empty_sections_skip_child_tables(self):
+        url = reverse("mini_fb:show_profile", kwargs={"pk": self.other.pk})
+        with QueryRecorder() as queries:
+            response = self.client.get(url)
+        self.assertContains(response, "No partners in crime")
+        self.assertContains(response, "No tales to tell")
+        for sql, origin in queries.queries:
+            self.assertNotIn("mini_fb_friend", sql)
+            self.assertNotIn("mini_fb_statusmessage", sql)
+
+
+@override_settings(MINI_FB_TASK_QUEUE="inline")
+class ExportTest(MiniFbTestCase):
+    """
+    A profile's data is exported as JSONL or as a ZIP with its image files,
+    streamed in pieces no larger than a file chunk
+    """
+
+    def setUp(self):
+        """
+        create a logged-in user whose profile has a friend and status messages,
+        one with a large image file shared by two images
+        """
+        self.use_temporary_media()
+        cache.clear()
+
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.profile, friend = self.create_profiles(self.user, 2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.profile.add_friend(friend)
+        self.data = os.urandom(300_000)
+        self.name = ContentAddressedStorage().save("big.png", ContentFile(self.data))
+        for i in range(3):
+            sm = StatusMessage.objects.create(profile=self.profile, message=f"m{i}")
+        for i in range(2):
+            Image.objects.create(status_message=sm, image_file=self.name)
+        self.client.force_login(self.user)
+
+    def export(self, export_format):
+        """
+        return the pieces of the streamed export
+        """
+        response = self.client.get(
+            reverse("mini_fb:export_profile"), {"format": export_format}
+        )
+        self.assertTrue(response.streaming)
+        self.assertIn("attachment", response["Content-Disposition"])
+        return list(response.streaming_content)
+
+    def test_jsonl(self):
+        records = [
+            json.loads(line)
+            for line in b"".join(self.export("jsonl")).decode().splitlines()
+        ]
+        self.assertEqual(
+            [record["type"] for record in records],
+            ["profile", "friend"] + ["status_message"] * 3,
+        )
+        self.assertEqual(records[0]["username"], "tester")
+        self.assertEqual(records[-1]["images"], [f"images/{self.name}"] * 2)
+
+    def test_zip(self):
+        chunks = self.export("zip")
+        self.assertLess(max(len(chunk) for chunk in chunks), 100_000)
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ["data.jsonl", f"images/{self.name}"])
+            self.assertEqual(archive.read(f"images/{self.name}"), self.data)
+            self.assertEqual(len(archive.read("data.jsonl").splitlines()), 5)
+
+    async def test_asgi_zip(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(
+            reverse("mini_fb:export_profile"), {"format": "zip"}
+        )
+        # an asynchronous iterator is sent as it goes, not gathered into a list
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertLess(max(len(chunk) for chunk in chunks), 100_000)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertEqual(archive.read(f"images/{self.name}"), self.data)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile(suffix=".zip") as f:
+            call_command(
+                "export_profile", self.profile.pk, output=f.name, stdout=io.StringIO()
+            )
+            with zipfile.ZipFile(f.name) as archive:
+                self.assertIsNone(archive.testzip())
+
+
+@override_settings(MINI_FB_TASK_QUEUE="inline", MINI_FB_FILE_GRACE_PERIOD=0)
+class BulkDeletionTest(MiniFbTestCase):
+    """
+    Profiles and status messages are deleted with their history in a number of
+    statements that does not grow with it, and their files are swept once no
+    row references them
+    """
+
+    def setUp(self):
+        """
+        create a logged-in user whose profile has a friend, and store media
+        in a temporary directory
+        """
+        self.use_temporary_media()
+        cache.clear()
+
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.profile, self.friend = self.create_profiles(self.user, 2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.profile.add_friend(self.friend)
+        self.storage = ContentAddressedStorage()
+        # a file the friend's image shares with the profile's images
+        self.shared = self.storage.save("shared.png", ContentFile(png_bytes(0)))
+        self.add_message(self.friend, self.shared)
+        self.client.force_login(self.user)
+
+    def add_message(self, profile, name):
+        """
+        return a new status message of profile, in the news feeds, with an image
+        of the file with name and a variant
+        """
+        sm = StatusMessage.objects.create(profile=profile, message="message")
+        sm.fan_out()
+        image = Image.objects.create(status_message=sm, image_file=name)
+        ImageVariant.objects.create(
+            image=image,
+            name="feed",
+            format="JPEG",
+            file=self.storage.save("v.jpg", ContentFile(name.encode())),
+            width=1,
+            height=1,
+        )
+        return sm
+
+    def add_history(self, count):
+        """
+        give the profile count more status messages, with their own files
+        return the names of the files
+        """
+        names = []
+        for i in range(count):
+            names.append(self.storage.save("a.png", ContentFile(os.urandom(100))))
+            self.add_message(self.profile, names[-1])
+        self.add_message(self.profile, self.shared)
+        return names
+
+    def test_delete_profile(self):
+        names = self.add_history(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as small:
+                delete_profiles([self.profile.pk])
+
+        self.assertFalse(Profile.objects.filter(pk=self.profile.pk).exists())
+        self.assertEqual(StatusMessage.objects.count(), 1)
+        self.assertEqual(Image.objects.count(), 1)
+        self.assertEqual(ImageVariant.objects.count(), 1)
+        self.assertEqual(NewsFeedItem.objects.count(), 1)
+        self.assertFalse(Friend.objects.exists())
+        self.assertFalse(PendingFileRemoval.objects.exists())
+        self.friend.refresh_from_db()
+        self.assertEqual(self.friend.friend_count, 0)
+        for name in names:
+            self.assertFalse(self.storage.exists(name))
+        self.assertTrue(self.storage.exists(self.shared))
+
+        # a larger history takes as many statements
+        profile = self.create_profile(self.user, "Large")
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.captureOnCommitCallbacks(execute=True):
+                profile.add_friend(self.friend)
+        self.profile = profile
+        self.add_history(12)
+        with CaptureQueriesContext(connection) as large:
+            delete_profiles([profile.pk])
+        self.assertEqual(len(large), len(small))
+
+    def test_delete_status_messages(self):
+        self.add_history(2)
+        first = StatusMessage.objects.filter(profile=self.profile).first()
+        with CaptureQueriesContext(connection) as small:
+            delete_status_messages([first.pk])
+
+        # the deletions subtract from the counters, whatever the history
+        self.add_history(12)
+        last = StatusMessage.objects.filter(profile=self.profile).last()
+        friend_message = StatusMessage.objects.get(profile=self.friend)
+        with CaptureQueriesContext(connection) as large:
+            delete_status_messages([last.pk])
+        self.assertEqual(len(large), len(small))
+
+        delete_status_messages([friend_message.pk])
+        for profile in [self.profile, self.friend]:
+            profile.refresh_from_db()
+            counters = (profile.status_count, profile.image_count)
+            rebuild_counters([profile.pk])
+            profile.refresh_from_db()
+            self.assertEqual((profile.status_count, profile.image_count), counters)
+
+    def test_raw_delete(self):
+        # raw_delete relies on the private QuerySet._raw_delete: it deletes the
+        # rows with one statement, without sending signals
+        deleted = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted.append(instance)
+
+        post_delete.connect(receiver, sender=NewsFeedItem)
+        self.addCleanup(post_delete.disconnect, receiver, sender=NewsFeedItem)
+        count = NewsFeedItem.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(raw_delete(NewsFeedItem.objects.all()), count)
+        self.assertFalse(NewsFeedItem.objects.exists())
+        self.assertEqual(deleted, [])
+        # one SELECT of the pks and one DELETE, then the SELECT finding no more
+        self.assertEqual(len(queries), 3)
+
+    def test_delete_status_view(self):
+        names = self.add_history(1)
+        sm = StatusMessage.objects.filter(profile=self.profile).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("mini_fb:delete_status", kwargs={"pk": sm.pk})
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(StatusMessage.objects.filter(pk=sm.pk).exists())
+        self.assertFalse(self.storage.exists(names[0]))
+        self.profile.refresh_from_db()
+        self.assertEqual((self.profile.status_count, self.profile.image_count), (1, 1))
+
+    @override_settings(MINI_FB_FILE_GRACE_PERIOD=60)
+    def test_sweep_keeps_files_within_grace_period(self):
+        name = self.storage.save("new.png", ContentFile(b"new"))
+        queue_file_removals([name])
+        self.assertEqual(sweep_files(), 0)
+        self.assertTrue(self.storage.exists(name))
+        self.assertTrue(PendingFileRemoval.objects.filter(name=name).exists())
+
+        hour_ago = time.time() - 3600
+        os.utime(self.storage.path(name), (hour_ago, hour_ago))
+        self.assertEqual(sweep_files(), 1)
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(PendingFileRemoval.objects.exists())
+
+    def test_collect_orphaned_media(self):
+        orphan = self.storage.save("orphan.png", ContentFile(b"orphan"))
+        young = self.storage.save("young.png", ContentFile(b"young"))
+        day_ago = time.time() - 2 * 24 * 3600
+        for name in [orphan, self.shared]:
+            os.utime(self.storage.path(name), (day_ago, day_ago))
+
+        call_command("collect_orphaned_media", dry_run=True, stdout=io.StringIO())
+        self.assertTrue(self.storage.exists(orphan))
+
+        call_command("collect_orphaned_media", stdout=io.StringIO())
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertTrue(self.storage.exists(young))
+        self.assertTrue(self.storage.exists(self.shared))
+
+
+# the calls of flaky_task, one entry per call
+flaky_calls = []
+
+FLAKY_TASK = "mini_fb.tests.flaky_task"
+
+
+def flaky_task(failures):
+    """
+    record the call, and raise for the first failures calls
+    """
+    flaky_calls.append(failures)
+    if len(flaky_calls) <= failures:
+        raise RuntimeError("flaky")
+
+
+def terminate_task():
+    """
+    send SIGTERM to this process, as a process manager stopping the worker does
+    """
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+@override_settings(MINI_FB_TASK_QUEUE="database")
+class TaskQueueTest(MiniFbTestCase):
+    """
+    Side effects of the writes are queued as Tasks, run once each by the worker,
+    and retried with backoff when they fail
+    """
+
+    def setUp(self):
+        """
+        create a logged-in user whose profile has a friend, and run the task
+        queued by the friendship
+        """
+        cache.clear()
+        flaky_calls.clear()
+        self.user = User.objects.create_user(username="tester", password="password")
+        self.profile, self.friend = self.create_profiles(self.user, 2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.profile.add_friend(self.friend)
+        run_due_tasks()
+        self.client.force_login(self.user)
+
+    def test_add_friend_backfills_in_background(self):
+        StatusMessage.objects.create(profile=self.friend, message="earlier")
+        other = self.create_profile(self.user, "Other")
+        with contextlib.redirect_stdout(io.StringIO()):
+            other.add_friend(self.friend)
+            # adding the friend again queues no second backfill
+            self.friend.add_friend(other)
+        self.assertFalse(NewsFeedItem.objects.filter(profile=other).exists())
+
+        run_due_tasks()
+        self.assertTrue(NewsFeedItem.objects.filter(profile=other).exists())
+
+    def test_create_status_fans_out_in_background(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.post(
+                reverse("mini_fb:create_status"), {"message": "queued"}
+            )
+        self.assertEqual(response.status_code, 302)
+        sm = StatusMessage.objects.get(message="queued")
+        self.assertFalse(NewsFeedItem.objects.filter(status_message=sm).exists())
+        self.assertTrue(
+            Task.objects.filter(
+                name="mini_fb.tasks.fan_out_status_message", args=[sm.pk]
+            ).exists()
+        )
+
+        run_due_tasks()
+        self.assertEqual(NewsFeedItem.objects.filter(status_message=sm).count(), 2)
+        # the task is not run again
+        self.assertEqual(run_due_tasks(), 0)
+        self.assertFalse(Task.objects.exclude(status=Task.DONE).exists())
+
+    def test_idempotency_key(self):
+        for i in range(3):
+            Task.enqueue(FLAKY_TASK, 0, key="once")
+        self.assertEqual(Task.objects.filter(key="once").count(), 1)
+        run_due_tasks()
+        self.assertEqual(flaky_calls, [0])
+
+    def test_failed_task_is_queued_again(self):
+        Task.enqueue(FLAKY_TASK, 1, key="retry", max_attempts=1)
+        with self.assertLogs("mini_fb.worker", "ERROR"):
+            run_due_tasks()
+        self.assertEqual(Task.objects.get(key="retry").status, Task.FAILED)
+
+        Task.enqueue(FLAKY_TASK, 1, key="retry", max_attempts=1)
+        run_due_tasks()
+        task = Task.objects.get(key="retry")
+        self.assertEqual((task.status, task.attempts), (Task.DONE, 1))
+
+    def test_retry_with_backoff(self):
+        Task.enqueue(FLAKY_TASK, 1)
+        # a failure that will be retried is a warning
+        with self.assertLogs("mini_fb.worker", "WARNING") as logs:
+            self.assertEqual(run_due_tasks(), 1)
+        self.assertEqual([record.levelname for record in logs.records], ["WARNING"])
+        task = Task.objects.get(name=FLAKY_TASK)
+        self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+        self.assertIn("RuntimeError", task.last_error)
+        self.assertGreater(task.run_after, timezone.now())
+
+        # the retry is not due before its backoff ends
+        self.assertEqual(run_due_tasks(), 0)
+        Task.objects.filter(name=FLAKY_TASK).update(run_after=timezone.now())
+        run_due_tasks()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.DONE, 2))
+        self.assertEqual(task.last_error, "")
+
+    def test_fails_after_max_attempts(self):
+        Task.enqueue(FLAKY_TASK, 10, max_attempts=2)
+        with self.assertLogs("mini_fb.worker", "WARNING") as logs:
+            for attempt in range(3):
+                Task.objects.filter(name=FLAKY_TASK).update(run_after=timezone.now())
+                run_due_tasks()
+        self.assertEqual(
+            [record.levelname for record in logs.records], ["WARNING", "ERROR"]
+        )
+        task = Task.objects.get(name=FLAKY_TASK)
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+        self.assertEqual(len(flaky_calls), 2)
+
+    def test_expired_lease_is_claimed_again(self):
+        Task.enqueue(FLAKY_TASK, 0)
+        # a worker claimed the task and died
+        Task.objects.filter(name=FLAKY_TASK).update(
+            status=Task.RUNNING,
+            attempts=1,
+            run_after=timezone.now() + timedelta(seconds=TASK_LEASE),
+        )
+        self.assertEqual(run_due_tasks(), 0)
+
+        Task.objects.filter(name=FLAKY_TASK).update(run_after=timezone.now())
+        self.assertEqual(run_due_tasks(), 1)
+        self.assertEqual(Task.objects.get(name=FLAKY_TASK).status, Task.DONE)
+
+    def test_inline_queue(self):
+        with override_settings(MINI_FB_TASK_QUEUE="inline"):
+            with self.captureOnCommitCallbacks(execute=True):
+                Task.enqueue(FLAKY_TASK, 0)
+        self.assertEqual(flaky_calls, [0])
+        self.assertFalse(Task.objects.filter(name=FLAKY_TASK).exists())
+
+    def test_delayed_task(self):
+        Task.enqueue(FLAKY_TASK, 0, delay=60)
+        self.assertEqual(run_due_tasks(), 0)
+        Task.objects.filter(name=FLAKY_TASK).update(run_after=timezone.now())
+        self.assertEqual(run_due_tasks(), 1)
+
+    def test_purge_finished_tasks(self):
+        Task.enqueue(FLAKY_TASK, 0)
+        Task.enqueue(FLAKY_TASK, 10, max_attempts=1)
+        with self.assertLogs("mini_fb.worker", "ERROR"):
+            run_due_tasks()
+        self.assertEqual(purge_finished_tasks(), 0)
+
+        Task.objects.update(finished=timezone.now() - timedelta(days=8))
+        purge_finished_tasks()
+        # the failed task is kept
+        self.assertEqual(
+            list(Task.objects.values_list("status", flat=True)), ["failed"]
+        )
+
+
+@override_settings(MINI_FB_TASK_QUEUE="database")
+class RunTasksCommandTest(TransactionTestCase):
+    """
+    The run_tasks workers run the committed tasks on their own connections
+    """
+
+    def setUp(self):
+        flaky_calls.clear()
+
+    def test_run_tasks_command(self):
+        Task.enqueue(FLAKY_TASK, 0)
+        call_command("run_tasks", once=True, workers=2, stdout=io.StringIO())
+        self.assertEqual(flaky_calls, [0])
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+
+    def test_sigterm_stops_after_running_task(self):
+        Task.enqueue("mini_fb.tests.terminate_task")
+        Task.enqueue(FLAKY_TASK, 0)
+        # returns once the first task has run, with the second one left queued
+        call_command("run_tasks", workers=1, poll_interval=0.1, stdout=io.StringIO())
+        statuses = dict(Task.objects.values_list("name", "status"))
+        self.assertEqual(statuses["mini_fb.tests.terminate_task"], Task.DONE)
+        self.assertEqual(statuses[FLAKY_TASK], Task.QUEUED)
+        self.assertEqual(flaky_calls, [])
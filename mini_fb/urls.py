@@ -1,15 +1,26 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 from django.contrib.auth import views as auth_views
 
 app_name = "mini_fb"
 
+# the read-heavy pages have async views for ASGI deployments, see cs412/asgi.py
+if settings.MINI_FB_ASYNC_VIEWS:
+    ShowAllProfilesView = async_views.AsyncShowAllProfilesView
+    ShowProfileForUser = async_views.AsyncShowProfileForUser
+    ShowProfilePageView = async_views.AsyncShowProfilePageView
+    ShowNewsFeedView = async_views.AsyncShowNewsFeedView
+else:
+    ShowAllProfilesView = views.ShowAllProfilesView
+    ShowProfileForUser = views.ShowProfileForUser
+    ShowProfilePageView = views.ShowProfilePageView
+    ShowNewsFeedView = views.ShowNewsFeedView
+
 urlpatterns = [
-    path(r"", views.ShowAllProfilesView.as_view(), name="show_all_profiles_view"),
-    path(r"profile/", views.ShowProfileForUser.as_view(), name="show_profile_for_user"),
-    path(
-        r"profile/<int:pk>/", views.ShowProfilePageView.as_view(), name="show_profile"
-    ),
+    path(r"", ShowAllProfilesView.as_view(), name="show_all_profiles_view"),
+    path(r"profile/", ShowProfileForUser.as_view(), name="show_profile_for_user"),
+    path(r"profile/<int:pk>/", ShowProfilePageView.as_view(), name="show_profile"),
     path(r"create_profile/", views.CreateProfileView.as_view(), name="create_profile"),
     path(
         r"profile/create_status/",
@@ -43,9 +54,15 @@ urlpatterns = [
     ),
     path(
         r"profile/news_feed/",
-        views.ShowNewsFeedView.as_view(),
+        ShowNewsFeedView.as_view(),
         name="show_newsfeed",
     ),
+    path(
+        r"profile/export/",
+        views.ExportProfileView.as_view(),
+        name="export_profile",
+    ),
+    path(r"search/", views.SearchView.as_view(), name="search"),
     # authentication URLs
     path(
         r"login/",
@@ -1,28 +1,59 @@
 from typing import Any
 from django.db.models.base import Model as Model
-from django.db.models.query import QuerySet
 from django.forms import BaseModelForm
-from django.http import HttpRequest, HttpResponse
+from django.http import (
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.views.generic import (
     ListView,
     DetailView,
     CreateView,
     UpdateView,
     DeleteView,
+    TemplateView,
     View,
 )
-from .models import Profile, StatusMessage, Image
+from .models import Profile, StatusMessage, Image, Task
 from .forms import CreateProfileForm, CreateStatusMessageForm, UpdateProfileForm
+from .deletion import delete_status_messages
+from .export import EXPORT_FORMATS, export_profile
+from .caching import get_directory_version, get_news_feed_version, get_profile_version
+from .images import schedule_variants
+from .pagination import paginate_by_id, paginate_by_timestamp
+from .search import search_profiles, search_status_messages
 from django.urls import reverse
 from django.shortcuts import redirect
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 
 
 from django.contrib.auth.models import User
+from cs412.streaming import streaming_content
 
 
 # Create your views here.
+class UserProfileMixin:
+    """
+    A mixin for the views that act on the profile of the logged-in user
+    """
+
+    def get_object(self, queryset=None):
+        """
+        return the profile of the logged-in user, resolved once per request
+        by ProfileMiddleware
+        """
+        # request.profile is a lazy object, falsy when the user has no profile
+        profile = self.request.profile
+        if not profile:
+            raise Http404("There is no profile for this user.")
+        return profile
+
+
 class ShowAllProfilesView(ListView):
     """
     A view class to display all profiles stored in the Profile model
@@ -37,8 +68,46 @@ class ShowAllProfilesView(ListView):
     # the name of the object manager that store all profiles
     context_object_name = "profiles"
 
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        """
+        provide one page of profiles and the cursor of the next page to the template
+        """
+        context = super().get_context_data(**kwargs)
+
+        # the page is fetched by the template only if its fragment is not cached
+        context["profiles"] = paginate_by_id(
+            self.object_list, self.request.GET.get("after")
+        )
+        context["cache_version"] = get_directory_version()
+
+        return context
+
+
+class ProfileStatusMessagesMixin:
+    """
+    A mixin for the profile page views that provides one page of the
+    profile's status messages and the cursor of the next page
+    """
+
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        """
+        add the current page of status messages to the context
+        """
+        context = super().get_context_data(**kwargs)
+
+        # prefetch the images of the whole page and their variants in two queries,
+        # the page is fetched by the template only if its fragment is not cached
+        context["status_messages"] = paginate_by_timestamp(
+            self.object.get_status_messages().prefetch_related("images__variants"),
+            self.request.GET.get("after"),
+        )
+        context["cache_version"] = get_profile_version(self.object)
+        context["is_owner"] = self.object.user_id == self.request.user.pk
+
+        return context
+
 
-class ShowProfilePageView(DetailView):
+class ShowProfilePageView(ProfileStatusMessagesMixin, DetailView):
     """
     A view class to display a single profile page
     """
@@ -50,7 +119,7 @@ class ShowProfilePageView(DetailView):
     context_object_name = "profile"
 
 
-class ShowProfileForUser(DetailView):
+class ShowProfileForUser(UserProfileMixin, ProfileStatusMessagesMixin, DetailView):
     """
     A view class to display the profile page for the current user
     """
@@ -61,13 +130,6 @@ class ShowProfileForUser(DetailView):
 
     context_object_name = "profile"
 
-    def get_object(self, queryset=None):
-        # Fetch the profile based on the logged-in user
-        # to resolve the problem where multiple existing profiles are connected to the test user
-        # use filter instead of get, then return only 1 profile
-        profile = Profile.objects.filter(user=self.request.user)[0]
-        return profile
-
 
 class CreateProfileView(CreateView):
     """
@@ -144,26 +206,38 @@ class CreateStatusMessageView(LoginRequiredMixin, CreateView):
         #    raise PermissionDenied("You are not the profile owner.")
 
         # Attach the StatusMessage instance created by the form to the profile
-        profile = Profile.objects.get(user=self.request.user)
-        form.instance.profile = profile
-
-        # Save the StatusMessage to the db
-        sm = form.save()
+        form.instance.profile = self.request.profile
 
         # Read the files from the form
         files = self.request.FILES.getlist("files")
 
-        # for each file, create an Image object and save it
-        for f in files:
-            # create a new Image object
-            img = Image()
-            img.image_file = f  # assign the uploaded file
-            img.status_message = sm
-            img.save()  # save to db
-            print(
-                f"CreateStatusMessageView.form_valid(): Saved image: {img.image_file}"
+        # the message, its images and the profile's counters are saved together
+        with transaction.atomic():
+            # Save the StatusMessage to the db
+            sm = form.save()
+
+            # push the new StatusMessage into the news feeds of the profile and its
+            # friends, in the background
+            Task.enqueue(
+                "mini_fb.tasks.fan_out_status_message",
+                sm.pk,
+                key=f"fan_out:{sm.pk}:{sm.timestamp.isoformat()}",
             )
 
+            # for each file, create an Image object and save it
+            for f in files:
+                # create a new Image object
+                img = Image()
+                img.image_file = f  # assign the uploaded file
+                img.status_message = sm
+                img.save()  # save to db
+                print(
+                    f"CreateStatusMessageView.form_valid(): Saved image: {img.image_file}"
+                )
+
+                # the downscaled variants are generated in the background
+                schedule_variants(img)
+
         return super().form_valid(form)
 
     def form_invalid(self, form):
@@ -194,16 +268,14 @@ class CreateStatusMessageView(LoginRequiredMixin, CreateView):
         # find the Profile identifies by the PK specified by the URL pattern
         # profile = Profile.objects.get(pk=self.kwargs["pk"])
 
-        profile = Profile.objects.filter(user=self.request.user)[0]
-
-        # add the Profile into the context
-        context["profile"] = profile
+        # add the Profile of the current user into the context
+        context["profile"] = self.request.profile
 
         # return the context to be used by the template
         return context
 
 
-class UpdateProfileView(LoginRequiredMixin, UpdateView):
+class UpdateProfileView(LoginRequiredMixin, UserProfileMixin, UpdateView):
     """
     A view to update a Profile and save it to database
     """
@@ -244,24 +316,12 @@ class UpdateProfileView(LoginRequiredMixin, UpdateView):
         # find the Profile identifies by the PK specified by the URL pattern
         # profile = Profile.objects.get(pk=self.kwargs["pk"])
 
-        # get the profile associated with the current login user
-        user = self.request.user
-
-        profile = Profile.objects.get(user=user)
-
-        # add the Profile into the context
-        context["profile"] = profile
+        # add the Profile being updated, the one of the current user, into the context
+        context["profile"] = self.object
 
         # return the context to be used by the template
         return context
 
-    def get_object(self, queryset: QuerySet[Any] | None = ...) -> Model:
-        # get the profile associated with current user
-        # use filter to deal with the problem where the test user are associated with
-        # multiple profiles
-        profile = Profile.objects.filter(user=self.request.user)[0]
-        return profile
-
 
 class DeleteStatusMessageView(LoginRequiredMixin, DeleteView):
     """
@@ -278,6 +338,14 @@ class DeleteStatusMessageView(LoginRequiredMixin, DeleteView):
         """
         return reverse("mini_fb:login")
 
+    def form_valid(self, form):
+        """
+        delete the StatusMessage with its images in bulk statements, see deletion.py
+        """
+        success_url = self.get_success_url()
+        delete_status_messages([self.object.pk])
+        return HttpResponseRedirect(success_url)
+
     def get_success_url(self):
         # After successful deletion, redirect back to the Profile page
         profile_id = self.object.profile.id
@@ -300,6 +368,20 @@ class UpdateStatusMessageView(LoginRequiredMixin, UpdateView):
         """
         return reverse("mini_fb:login")
 
+    def form_valid(self, form):
+        """
+        save the updated StatusMessage and queue the refresh of its position
+        in the news feeds
+        """
+        with transaction.atomic():
+            response = super().form_valid(form)
+            Task.enqueue(
+                "mini_fb.tasks.fan_out_status_message",
+                self.object.pk,
+                key=f"fan_out:{self.object.pk}:{self.object.timestamp.isoformat()}",
+            )
+        return response
+
     def get_success_url(self):
         # After a successful update, redirect back to the Profile page
         profile_id = self.object.profile.id
@@ -320,7 +402,9 @@ class CreateFriendView(View):
         other_pk = self.kwargs["other_pk"]
 
         # get the profile associated with the current user
-        p1 = Profile.objects.filter(user=self.request.user)[0]
+        p1 = self.request.profile
+        if not p1:
+            return redirect(reverse("mini_fb:login"))
 
         # get the profiles using the pk
         # p1 = Profile.objects.get(pk=pk)
@@ -332,7 +416,7 @@ class CreateFriendView(View):
         return redirect(reverse("mini_fb:show_profile_for_user"))
 
 
-class ShowFriendSuggestionsView(LoginRequiredMixin, DetailView):
+class ShowFriendSuggestionsView(LoginRequiredMixin, UserProfileMixin, DetailView):
     """
     A view class to show friend suggestions
     """
@@ -356,15 +440,40 @@ class ShowFriendSuggestionsView(LoginRequiredMixin, DetailView):
 
         return context
 
-    def get_object(self, queryset: QuerySet[Any] | None = ...) -> Model:
-        # get the profile associated with current user
-        # use filter to deal with the problem where the test user are associated with
-        # multiple profiles
-        profile = Profile.objects.filter(user=self.request.user)[0]
-        return profile
 
+class ExportProfileView(LoginRequiredMixin, UserProfileMixin, View):
+    """
+    A view class to download everything the logged-in user's profile has put on
+    the site, as JSONL or as a ZIP archive with the image files
+    the export is streamed as it is generated, see export.py
+    """
+
+    def get_login_url(self) -> str:
+        """
+        return the URL of the login page
+        """
+        return reverse("mini_fb:login")
 
-class ShowNewsFeedView(LoginRequiredMixin, DetailView):
+    def get(self, request, *args, **kwargs):
+        """
+        return a streaming response with the export in the format asked for
+        """
+        profile = self.get_object()
+        export_format = request.GET.get("format", "zip")
+        if export_format not in EXPORT_FORMATS:
+            export_format = "zip"
+
+        response = StreamingHttpResponse(
+            streaming_content(request, export_profile(profile, export_format)),
+            content_type=EXPORT_FORMATS[export_format],
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="mini_fb_profile_{profile.pk}.{export_format}"'
+        )
+        return response
+
+
+class ShowNewsFeedView(LoginRequiredMixin, UserProfileMixin, DetailView):
     model = Profile
     template_name = "mini_fb/news_feed.html"
     context_object_name = "profile"
@@ -375,21 +484,50 @@ class ShowNewsFeedView(LoginRequiredMixin, DetailView):
         """
         return reverse("mini_fb:login")
 
-    def get_object(self, queryset: QuerySet[Any] | None = ...) -> Model:
-        # get the profile object associated with this current user
-        # use filter method to resolve the problem where the test user is associated with
-        # multiple profiles
-        profile = Profile.objects.filter(user=self.request.user)[0]
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        """
+        return a context dictionary to give newsfeed data to the template
+        """
+        context = super().get_context_data(**kwargs)
+
+        # get one page of the newsfeed for the current profile,
+        # prefetching the images of the whole page and their variants in two queries
+        context["news_feed"] = paginate_by_timestamp(
+            self.object.get_news_feed().prefetch_related("images__variants"),
+            self.request.GET.get("after"),
+            field="feed_timestamp",
+        )
+        context["cache_version"] = get_news_feed_version(self.object)
+
+        return context
 
-        return profile
+
+class SearchView(TemplateView):
+    """
+    A view class to search profiles by name or city and status messages by text
+    """
+
+    template_name = "mini_fb/search.html"
 
     def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
         """
-        return a context dictionary to give newsfeed data to the template
+        return a context dictionary with one page of the ranked results of the query
         """
         context = super().get_context_data(**kwargs)
 
-        # get newsfeed for the current profile
-        context["news_feed"] = self.object.get_news_feed()
+        query = self.request.GET.get("q", "").strip()
+        kind = self.request.GET.get("kind")
+        if kind != "status":
+            kind = "profiles"
+        try:
+            page = max(int(self.request.GET.get("page", 1)), 1)
+        except ValueError:
+            page = 1
+
+        context["query"] = query
+        context["kind"] = kind
+        if query:
+            search = search_profiles if kind == "profiles" else search_status_messages
+            context["results"] = search(query, page)
 
         return context
@@ -0,0 +1,218 @@
+"""
+The worker running the queued mini_fb Tasks, without any broker: the queue is
+the Task table of the project's database.
+
+A worker claims due tasks with a conditional UPDATE, so two workers never run
+the same task, and leases each claimed task for TASK_LEASE seconds: the task
+of a worker that died is due again once its lease runs out. A failing task is
+queued again after an exponential backoff with jitter, until it has been
+attempted max_attempts times. Finished tasks are kept TASK_RETENTION seconds,
+for their idempotency keys to drop repeated tasks, then purged.
+
+On SIGTERM, which process managers send before stopping a process, or on
+Ctrl-C, a worker stops claiming tasks and exits once the running ones finish.
+
+Start workers with the run_tasks command:
+
+    python manage.py run_tasks --workers 4
+    python manage.py run_tasks --pool process --workers 4
+    python manage.py run_tasks --once
+"""
+
+import logging
+import random
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.db import close_old_connections, connections
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# seconds a claimed task may run before another worker may claim it again
+TASK_LEASE = 10 * 60
+
+# seconds before the first retry of a failed task, doubled for each later one
+RETRY_BACKOFF = 5
+
+# longest wait between two attempts, in seconds
+MAX_RETRY_BACKOFF = 60 * 60
+
+# seconds finished tasks are kept before they are purged
+TASK_RETENTION = 7 * 24 * 60 * 60
+
+
+def retry_delay(attempts):
+    """
+    return the seconds to wait before attempting a task again after its
+    attempts-th failure, with jitter so failed tasks do not retry in step
+    """
+    delay = min(RETRY_BACKOFF * 2 ** (attempts - 1), MAX_RETRY_BACKOFF)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def claim_tasks(limit):
+    """
+    lease up to limit due tasks to this worker
+    return their pks
+    """
+    now = timezone.now()
+    due = Task.objects.filter(
+        status__in=[Task.QUEUED, Task.RUNNING], run_after__lte=now
+    ).order_by("run_after", "pk")
+
+    claimed = []
+    for pk, status, run_after in due.values_list("pk", "status", "run_after")[
+        : limit * 2
+    ]:
+        # another worker may have claimed the task since it was read
+        if Task.objects.filter(pk=pk, status=status, run_after=run_after).update(
+            status=Task.RUNNING,
+            run_after=now + timedelta(seconds=TASK_LEASE),
+            attempts=F("attempts") + 1,
+        ):
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def execute_task(task_pk):
+    """
+    run a claimed task and record its outcome
+    return True if it succeeded
+    """
+    task = Task.objects.get(pk=task_pk)
+    try:
+        import_string(task.name)(*task.args)
+    except Exception:
+        error = traceback.format_exc()
+        if task.attempts >= task.max_attempts:
+            logger.error("task %s failed for good:\n%s", task, error)
+            status, run_after = Task.FAILED, task.run_after
+        else:
+            logger.warning("task %s failed, will retry:\n%s", task, error)
+            status = Task.QUEUED
+            run_after = timezone.now() + timedelta(seconds=retry_delay(task.attempts))
+        Task.objects.filter(pk=task.pk).update(
+            status=status, run_after=run_after, last_error=error
+        )
+        return False
+
+    Task.objects.filter(pk=task.pk).update(
+        status=Task.DONE, finished=timezone.now(), last_error=""
+    )
+    return True
+
+
+def _execute_in_worker(task_pk):
+    """
+    run a task in a pool worker, which keeps its own database connection
+    """
+    try:
+        return execute_task(task_pk)
+    finally:
+        close_old_connections()
+
+
+def purge_finished_tasks():
+    """
+    delete the tasks that succeeded more than TASK_RETENTION seconds ago,
+    keeping the failed ones for inspection until their key is queued again
+    return the number of tasks deleted
+    """
+    cutoff = timezone.now() - timedelta(seconds=TASK_RETENTION)
+    deleted, _ = Task.objects.filter(status=Task.DONE, finished__lt=cutoff).delete()
+    return deleted
+
+
+def _init_pool_process():
+    """
+    set up a pool process, leaving the shutdown signals to the worker process,
+    which lets the running tasks finish
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    django.setup()
+
+
+def run_due_tasks():
+    """
+    run the due tasks one after the other in this thread, until none is due
+    return the number of tasks run
+    """
+    count = 0
+    while pks := claim_tasks(1):
+        execute_task(pks[0])
+        count += 1
+    return count
+
+
+def run_worker(workers=4, pool="thread", poll_interval=1.0, once=False):
+    """
+    run the due tasks on a pool of worker threads or processes, polling the
+    queue every poll_interval seconds when it is empty
+    with once, return when no task is due any more
+    return the number of tasks run
+    """
+    if pool == "process":
+        # the processes must not share the connections of this one
+        connections.close_all()
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_pool_process
+        )
+    else:
+        executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="mini_fb-tasks"
+        )
+
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        logger.info("stopping once the running tasks finish")
+        stopping.set()
+
+    # signal handlers can only be installed by the main thread
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            previous_handlers[signum] = signal.signal(signum, stop)
+
+    count = 0
+    running = set()
+    purged_at = None
+    try:
+        with executor:
+            while True:
+                # once an hour is often enough for what is kept a week
+                if purged_at is None or time.monotonic() - purged_at > 60 * 60:
+                    purge_finished_tasks()
+                    purged_at = time.monotonic()
+
+                if len(running) < workers and not stopping.is_set():
+                    for pk in claim_tasks(workers - len(running)):
+                        running.add(executor.submit(_execute_in_worker, pk))
+
+                if not running:
+                    if once or stopping.is_set():
+                        break
+                    stopping.wait(poll_interval)
+                    continue
+
+                done, running = wait(
+                    running, timeout=poll_interval, return_when="FIRST_COMPLETED"
+                )
+                count += len(done)
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+    return count
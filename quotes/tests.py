@@ -1,3 +1,24 @@
+import time
+
 from django.test import TestCase
+from django.urls import reverse
+
+from .views import images, quotes
+
 
 # Create your tests here.
+class QuotePageTest(TestCase):
+    """
+    The quote page is one of its renderings ahead of time, with the current time
+    """
+
+    def test_quote_page(self):
+        response = self.client.get(reverse("quotes:quote"))
+        content = response.content.decode()
+
+        self.assertTrue(any(image.replace("&", "&amp;") in content for image in images))
+        self.assertTrue(
+            any(quote.replace("'", "&#x27;") in content for quote in quotes)
+        )
+        self.assertIn(f"Page is generated at: {time.ctime()[:4]}", content)
+        self.assertNotIn("__PRERENDERED", content)
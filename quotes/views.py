@@ -1,6 +1,4 @@
-from django.shortcuts import render
-import random
-import time
+from cs412.prerender import PrerenderedPage
 
 #  List of my fav quotes
 quotes = [
@@ -21,24 +19,33 @@ images = [
 ]
 
 
+# Every page is rendered ahead of time, see cs412/prerender.py
+# one rendering for each quote and image pair
+quote_page = PrerenderedPage(
+    "quotes/quote.html",
+    [{"quote": text, "image": image} for text in quotes for image in images],
+)
+show_all_page = PrerenderedPage(
+    "quotes/show_all.html", [{"quotes": quotes, "images": images}]
+)
+about_page = PrerenderedPage(
+    "quotes/about.html",
+    [
+        {
+            "bio": "Barack Hussein Obama II (born August 4, 1961) is an American politician who served as the 44th president of the United States from 2009 to 2017.",
+        }
+    ],
+)
+
+
 def quote(request):
     """
     A view function to display one random quote and image
     This function view handles requests to the main page / and /quote
     """
 
-    # Randomly select a quote and an image
-    selected_quote = random.choice(quotes)
-    selected_image = random.choice(images)
-
-    # Pass the selected quote and image as context data to the template
-    context = {
-        "quote": selected_quote,
-        "image": selected_image,
-        "current_time": time.ctime(),
-    }
-
-    return render(request, "quotes/quote.html", context)
+    # Pick the rendering of a random quote and image, with the current time
+    return quote_page.response(request)
 
 
 def show_all(request):
@@ -46,14 +53,7 @@ def show_all(request):
     A function view to display all quotes and images
     This function view responds to requests to /show_all
     """
-    # Pass the list of quotes and images as context to template
-    context = {
-        "quotes": quotes,
-        "images": images,
-        "current_time": time.ctime(),
-    }
-
-    return render(request, "quotes/show_all.html", context)
+    return show_all_page.response(request)
 
 
 def about(request):
@@ -61,9 +61,4 @@ def about(request):
     View to display information about the famous person and the app creator.
     This view handles requests to /about.
     """
-    # Pass a brief biography of the famous person as context data.
-    context = {
-        "current_time": time.ctime(),
-        "bio": "Barack Hussein Obama II (born August 4, 1961) is an American politician who served as the 44th president of the United States from 2009 to 2017.",
-    }
-    return render(request, "quotes/about.html", context)
+    return about_page.response(request)
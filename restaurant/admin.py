@@ -1,3 +1,14 @@
 from django.contrib import admin
+from .models import Order, OrderItem
+
 
 # Register your models here.
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ["reference", "customer_name", "total_price", "created"]
+    inlines = [OrderItemInline]
@@ -0,0 +1,72 @@
+"""
+Report the restaurant orders of the last minutes: orders and revenue per
+minute, totals, and the best-selling items, all aggregated in SQL:
+
+    python manage.py order_report --minutes 60
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Max, Sum
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+
+from restaurant.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = "Report order throughput and revenue of the last minutes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--minutes", type=int, default=60, help="length of the reported window"
+        )
+        parser.add_argument(
+            "--top", type=int, default=10, help="number of best-selling items shown"
+        )
+
+    def handle(self, *args, **options):
+        minutes = options["minutes"]
+        since = timezone.now() - timedelta(minutes=minutes)
+        orders = Order.objects.filter(created__gte=since)
+
+        totals = orders.aggregate(
+            orders=Count("id"),
+            revenue=Sum("total_price"),
+            average=Avg("total_price"),
+            largest=Max("total_price"),
+        )
+        self.stdout.write(
+            f"last {minutes} minutes: {totals['orders']} orders, "
+            f"{totals['orders'] / minutes:.2f} orders/minute, "
+            f"revenue ${totals['revenue'] or 0}, "
+            f"average ${round(totals['average'] or 0, 2)}, "
+            f"largest ${totals['largest'] or 0}"
+        )
+
+        self.stdout.write("\nper minute:")
+        per_minute = (
+            orders.annotate(minute=TruncMinute("created"))
+            .values("minute")
+            .annotate(orders=Count("id"), revenue=Sum("total_price"))
+            .order_by("minute")
+        )
+        for row in per_minute:
+            self.stdout.write(
+                f"  {timezone.localtime(row['minute']):%Y-%m-%d %H:%M}  "
+                f"{row['orders']:>5} orders  ${row['revenue']}"
+            )
+
+        self.stdout.write("\nbest-selling items:")
+        items = (
+            OrderItem.objects.filter(order__created__gte=since)
+            .values("kind", "name")
+            .annotate(sold=Count("id"), revenue=Sum("price"))
+            .order_by("-revenue", "name")[: options["top"]]
+        )
+        for row in items:
+            self.stdout.write(
+                f"  {row['name']:<40} {row['kind']:<8} "
+                f"{row['sold']:>5} sold  ${row['revenue']}"
+            )
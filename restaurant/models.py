@@ -1,3 +1,53 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
+
 
 # Create your models here.
+class Order(models.Model):
+    """
+    Model to represent an order placed on the order page
+    orders are written in batches, see orders.py
+    """
+
+    # the order number shown to the customer, known before the order is stored
+    reference = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+    ready_time = models.DateTimeField()
+
+    customer_name = models.CharField(max_length=100)
+    customer_phone = models.CharField(max_length=30)
+    customer_email = models.EmailField()
+    special_instructions = models.TextField(blank=True)
+
+    total_price = models.DecimalField(max_digits=8, decimal_places=2)
+
+    def __str__(self):
+        """
+        Return the string representation of the order
+        """
+        return f"Order {self.reference} by {self.customer_name}"
+
+
+class OrderItem(models.Model):
+    """
+    Model to represent a dish, topping or daily special of an Order
+    """
+
+    DISH = "dish"
+    TOPPING = "topping"
+    SPECIAL = "special"
+    KINDS = [(DISH, "Dish"), (TOPPING, "Topping"), (SPECIAL, "Daily special")]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
+    kind = models.CharField(max_length=10, choices=KINDS)
+    name = models.CharField(max_length=100)
+    # the price when the order was placed
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+
+    def __str__(self):
+        """
+        Return the string representation of the order item
+        """
+        return f"{self.name} (${self.price})"
@@ -0,0 +1,180 @@
+"""
+Write-behind storage of restaurant orders.
+
+The confirmation view does not wait for the database: it hands each order to
+the process's OrderWriter, which stores the waiting orders of all requests
+together, with bulk_create, once RESTAURANT_ORDER_BATCH_SIZE orders are
+waiting or RESTAURANT_ORDER_FLUSH_INTERVAL seconds have passed, and when the
+process exits. Orders still waiting are lost if the process is killed.
+
+When a batch fails, its orders are stored one at a time, so one bad order does
+not hold back the others. An order that still fails is queued again, and
+logged and dropped after RESTAURANT_ORDER_MAX_ATTEMPTS failed flushes.
+"""
+
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+# the writer of this process, created on first use
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def write_orders(batch):
+    """
+    store a list of (Order, [OrderItem]) pairs in one transaction
+    """
+    orders = [order for order, items in batch]
+    with transaction.atomic():
+        Order.objects.bulk_create(orders)
+
+        # bulk_create does not return pks on every backend, so look them up
+        if any(order.pk is None for order in orders):
+            pks = dict(
+                Order.objects.filter(
+                    reference__in=[order.reference for order in orders]
+                ).values_list("reference", "pk")
+            )
+            for order in orders:
+                order.pk = pks[order.reference]
+
+        items = []
+        for order, order_items in batch:
+            for item in order_items:
+                item.order = order
+                items.append(item)
+        OrderItem.objects.bulk_create(items)
+
+
+class OrderWriter:
+    """
+    A background thread storing the orders handed to it in batches
+    """
+
+    def __init__(self, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        # the number of failed flushes of each waiting order, by reference
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+
+    def add(self, order, items):
+        """
+        queue an order and its items, starting the thread on first use
+        """
+        with self.lock:
+            self.pending.append((order, items))
+            full = len(self.pending) >= self.batch_size
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="restaurant-orders", daemon=True
+                )
+                self.thread.start()
+                # store the orders still waiting when the worker shuts down
+                atexit.register(self.stop)
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        """
+        flush the queue every flush_interval seconds, or sooner when it is full
+        """
+        while not self.stopped:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                # the thread keeps its own database connection
+                close_old_connections()
+
+    def flush(self):
+        """
+        store the waiting orders
+        return the number of orders stored
+        """
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+
+        try:
+            write_orders(batch)
+        except Exception:
+            logger.exception("could not store %s orders together", len(batch))
+        else:
+            return len(batch)
+
+        # store the orders one at a time, to keep the bad ones from the others
+        stored = 0
+        retry = []
+        for order, items in batch:
+            try:
+                write_orders([(order, items)])
+            except Exception:
+                failures = self.failures.get(order.reference, 0) + 1
+                if failures < getattr(settings, "RESTAURANT_ORDER_MAX_ATTEMPTS", 5):
+                    self.failures[order.reference] = failures
+                    retry.append((order, items))
+                    continue
+                logger.exception(
+                    "dropping order %s after %s attempts: %r",
+                    order.reference,
+                    failures,
+                    {
+                        "customer_name": order.customer_name,
+                        "customer_phone": order.customer_phone,
+                        "customer_email": order.customer_email,
+                        "items": [item.name for item in items],
+                        "total_price": order.total_price,
+                    },
+                )
+            else:
+                stored += 1
+            self.failures.pop(order.reference, None)
+
+        if retry:
+            with self.lock:
+                self.pending[:0] = retry
+        return stored
+
+    def stop(self):
+        """
+        stop the thread and store what is left
+        """
+        self.stopped = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+        self.flush()
+
+
+def queue_order(order, items):
+    """
+    store an unsaved Order and its unsaved OrderItems, in the background
+    with RESTAURANT_ORDER_FLUSH_INTERVAL set to 0, store them right away instead
+    """
+    interval = getattr(settings, "RESTAURANT_ORDER_FLUSH_INTERVAL", 1.0)
+    if not interval:
+        write_orders([(order, items)])
+        return
+
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = OrderWriter(
+                getattr(settings, "RESTAURANT_ORDER_BATCH_SIZE", 100), interval
+            )
+    _writer.add(order, items)
@@ -1,3 +1,147 @@
-from django.test import TestCase
+import io
+import re
+
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Order, OrderItem
+from .orders import OrderWriter
+from .views import specials
+
 
 # Create your tests here.
+@override_settings(RESTAURANT_ORDER_FLUSH_INTERVAL=0)
+class OrderPageTest(TestCase):
+    """
+    The order page is rendered ahead of time for each daily special,
+    and its form still carries a working CSRF token
+    """
+
+    def test_daily_special_and_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(reverse("restaurant:order"))
+        content = response.content.decode()
+
+        self.assertTrue(any(name in content for name in specials))
+        self.assertNotIn("__PRERENDERED", content)
+
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', content)[1]
+        response = client.post(
+            reverse("restaurant:confirmation"),
+            {
+                "csrfmiddlewaretoken": token,
+                "items": ["Egg Rolls"],
+                "name": "Test",
+                "phone": "555-0100",
+                "email": "test@example.com",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Egg Rolls")
+
+
+@override_settings(RESTAURANT_ORDER_FLUSH_INTERVAL=0)
+class OrderStorageTest(TestCase):
+    """
+    Orders are stored with their items, in batches when written behind
+    """
+
+    def test_confirmation_stores_order(self):
+        response = self.client.post(
+            reverse("restaurant:confirmation"),
+            {
+                "items": ["Egg Rolls", "Unknown Dish"],
+                "extras": ["Tendon"],
+                "daily_special": "Sate Beef Udon",
+                "name": "Test",
+                "phone": "555-0100",
+                "email": "test@example.com",
+            },
+        )
+        order = Order.objects.get()
+        self.assertContains(response, str(order.reference))
+        self.assertEqual(order.total_price, 6 + 3 + 16)
+        self.assertEqual(
+            sorted(order.items.values_list("kind", "name")),
+            [
+                (OrderItem.DISH, "Egg Rolls"),
+                (OrderItem.SPECIAL, "Sate Beef Udon"),
+                (OrderItem.TOPPING, "Tendon"),
+            ],
+        )
+
+    def test_confirmation_rejects_invalid_order(self):
+        response = self.client.post(
+            reverse("restaurant:confirmation"),
+            {
+                "items": ["Egg Rolls"],
+                "name": "x" * 101,
+                "phone": "555-0100",
+                "email": "not an email",
+            },
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, "customer_name", status_code=400)
+        self.assertContains(response, "customer_email", status_code=400)
+        self.assertFalse(Order.objects.exists())
+
+    def add_orders(self, writer, count):
+        """
+        Queue count orders of one dish on the writer
+        """
+        for i in range(count):
+            order = Order(
+                ready_time=timezone.now(),
+                customer_name=f"Customer {i}",
+                customer_phone="555-0100",
+                customer_email="test@example.com",
+                total_price=8,
+            )
+            writer.pending.append(
+                (order, [OrderItem(kind=OrderItem.DISH, name="Wonton Soup", price=8)])
+            )
+
+    def test_writer_batches(self):
+        writer = OrderWriter(batch_size=100, flush_interval=60)
+        self.add_orders(writer, 3)
+
+        with self.assertNumQueries(4):  # one insert per model, in a savepoint
+            self.assertEqual(writer.flush(), 3)
+        self.assertEqual(OrderItem.objects.filter(order__isnull=False).count(), 3)
+        self.assertEqual(writer.flush(), 0)
+
+    @override_settings(RESTAURANT_ORDER_MAX_ATTEMPTS=2)
+    def test_writer_drops_failing_order(self):
+        writer = OrderWriter(batch_size=100, flush_interval=60)
+        self.add_orders(writer, 3)
+        # an order whose reference is taken can never be stored
+        bad = writer.pending[1][0]
+        Order.objects.create(
+            reference=bad.reference,
+            ready_time=timezone.now(),
+            customer_name="Taken",
+            customer_phone="555-0100",
+            customer_email="test@example.com",
+            total_price=0,
+        )
+
+        with self.assertLogs("restaurant.orders", "ERROR"):
+            self.assertEqual(writer.flush(), 2)
+        self.assertEqual(len(writer.pending), 1)
+        self.assertIs(writer.pending[0][0], bad)
+        self.assertEqual(Order.objects.count(), 3)
+
+        with self.assertLogs("restaurant.orders", "ERROR") as logs:
+            self.assertEqual(writer.flush(), 0)
+        self.assertIn(f"dropping order {bad.reference}", logs.output[-1])
+        self.assertEqual(writer.pending, [])
+        self.assertEqual(writer.failures, {})
+
+    def test_report(self):
+        self.test_confirmation_stores_order()
+        out = io.StringIO()
+        call_command("order_report", minutes=10, stdout=out)
+        self.assertIn("1 orders", out.getvalue())
+        self.assertIn("Sate Beef Udon", out.getvalue())
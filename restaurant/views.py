@@ -1,30 +1,38 @@
+from django.core.exceptions import ValidationError
+from django.http import HttpResponseBadRequest
 from django.shortcuts import render, redirect
+from django.utils import timezone
+from cs412.prerender import PrerenderedPage
+from .models import Order, OrderItem
+from .orders import queue_order
 import time, random
-from datetime import datetime, timedelta
+from datetime import timedelta
+
+# Context data for the main page (name, location, hours, photos)
+main_page = PrerenderedPage(
+    "restaurant/main.html",
+    [
+        {
+            "name": "Pho 89 Brockton",
+            "location": "708 Belmont St, Brockton, MA 02301",
+            "hours": ["Mon-Fri: 9:00am - 10:00pm", "Sat-Sun: 10:00am - 11:00pm"],
+            "photos": [
+                "https://www.enterprisenews.com/gcdn/authoring/authoring-images/2024/05/18/NENT/73749325007-05182024-mv-brockton-food-21.JPG?width=1200&disable=upscale&format=pjpg&auto=webp",
+                "https://s3-media0.fl.yelpcdn.com/bphoto/J75xZymFFmAeHDwMxcM8sw/o.jpg",
+                "https://www.dailynews.com/wp-content/uploads/2023/01/LDN-L-DINE-PHO-0113-01-03.jpg?w=525",
+            ],
+        }
+    ],
+)
 
 
 # Create your views here.
 def main(request):
     """
     A view function handling requests to /restaurant/main
-    render with template main.html
+    render with template main.html, rendered ahead of time (see cs412/prerender.py)
     """
-    template_name = "restaurant/main.html"
-
-    # Context data for the main page (name, location, hours, photos)
-    context = {
-        "current_time": time.ctime(),
-        "name": "Pho 89 Brockton",
-        "location": "708 Belmont St, Brockton, MA 02301",
-        "hours": ["Mon-Fri: 9:00am - 10:00pm", "Sat-Sun: 10:00am - 11:00pm"],
-        "photos": [
-            "https://www.enterprisenews.com/gcdn/authoring/authoring-images/2024/05/18/NENT/73749325007-05182024-mv-brockton-food-21.JPG?width=1200&disable=upscale&format=pjpg&auto=webp",
-            "https://s3-media0.fl.yelpcdn.com/bphoto/J75xZymFFmAeHDwMxcM8sw/o.jpg",
-            "https://www.dailynews.com/wp-content/uploads/2023/01/LDN-L-DINE-PHO-0113-01-03.jpg?w=525",
-        ],
-    }
-
-    return render(request, template_name, context)
+    return main_page.response(request)
 
 
 # Global variables to use in the order and submit view
@@ -48,29 +56,29 @@ toppings = {
 specials = {"Spring Rolls": 7, "Sate Beef Udon": 16, "Grilled Chicken Vemicelli": 15}
 
 
+# One rendering of the order page for each daily special
+order_page = PrerenderedPage(
+    "restaurant/order.html",
+    [
+        {
+            "dishes": dishes,
+            "toppings": toppings,
+            "daily_special": {"name": name, "price": price},
+        }
+        for name, price in specials.items()
+    ],
+)
+
+
 def order(request):
     """
     Handle requests to url endpoint /restaurant/order
     Render with template order.html
     Display the order page where customers can select pho noodle soup and other Vietnamese dishes.
-    Pass a random "daily special" item to the order.html template
+    Pass a random "daily special" item to the order.html template:
+    the page is rendered ahead of time for every daily special, and one is picked at random
     """
-    # Randomly select a daily special
-    daily_special_name = random.choice(list(specials.keys()))
-    daily_special_price = specials[daily_special_name]
-
-    # argument for the order.html template
-    context = {
-        "current_time": time.ctime(),
-        "dishes": dishes,
-        "toppings": toppings,
-        "daily_special": {
-            "name": daily_special_name,
-            "price": daily_special_price,
-        },
-    }
-
-    return render(request, "restaurant/order.html", context)
+    return order_page.response(request)
 
 
 def confirmation(request):
@@ -86,8 +94,6 @@ def confirmation(request):
     # Handle form submission
     if request.POST:
         # get selected items and toppings
-        print(request.POST)
-
         selected_items = request.POST.getlist("items")
         selected_toppings = request.POST.getlist("extras")
         selected_daily_special = request.POST.get("daily_special")
@@ -112,11 +118,44 @@ def confirmation(request):
             daily_special_price = specials.get(selected_daily_special, 0)
             total_price += daily_special_price
 
-            # Generate a random ready time (30-60 minutes from now)
-        ready_time = datetime.now() + timedelta(minutes=random.randint(30, 60))
+        # Generate a random ready time (30-60 minutes from now)
+        ready_time = timezone.localtime() + timedelta(minutes=random.randint(30, 60))
+
+        # Store the order and the known dishes, toppings and special in the background
+        order = Order(
+            ready_time=ready_time,
+            customer_name=customer_name or "",
+            customer_phone=customer_phone or "",
+            customer_email=customer_email or "",
+            special_instructions=special_instructions,
+            total_price=total_price,
+        )
+        # the order is stored later: reject what the database would refuse now
+        try:
+            order.full_clean(validate_unique=False)
+        except ValidationError as error:
+            return HttpResponseBadRequest(
+                "\n".join(
+                    f"{field}: {' '.join(messages)}"
+                    for field, messages in error.message_dict.items()
+                ),
+                content_type="text/plain",
+            )
+        items = [
+            OrderItem(kind=kind, name=name, price=prices[name])
+            for kind, names, prices in [
+                (OrderItem.DISH, selected_items, dishes),
+                (OrderItem.TOPPING, selected_toppings, toppings),
+                (OrderItem.SPECIAL, [selected_daily_special], specials),
+            ]
+            for name in names
+            if name in prices
+        ]
+        queue_order(order, items)
 
         # Context to pass to the confirmation page
         context = {
+            "order": order,
             "customer_name": customer_name,
             "customer_phone": customer_phone,
             "customer_email": customer_email,